@@ -0,0 +1,489 @@
+import argparse
+import csv
+import glob
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from itertools import chain
+from timetable_loader import DEFAULT_WORKERS, load_stores
+from timetable_cache import ParsedDataCache
+from timetable_query import Equals, Range
+from timetable_query_cache import QueryCache
+from timetable_keys import week_range
+from timetable_sqlite import SqliteBackend
+from timetable_store import FIELDS
+import timetable_scheduler_cli as cli
+
+
+# Dataset sizes: total rows and the number of CSV files they are spread over
+SIZES = {
+    "1k": (1000, 2),
+    "100k": (100000, 10),
+    "1m": (1000000, 40)
+}
+
+# Exports are timed on the first rows only, PDF rendering costs far more per row
+EXCEL_EXPORT_ROWS = 20000
+PDF_EXPORT_ROWS = 2000
+
+# Shortest run timed, calls faster than this are repeated within one run
+MIN_RUN_SECONDS = 0.1
+
+# A benchmark this many times slower than the baseline counts as a regression
+DEFAULT_THRESHOLD = 1.25
+
+# Bump whenever the generated data changes, so stored datasets are rebuilt
+GENERATOR_VERSION = 1
+
+CSV_HEADER = ["Id", "Name", "Description", "Activity_Dates", "Days", "Start", "End",
+              "Duration", "Location", "Size", "Staff", "Zone"]
+
+PROGRAMMES = ["DICT-DNDFC", "DICS-DNCSF", "BSCS-BCSF", "BIT-BITF", "DBM-DBMF", "MSCS-MCSF"]
+INTAKES = ["221", "222", "231", "232", "241"]
+STUDY_MODES = ["FT", "PT"]
+SUBJECTS = [
+    "Discrete Mathematics", "Network Defense", "Introduction to Programming",
+    "Computer Hacking Forensics Investigator", "Database Management Systems", "Operating Systems",
+    "Data Structures", "Software Engineering", "Web Development", "Cloud Computing",
+    "Machine Learning", "Computer Architecture", "Information Security", "Statistics",
+    "Mobile Applications", "Human Computer Interaction", "Project Management",
+    "Business Analytics", "Social Media Marketing", "Accounting Principles"
+]
+FIRST_NAMES = ["Kelvin", "Chin Ann", "Boon Leing", "Sook Liang", "Mei Ling", "Ahmad",
+               "Priya", "Wei Jie", "Siti", "Daniel", "Hui Min", "Rajesh"]
+LAST_NAMES = ["Wu", "Ong", "Tan", "Yee", "Lim", "Ismail", "Nair", "Chen", "Rahman", "Lee"]
+ZONES = {"A": "Marina", "B": "Marina", "C": "Jackson", "D": "Jackson", "LT": "Central"}
+CLASS_TYPES = [f"Lec{n:02d}" for n in range(1, 16)] + [f"Tut{n:02d}" for n in range(1, 11)] + \
+              [f"Lab{n:02d}" for n in range(1, 7)]
+# (start, end) of the teaching slots, a few without seconds as in real exports
+SLOTS = [("08:30:00", "11:30:00"), ("09:00", "11:00"), ("12:00:00", "15:00:00"),
+         ("13:00:00", "14:30:00"), ("15:30:00", "18:00:00"), ("19:00:00", "22:00:00")]
+PLANNED_SIZES = ["20", "30", "40", "60", "120"]
+FIRST_DATE = date(2021, 1, 4)
+DAYS_COVERED = 4 * 365
+
+
+def vocabulary(rng):
+    # Modules, lecturers and rooms shared by every generated file
+    modules = []
+    for subject in SUBJECTS:
+        code = "".join(word[0] for word in subject.split()).upper()
+        modules.append((code, f"SET {subject} ({code})"))
+    staff = sorted({f"{rng.choice(['', 'Dr '])}{first} {last}"
+                    for first in FIRST_NAMES for last in LAST_NAMES})
+    rooms = [(f"{block}{n:02d}", zone) for block, zone in ZONES.items() for n in range(1, 11)]
+    return modules, staff, rooms
+
+
+def duration_text(start, end):
+    start_hours, start_minutes = map(int, start.split(":")[:2])
+    end_hours, end_minutes = map(int, end.split(":")[:2])
+    minutes = (end_hours - start_hours) * 60 + end_minutes - start_minutes
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+
+def generate_csv(csv_filename, rows, rng, vocab, first_id=0):
+    # One timetable export in the layout parse_csv_row expects: the activity
+    # name in column 1 is cohort_intake_mode_module_classtype
+    modules, staff, rooms = vocab
+    with open(csv_filename, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(CSV_HEADER)
+        for row_id in range(first_id, first_id + rows):
+            code, description = rng.choice(modules)
+            room, zone = rng.choice(rooms)
+            start, end = rng.choice(SLOTS)
+            day = FIRST_DATE + timedelta(days=rng.randrange(DAYS_COVERED))
+            name = "_".join((rng.choice(PROGRAMMES), rng.choice(INTAKES), rng.choice(STUDY_MODES),
+                             code, rng.choice(CLASS_TYPES)))
+            writer.writerow([
+                row_id, name, description, day.strftime("%d/%m/%Y"), day.strftime("%A"),
+                start, end, duration_text(start, end), room, rng.choice(PLANNED_SIZES),
+                rng.choice(staff), zone
+            ])
+
+
+def generate_dataset(data_dir, rows, files, seed):
+    # Write 'rows' rows over 'files' CSV files, the same bytes for the same
+    # arguments. A dataset already in data_dir is reused when it matches.
+    spec = {"rows": rows, "files": files, "seed": seed, "version": GENERATOR_VERSION}
+    spec_filename = os.path.join(data_dir, "dataset.json")
+    csv_filepaths = [os.path.join(data_dir, f"timetable_{i:03d}.csv") for i in range(files)]
+    try:
+        with open(spec_filename) as spec_file:
+            if json.load(spec_file) == spec and all(map(os.path.exists, csv_filepaths)):
+                return csv_filepaths
+    except (OSError, ValueError):
+        pass
+
+    os.makedirs(data_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(data_dir, "timetable_*.csv")):
+        os.remove(stale)
+    rng = random.Random(seed)
+    vocab = vocabulary(rng)
+    first_id = 0
+    for i, csv_filename in enumerate(csv_filepaths):
+        file_rows = rows // files + (1 if i < rows % files else 0)
+        generate_csv(csv_filename, file_rows, rng, vocab, first_id)
+        first_id += file_rows
+    with open(spec_filename, 'w') as spec_file:
+        json.dump(spec, spec_file)
+    return csv_filepaths
+
+
+def measure(run, repeat):
+    # Seconds per call of run() for each of 'repeat' runs. Fast calls are
+    # looped until a run takes MIN_RUN_SECONDS, so timer noise stays small.
+    start = time.perf_counter()
+    run()
+    first = time.perf_counter() - start
+    number = max(1, math.ceil(MIN_RUN_SECONDS / first)) if first else 1000
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        timings.append((time.perf_counter() - start) / number)
+    return timings
+
+
+class Suite:
+    def __init__(self, csv_filepaths, repeat=3, workers=None, only=None):
+        self.csv_filepaths = csv_filepaths
+        self.repeat = repeat
+        self.workers = workers
+        # Benchmark name prefixes to run, e.g. ["search", "gui.load"], None runs all
+        self.only = only
+        self.results = {}
+        # Benchmarks whose SQLite or lazily loaded results differ from the in-memory ones
+        self.mismatches = []
+
+    def selected(self, name):
+        return not self.only or any(name.startswith(prefix) for prefix in self.only)
+
+    def bench(self, name, run, repeat=None):
+        if not self.selected(name):
+            return
+        timings = measure(run, repeat or self.repeat)
+        self.results[name] = {
+            "median": statistics.median(timings),
+            "min": min(timings),
+            "runs": len(timings)
+        }
+        print(f"{name:<24} {statistics.median(timings) * 1000:>12.3f} ms")
+
+    def skip(self, name, reason):
+        if self.selected(name):
+            print(f"{name:<24} {'skipped':>12}  ({reason})")
+
+    def check_same(self, name, expected, actual):
+        def values(rows):
+            return [tuple(row.get_item(field) for field in FIELDS) for row in rows]
+        if values(expected) != values(actual):
+            self.mismatches.append(name)
+            print(f"{name:<24} {'MISMATCH':>12}  (the results differ from the in-memory ones)")
+
+    def run(self):
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            self.run_parse(scratch_dir)
+            rows = self.run_cli(scratch_dir)
+            self.run_exports(rows, scratch_dir)
+            del rows
+            self.run_gui()
+        return self.results
+
+    def run_parse(self, scratch_dir):
+        paths, workers = self.csv_filepaths, self.workers
+        self.bench("parse.serial", lambda: load_stores(paths, workers=1))
+        self.bench("parse.parallel", lambda: load_stores(paths, workers))
+        self.bench("load.cli", lambda: cli.DataManager().load_files(paths, workers))
+        self.bench("load.lazy", lambda: cli.DataManager(lazy=True).load_files(paths, workers))
+
+        cache_dir = os.path.join(scratch_dir, "cache")
+        if self.selected("load.cached"):
+            # Fill the parse cache once, then time loads served from it
+            cli.DataManager(cache=ParsedDataCache(cache_dir)).load_files(paths, workers)
+        self.bench("load.cached",
+                   lambda: cli.DataManager(cache=ParsedDataCache(cache_dir)).load_files(paths, workers))
+
+    def run_cli(self, scratch_dir):
+        # Queries against one load, with a query cache that never keeps results
+        manager = cli.TimetableManager(query_cache=QueryCache(max_rows=0))
+        data_manager = manager.data_manager
+        data_manager.load_files(self.csv_filepaths, self.workers)
+        csv_filenames = list(data_manager.data_by_file)
+        rows = [row for data in data_manager.data_by_file.values() for row in data["timetable_data_list"]]
+        if not rows:
+            return rows
+
+        # Query values taken from the data, so every query has matches
+        sample = rows[len(rows) // 2]
+        lecturer = sample.get_item("Allocated_Staff_Name")
+        lecturer_surname = lecturer.split()[-1]
+        module_code = sample.get_item("Module_Code")
+        first_day = datetime.strptime(sample.get_item("Activity_Dates_Individual"), "%d/%m/%Y")
+        start_date = first_day.strftime("%d/%m/%Y")
+        end_date = (first_day + timedelta(days=30)).strftime("%d/%m/%Y")
+        week = week_range(first_day)
+
+        self.bench("search.exact", lambda: manager.binary_search_all(lecturer, "Allocated_Staff_Name"))
+        self.bench("search.substring", lambda: [
+            data_manager.list_schedules_by_lecturer_name(csv_filename, lecturer_surname)
+            for csv_filename in csv_filenames])
+        self.bench("search.scan", lambda: [
+            data_manager.substring_search(csv_filename, "Module_Code", module_code)
+            for csv_filename in csv_filenames])
+        self.bench("search.date_range", lambda: [
+            data_manager.list_schedules_by_date_range(csv_filename, start_date, end_date)
+            for csv_filename in csv_filenames])
+        self.bench("search.week", lambda: manager.schedules_between(*week))
+        self.bench("search.query", lambda: manager.compound_search([
+            Equals("Allocated_Staff_Name", lecturer),
+            Equals("Scheduled_Days", sample.get_item("Scheduled_Days")),
+            Range("start_minutes", 12 * 60, None)
+        ]))
+        self.bench("search.next_sessions", lambda: manager.next_sessions(
+            "Allocated_Staff_Name", lecturer, 10, now=first_day))
+
+        matches = manager.binary_search_all(lecturer, "Allocated_Staff_Name")
+        self.bench("sort.heap_sort", lambda: manager.heap_sort(list(matches)))
+        self.bench("sort.top_k", lambda: manager.top_k(rows, 100))
+
+        # Memory-mapped load followed by the first query, which only decodes the lecturer column
+        def lazy_first_query():
+            lazy_manager = cli.TimetableManager(query_cache=QueryCache(max_rows=0), lazy=True)
+            lazy_manager.data_manager.load_files(self.csv_filepaths, self.workers)
+            return lazy_manager.binary_search_all(lecturer, "Allocated_Staff_Name")
+        self.bench("lazy.first_query", lazy_first_query)
+        if self.selected("lazy.first_query"):
+            self.check_same("lazy.first_query", matches, lazy_first_query())
+
+        # The same queries against the SQLite backend, each checked against the
+        # in-memory results: (in-memory query, SQLite query)
+        predicates = [
+            Equals("Allocated_Staff_Name", lecturer),
+            Equals("Scheduled_Days", sample.get_item("Scheduled_Days")),
+            Range("start_minutes", 12 * 60, None)
+        ]
+        queries = {
+            "sqlite.search.exact": (
+                lambda: manager.binary_search_all(lecturer, "Allocated_Staff_Name"),
+                lambda: backend.binary_search_all(lecturer, "Allocated_Staff_Name")),
+            "sqlite.search.substring": (
+                lambda: chain.from_iterable(data_manager.list_schedules_by_lecturer_name(
+                    csv_filename, lecturer_surname) for csv_filename in csv_filenames),
+                lambda: chain.from_iterable(backend.list_schedules_by_lecturer_name(
+                    csv_filename, lecturer_surname) for csv_filename in csv_filenames)),
+            "sqlite.search.scan": (
+                lambda: chain.from_iterable(data_manager.substring_search(
+                    csv_filename, "Module_Code", module_code) for csv_filename in csv_filenames),
+                lambda: chain.from_iterable(backend.substring_search(
+                    csv_filename, "Module_Code", module_code) for csv_filename in csv_filenames)),
+            "sqlite.search.date_range": (
+                lambda: chain.from_iterable(data_manager.list_schedules_by_date_range(
+                    csv_filename, start_date, end_date) for csv_filename in csv_filenames),
+                lambda: chain.from_iterable(backend.list_schedules_by_date_range(
+                    csv_filename, start_date, end_date) for csv_filename in csv_filenames)),
+            "sqlite.search.week": (
+                lambda: manager.schedules_between(*week),
+                lambda: backend.schedules_between(*week)),
+            "sqlite.search.query": (
+                lambda: manager.compound_search(predicates),
+                lambda: backend.find(predicates)),
+            "sqlite.sort.top_k": (
+                lambda: manager.top_k(rows, 100),
+                lambda: backend.sorted_schedules(limit=100)),
+            # A full sort with many ties, which must keep the same tie order
+            "sqlite.sort.full": (
+                lambda: manager.sort_by_field(manager.binary_search_all(module_code, "Module_Code"),
+                                              "Scheduled_Days"),
+                lambda: backend.sorted_schedules([Equals("Module_Code", module_code)], "Scheduled_Days"))
+        }
+        if not any(self.selected(name) for name in ("sqlite.ingest", "sqlite.load", "sqlite.reload_order",
+                                                    *queries)):
+            return rows
+        backend = self.run_sqlite_load(scratch_dir)
+        for name, (in_memory, in_sqlite) in queries.items():
+            if self.selected(name):
+                self.bench(name, lambda in_sqlite=in_sqlite: list(in_sqlite()))
+                self.check_same(name, list(in_memory()), list(in_sqlite()))
+
+        # Reload the same database with the files in the opposite order: ties
+        # must follow the new order, as they do after a fresh in-memory load
+        if self.selected("sqlite.reload_order") and len(self.csv_filepaths) > 1:
+            reordered = self.csv_filepaths[::-1]
+            reordered_manager = cli.TimetableManager(query_cache=QueryCache(max_rows=0))
+            reordered_manager.data_manager.load_files(reordered, self.workers)
+            self.bench("sqlite.reload_order", lambda: backend.load_files(reordered, self.workers, replace=True))
+            self.check_same("sqlite.reload_order",
+                            list(reordered_manager.schedules_between(*week)) + list(reordered_manager.sort_by_field(
+                                reordered_manager.binary_search_all(module_code, "Module_Code"), "Scheduled_Days")),
+                            list(backend.schedules_between(*week)) + list(backend.sorted_schedules(
+                                [Equals("Module_Code", module_code)], "Scheduled_Days")))
+        backend.close()
+        return rows
+
+    def run_sqlite_load(self, scratch_dir):
+        # Time a fresh ingest into an empty database, then a load of the
+        # unchanged files, which are served from the database
+        db_path = os.path.join(scratch_dir, "timetable.sqlite3")
+        paths, workers = self.csv_filepaths, self.workers
+
+        def ingest():
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+            backend = SqliteBackend(db_path)
+            backend.load_files(paths, workers)
+            backend.close()
+        self.bench("sqlite.ingest", ingest)
+        if not os.path.exists(db_path):
+            ingest()
+        self.bench("sqlite.load", lambda: SqliteBackend(db_path).load_files(paths, workers))
+        backend = SqliteBackend(db_path, cli.TimetableData)
+        backend.load_files(paths, workers)
+        return backend
+
+    def run_exports(self, rows, scratch_dir):
+        def values(row):
+            return [row.get_item(field) for field in FIELDS]
+
+        try:
+            from timetable_export import write_excel, write_pdf
+        except ImportError as e:
+            self.skip("export.excel", e)
+            self.skip("export.pdf", e)
+            return
+
+        excel_rows = rows[:EXCEL_EXPORT_ROWS]
+        self.bench("export.excel", lambda: write_excel(
+            os.path.join(scratch_dir, "export.xlsx"), excel_rows, list(FIELDS), values))
+        pdf_rows = rows[:PDF_EXPORT_ROWS]
+        # Equal columns across the width of a landscape letter page inside the margins
+        col_widths = [648 / len(FIELDS)] * len(FIELDS)
+        self.bench("export.pdf", lambda: write_pdf(
+            os.path.join(scratch_dir, "export.pdf"), pdf_rows, list(FIELDS), values, col_widths))
+
+    def run_gui(self):
+        # The GUI's data model without a window: load, refresh, search, sort
+        # and autocomplete, as run by the Window's background jobs
+        try:
+            import timetable_scheduler_gui as gui
+        except ImportError as e:
+            self.skip("gui", e)
+            return
+
+        model = gui.DataManager(query_cache=QueryCache(max_rows=0))
+        self.bench("gui.load", lambda: gui.DataManager().timetable_manager.load_files(
+            self.csv_filepaths, self.workers))
+        model.timetable_manager.load_files(self.csv_filepaths, self.workers)
+
+        def refresh():
+            # A new mtime marks the first file as modified, so it is re-parsed
+            os.utime(self.csv_filepaths[0])
+            model.timetable_manager.refresh([os.path.dirname(self.csv_filepaths[0])], self.workers)
+        self.bench("gui.refresh", refresh)
+
+        rows = [row for data in model.timetable_manager.data_by_file.values()
+                for row in data["timetable_data_list"]]
+        if not rows:
+            return
+        lecturer = rows[len(rows) // 2].get_display_item("Lecturer")
+        self.bench("gui.search", lambda: model.search(lecturer, "Lecturer"))
+        matches = model.search(lecturer, "Lecturer")
+        self.bench("gui.sort", lambda: model.sort_results(
+            None, matches, "Scheduled Date", False, lambda row: (row.date_ordinal, row.start_minutes)))
+        trie = model.timetable_manager.suggestions["Lecturer"]
+        self.bench("gui.suggestions", lambda: trie.complete(lecturer[:2], 50))
+
+
+def compare(results, baseline, threshold):
+    # Print current against baseline medians, returns the names that regressed
+    regressions = []
+    print(f"\n{'benchmark':<24} {'baseline ms':>12} {'current ms':>12} {'ratio':>8}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<24} {'-':>12} {result['median'] * 1000:>12.3f} {'new':>8}")
+            continue
+        ratio = result["median"] / before["median"] if before["median"] else float("inf")
+        flag = "  slower" if ratio > threshold else ""
+        print(f"{name:<24} {before['median'] * 1000:>12.3f} {result['median'] * 1000:>12.3f} {ratio:>8.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time parsing, queries, sorting, exports and the GUI model on synthetic timetables.")
+    parser.add_argument("--size", choices=SIZES, default="100k", help="dataset size (default 100k)")
+    parser.add_argument("--rows", type=int, help="rows to generate, overrides --size")
+    parser.add_argument("--files", type=int, help="CSV files to spread the rows over, overrides --size")
+    parser.add_argument("--seed", type=int, default=1, help="generator seed (default 1)")
+    parser.add_argument("--data-dir", help="keep the generated CSV files here and reuse them on later runs")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the median is reported")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="parser processes")
+    parser.add_argument("--only", action="append", metavar="PREFIX",
+                        help="only run benchmarks starting with PREFIX, e.g. search or gui.load")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results JSON of an earlier run")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"slowdown ratio reported as a regression (default {DEFAULT_THRESHOLD})")
+    args = parser.parse_args()
+
+    rows, files = SIZES[args.size]
+    rows, files = args.rows or rows, args.files or files
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = args.data_dir or temp_dir
+        start = time.perf_counter()
+        csv_filepaths = generate_dataset(data_dir, rows, files, args.seed)
+        print(f"{rows} rows in {files} files ready in {time.perf_counter() - start:.1f} s\n")
+        suite = Suite(csv_filepaths, args.repeat, args.workers, args.only)
+        results = suite.run()
+
+    report = {
+        "meta": {
+            "rows": rows,
+            "files": files,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "workers": args.workers,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": datetime.now().isoformat(timespec="seconds")
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    status = 0
+    if suite.mismatches:
+        print(f"\nResults differ from the in-memory backend for: {', '.join(suite.mismatches)}")
+        status = 1
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["meta"]["rows"] != rows or baseline["meta"]["files"] != files:
+            print(f"Warning: the baseline was run on {baseline['meta']['rows']} rows "
+                  f"in {baseline['meta']['files']} files")
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmarks slower than the baseline: {', '.join(regressions)}")
+            return 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import pickle
+
+
+# Bump whenever TimetableStore or the index classes change shape, so old
+# cache files are ignored instead of unpickled into the wrong layout
+CACHE_SCHEMA_VERSION = 3
+
+DEFAULT_CACHE_DIR = os.environ.get("TIMETABLE_CACHE_DIR") or os.path.join(
+    os.path.expanduser("~"), ".cache", "timetable_scheduler")
+
+
+def file_signature(csv_filename):
+    # (size, mtime) of the file, taken before parsing so edits made while it
+    # is being parsed are never cached under the new signature
+    stat = os.stat(csv_filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def content_hash(csv_filename):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(csv_filename, 'rb') as csv_file:
+        for chunk in iter(lambda: csv_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# One cached CSV: the parsed store and, when they were saved, its indexes
+class CacheEntry:
+    def __init__(self, store, indexes=None):
+        self.store = store
+        self.indexes = indexes
+
+
+# On-disk cache of parsed CSV files, keyed by path, size, mtime and content hash.
+# Cache files are pickles, so the directory must only be writable by the user.
+class ParsedDataCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def cache_path(self, csv_filename):
+        name = hashlib.blake2b(os.path.abspath(csv_filename).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, name + ".pickle")
+
+    def read(self, csv_filename):
+        try:
+            with open(self.cache_path(csv_filename), 'rb') as cache_file:
+                cached = pickle.load(cache_file)
+        except Exception:
+            # Missing, truncated or unreadable cache files are all misses
+            return None
+        if not isinstance(cached, dict) or cached.get("schema") != CACHE_SCHEMA_VERSION:
+            return None
+        if cached.get("path") != os.path.abspath(csv_filename):
+            return None
+        return cached
+
+    def load(self, csv_filename, indexes_key=None):
+        # Return the CacheEntry for an unchanged file, or None on a miss
+        cached = self.read(csv_filename)
+        try:
+            signature = file_signature(csv_filename)
+        except OSError:
+            cached = None
+
+        if cached is not None and cached["signature"] != signature:
+            # Same size but a new mtime (e.g. touched or copied): compare contents
+            if cached["signature"][0] != signature[0] or cached["hash"] != content_hash(csv_filename):
+                cached = None
+            else:
+                cached["signature"] = signature
+                self.write(csv_filename, cached)
+
+        if cached is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        indexes = cached["indexes"] if cached["indexes_key"] == indexes_key else None
+        return CacheEntry(cached["store"], indexes)
+
+    def save(self, csv_filename, signature, store, indexes=None, indexes_key=None):
+        # Skip the save if the file changed since 'signature' was taken
+        try:
+            if file_signature(csv_filename) != signature:
+                return
+            cached = {
+                "schema": CACHE_SCHEMA_VERSION,
+                "path": os.path.abspath(csv_filename),
+                "signature": signature,
+                "hash": content_hash(csv_filename),
+                "store": store,
+                "indexes_key": indexes_key if indexes is not None else None,
+                "indexes": indexes
+            }
+        except OSError:
+            return
+        self.write(csv_filename, cached)
+
+    def write(self, csv_filename, cached):
+        # Write to a temporary file first so readers never see a partial pickle
+        cache_path = self.cache_path(csv_filename)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temp_path, 'wb') as cache_file:
+                pickle.dump(cached, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def invalidate(self, csv_filename):
+        try:
+            os.remove(self.cache_path(csv_filename))
+        except OSError:
+            pass
@@ -0,0 +1,96 @@
+import heapq
+from datetime import date
+from timetable_keys import INVALID_KEY
+
+
+# Raw fields identifying each kind of resource that cannot be double-booked
+RESOURCE_FIELDS = {
+    "Room": ("Allocated_Location_Name", "Zone_Name"),
+    "Lecturer": ("Allocated_Staff_Name",)
+}
+
+# Resource names shared by any number of sessions at once
+IGNORED_RESOURCES = {"", "Online Learning"}
+
+# Fields that, with the times, identify one activity, so a joint session listed
+# in several cohorts' CSV files is not reported as clashing with itself
+ACTIVITY_FIELDS = ("Module_Code", "Class_Type", "Allocated_Location_Name", "Allocated_Staff_Name")
+
+
+def format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+# Two sessions that use the same room or lecturer at overlapping times
+class Clash:
+    def __init__(self, kind, resource, date_ordinal, first, second):
+        self.kind = kind
+        self.resource = resource
+        self.date_ordinal = date_ordinal
+        self.first = first
+        self.second = second
+        self.overlap_start = max(first.start_minutes, second.start_minutes)
+        self.overlap_end = min(first.end_minutes, second.end_minutes)
+
+    def describe(self, timetable_data):
+        return (f"{timetable_data.get_item('Module_Code')} {timetable_data.get_item('Class_Type')} "
+                f"({timetable_data.get_item('Cohort')}) "
+                f"{format_minutes(timetable_data.start_minutes)}-{format_minutes(timetable_data.end_minutes)}")
+
+    def __str__(self):
+        return (f"{self.kind} {self.resource} on {date.fromordinal(self.date_ordinal).strftime('%d/%m/%Y')} "
+                f"{format_minutes(self.overlap_start)}-{format_minutes(self.overlap_end)}: "
+                f"{self.describe(self.first)} clashes with {self.describe(self.second)}")
+
+
+def resource_name(store, fields, row):
+    values = [store.columns[field][row] for field in fields]
+    if len(values) == 1:
+        return values[0]
+    return f"{values[0]} ({', '.join(values[1:])})"
+
+
+def group_sessions(data_by_file, kind):
+    # Bucket every valid session of every loaded file by (resource, date)
+    fields = RESOURCE_FIELDS[kind]
+    groups = {}
+    for data in data_by_file.values():
+        store = data["store"]
+        timetable_data_list = data["timetable_data_list"]
+        resources = store.columns[fields[0]]
+        for row in store.row_ids:
+            if resources[row] in IGNORED_RESOURCES:
+                continue
+            date_ordinal = store.date_ordinal[row]
+            start, end = store.start_minutes[row], store.end_minutes[row]
+            if INVALID_KEY in (date_ordinal, start, end) or end <= start:
+                continue
+            activity = (start, end) + tuple(store.columns[field][row] for field in ACTIVITY_FIELDS)
+            groups.setdefault((resource_name(store, fields, row), date_ordinal), []).append(
+                (start, end, activity, timetable_data_list[row]))
+    return groups
+
+
+def sweep(sessions):
+    # Sweep the sessions of one resource and day in start order, keeping a
+    # min-heap of the sessions still running. Every session left in the heap
+    # overlaps the next start, so the cost is O(n log n + clashes).
+    sessions.sort(key=lambda session: session[0])
+    running = []
+    for i, (start, end, activity, timetable_data) in enumerate(sessions):
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+        for _, j in running:
+            if sessions[j][2] != activity:
+                yield sessions[j][3], timetable_data
+        heapq.heappush(running, (end, i))
+
+
+def find_clashes(data_by_file, kinds=tuple(RESOURCE_FIELDS)):
+    # Every pair of overlapping sessions per room and per lecturer across all files
+    clashes = []
+    for kind in kinds:
+        for (resource, date_ordinal), sessions in sorted(group_sessions(data_by_file, kind).items()):
+            for first, second in sweep(sessions):
+                clashes.append(Clash(kind, resource, date_ordinal, first, second))
+    return clashes
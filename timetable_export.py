@@ -0,0 +1,205 @@
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+from openpyxl import Workbook
+from reportlab.lib.pagesizes import landscape, letter
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, PageBreak, Paragraph
+from timetable_loader import DEFAULT_WORKERS, OperationCancelled, check_cancelled
+from timetable_metrics import timed
+
+
+# Rows written between progress reports and cancel checks
+EXPORT_CHUNK_ROWS = 2000
+
+# Excel sheet titles are at most 31 characters and may not contain these
+MAX_TITLE_LENGTH = 31
+INVALID_TITLE_CHARS = set('[]:*?/\\')
+
+# Characters that cannot appear in file names on common platforms
+INVALID_FILENAME_CHARS = set('<>:"/\\|?*')
+MAX_FILENAME_LENGTH = 100
+
+# Rows per PDF table, one landscape letter page at the table's font size, and
+# the rows' worth of space taken by a group title. Tables that still come out
+# taller than a page split with the header row repeated.
+PDF_ROWS_PER_PAGE = 22
+PDF_TITLE_ROWS = 2
+
+PDF_TABLE_STYLE = [
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.lightblue),
+    ('GRID', (0, 0), (-1, -1), 1, colors.white),
+    ('FONTSIZE', (0, 0), (-1, -1), 6)
+]
+
+
+def unique_title(name, used_titles, invalid_chars, max_length):
+    # A cleaned-up 'name' that no earlier title in 'used_titles' has taken
+    title = "".join("_" if char in invalid_chars else char for char in name).strip("'. ")
+    title = title[:max_length] or "Blank"
+    base, n = title, 2
+    while title.lower() in used_titles:
+        suffix = f" ({n})"
+        title = base[:max_length - len(suffix)] + suffix
+        n += 1
+    used_titles.add(title.lower())
+    return title
+
+
+def sheet_title(name, used_titles):
+    return unique_title(name, used_titles, INVALID_TITLE_CHARS, MAX_TITLE_LENGTH)
+
+
+def file_title(name, used_titles):
+    return unique_title(name, used_titles, INVALID_FILENAME_CHARS, MAX_FILENAME_LENGTH)
+
+
+def group_sections(rows, values, group=None):
+    # Split the rows into (title, value rows) sections sorted by group(row),
+    # or a single untitled section. Plain tuples, so they pickle cheaply.
+    if group is None or not rows:
+        return [(None, [values(row) for row in rows])]
+    sections = {}
+    for row in rows:
+        sections.setdefault(group(row), []).append(values(row))
+    return sorted(sections.items())
+
+
+@timed("export.excel")
+def write_excel(excel_file, rows, headers, values, group=None, progress=None, cancelled=None):
+    # Stream the rows into a write-only workbook. Each appended row goes
+    # straight to the sheet's temporary file instead of staying in memory as
+    # cell objects, so peak memory does not grow with the number of rows.
+    # values(row) gives the cells of a row, group(row) names the sheet it goes
+    # on (None puts every row on one sheet) and progress(done, total) is called
+    # after every chunk.
+    wb = Workbook(write_only=True)
+    used_titles = set()
+    if group is None or not rows:
+        sheets = {None: wb.create_sheet("Timetable")}
+        group = None
+    else:
+        sheets = {name: wb.create_sheet(sheet_title(name, used_titles))
+                  for name in sorted({group(row) for row in rows})}
+    for ws in sheets.values():
+        ws.append(headers)
+
+    total = len(rows)
+    for start in range(0, total, EXPORT_CHUNK_ROWS):
+        check_cancelled(cancelled)
+        for i in range(start, min(start + EXPORT_CHUNK_ROWS, total)):
+            row = rows[i]
+            sheets[group(row) if group is not None else None].append(values(row))
+        if progress is not None:
+            progress(min(start + EXPORT_CHUNK_ROWS, total), total)
+
+    check_cancelled(cancelled)
+    wb.save(excel_file)
+
+
+def pdf_story(sections, headers, col_widths):
+    # One page-sized table per chunk of rows, each starting with the header
+    # row. Small tables keep reportlab's layout cost linear in the row count,
+    # where one huge table is split again and again and can fail outright.
+    heading_style = getSampleStyleSheet()["Heading2"]
+    story = []
+    for title, value_rows in sections:
+        if story:
+            story.append(PageBreak())
+        chunk_rows = PDF_ROWS_PER_PAGE
+        if title is not None:
+            story.append(Paragraph(escape(title), heading_style))
+            chunk_rows -= PDF_TITLE_ROWS
+        start = 0
+        while True:
+            table = Table([headers] + value_rows[start:start + chunk_rows],
+                          colWidths=col_widths, repeatRows=1)
+            table.setStyle(TableStyle(PDF_TABLE_STYLE))
+            story.append(table)
+            start += chunk_rows
+            if start >= len(value_rows):
+                break
+            story.append(PageBreak())
+            chunk_rows = PDF_ROWS_PER_PAGE
+    return story
+
+
+def build_pdf(pdf_file, sections, headers, col_widths):
+    doc = SimpleDocTemplate(pdf_file, pagesize=landscape(letter))
+    doc.build(pdf_story(sections, headers, col_widths))
+    return pdf_file
+
+
+@timed("export.pdf")
+def write_pdf(pdf_file, rows, headers, values, col_widths, group=None):
+    # One document, with each group (if any) starting on a new page under its title
+    build_pdf(pdf_file, group_sections(rows, values, group), headers, col_widths)
+
+
+def render_section(pdf_file, title, value_rows, headers, col_widths):
+    # Runs in a worker process, so it only takes plain picklable values
+    return build_pdf(pdf_file, [(title, value_rows)], headers, col_widths)
+
+
+def render_serially(jobs, on_done, cancelled=None):
+    for job in jobs:
+        check_cancelled(cancelled)
+        on_done(render_section(*job))
+
+
+def render_sections(jobs, workers=None, on_done=lambda pdf_file: None, cancelled=None):
+    # Render one document per job across a process pool, reportlab is pure
+    # Python so threads would serialise on the GIL
+    workers = min(workers or DEFAULT_WORKERS, len(jobs))
+    if workers <= 1:
+        return render_serially(jobs, on_done, cancelled)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(render_section, *job) for job in jobs]
+            for future in as_completed(futures):
+                if cancelled is not None and cancelled():
+                    for pending in futures:
+                        pending.cancel()
+                    raise OperationCancelled()
+                on_done(future.result())
+    except (OSError, NotImplementedError, BrokenProcessPool):
+        # Platforms without working multiprocessing fall back to serial rendering
+        render_serially(jobs, on_done, cancelled)
+
+
+@timed("export.pdf_archive")
+def write_pdf_archive(zip_file, rows, headers, values, col_widths, group,
+                      workers=None, progress=None, cancelled=None):
+    # One document per group, rendered in parallel and collected into a zip.
+    # progress(done, total) is called as each document finishes.
+    sections = group_sections(rows, values, group)
+    total = len(sections)
+    done = 0
+
+    def on_done(pdf_file):
+        nonlocal done
+        done += 1
+        if progress is not None:
+            progress(done, total)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        used_titles = set()
+        jobs = [(os.path.join(temp_dir, file_title(title or "Timetable", used_titles) + ".pdf"),
+                 title, value_rows, headers, col_widths)
+                for title, value_rows in sections]
+        render_sections(jobs, workers, on_done, cancelled)
+
+        check_cancelled(cancelled)
+        with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED) as archive:
+            for job in jobs:
+                archive.write(job[0], os.path.basename(job[0]))
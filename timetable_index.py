@@ -0,0 +1,248 @@
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from operator import itemgetter
+from timetable_keys import datetime_key
+
+
+def group_positions(values):
+    # Map each distinct value to the array of row positions holding it, in CSV order
+    groups = {}
+    for position, value in enumerate(values):
+        positions = groups.get(value)
+        if positions is None:
+            positions = groups[value] = array('i')
+        positions.append(position)
+    return groups
+
+
+# Dictionary whose entries are built the first time they are read, by
+# builders[key](key). Memory-mapped files use it so a query only builds the
+# indexes it touches.
+class LazyIndexes(dict):
+    def __init__(self, builders, **entries):
+        super().__init__(entries)
+        self.builders = builders
+
+    def __missing__(self, key):
+        builder = self.builders.get(key)
+        if builder is None:
+            raise KeyError(key)
+        value = self[key] = builder(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+# Sorted index over one field of a loaded file, used for exact-match lookups
+class SortedFieldIndex:
+    def __init__(self, values):
+        # Distinct values in sorted order, with the rows of keys[i] stored at
+        # positions[starts[i]:starts[i + 1]] so matches come back in CSV order
+        groups = group_positions(values)
+        self.keys = sorted(groups)
+        self.starts = array('i', [0])
+        self.positions = array('i')
+        for key in self.keys:
+            self.positions.extend(groups[key])
+            self.starts.append(len(self.positions))
+
+    def lookup(self, search_key):
+        # One bisect over the distinct values finds the range of equal rows: O(log n + k)
+        i = bisect_left(self.keys, search_key)
+        if i == len(self.keys) or self.keys[i] != search_key:
+            return []
+        return self.positions[self.starts[i]:self.starts[i + 1]]
+
+    def count(self, search_key):
+        # Number of rows equal to search_key, without copying their positions
+        i = bisect_left(self.keys, search_key)
+        if i == len(self.keys) or self.keys[i] != search_key:
+            return 0
+        return self.starts[i + 1] - self.starts[i]
+
+
+# Trigram inverted index over the distinct values of one field, used for substring queries
+class NgramIndex:
+    def __init__(self, values, n=3):
+        self.n = n
+        self.values = []            # Distinct field values
+        self.rows_by_value = []     # Row positions holding each distinct value
+        self.postings = {}          # n-gram -> ids of the distinct values containing it
+
+        for value_id, (value, positions) in enumerate(group_positions(values).items()):
+            self.values.append(value)
+            self.rows_by_value.append(positions)
+            for gram in self.grams(value):
+                self.postings.setdefault(gram, []).append(value_id)
+
+    def grams(self, text):
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def candidates(self, term):
+        # Queries shorter than n have no grams, so every distinct value is a candidate
+        grams = self.grams(term)
+        if not grams:
+            return range(len(self.values))
+
+        # Intersect posting lists, smallest first
+        posting_lists = sorted((self.postings.get(gram, []) for gram in grams), key=len)
+        candidate_ids = set(posting_lists[0])
+        for posting_list in posting_lists[1:]:
+            if not candidate_ids:
+                break
+            candidate_ids.intersection_update(posting_list)
+        return candidate_ids
+
+    def search(self, term):
+        # Verify each candidate, since sharing every gram does not imply containment
+        positions = []
+        for value_id in self.candidates(term):
+            if term in self.values[value_id]:
+                positions.extend(self.rows_by_value[value_id])
+        positions.sort()
+        return positions
+
+
+# Case-insensitive prefix tree over the distinct values of one field, used for
+# autocomplete. Values are counted per loaded file, so files can be added and
+# dropped without rebuilding the tree.
+class PrefixTrie:
+    def __init__(self):
+        self.root = {}      # char -> child node, "" -> set of values ending here
+        self.counts = {}    # value -> number of loaded files holding it
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, value, count=1):
+        # A negative count drops a file's share of the value
+        total = self.counts.get(value, 0) + count
+        if total > 0:
+            if value not in self.counts:
+                node = self.root
+                for char in value.casefold():
+                    node = node.setdefault(char, {})
+                node.setdefault("", set()).add(value)
+            self.counts[value] = total
+        elif value in self.counts:
+            del self.counts[value]
+            self.remove_path(value)
+
+    def remove_path(self, value):
+        path = [self.root]
+        for char in value.casefold():
+            path.append(path[-1][char])
+        path[-1][""].discard(value)
+        if not path[-1][""]:
+            del path[-1][""]
+        # Prune the nodes left without values or children, deepest first
+        for char, parent, node in zip(reversed(value.casefold()), reversed(path[:-1]), reversed(path[1:])):
+            if node:
+                break
+            del parent[char]
+
+    def complete(self, prefix, limit=None):
+        # Values starting with 'prefix' in sorted order: O(len(prefix)) to find
+        # the subtree, then only as many nodes as it takes to fill 'limit'
+        node = self.root
+        for char in prefix.casefold():
+            node = node.get(char)
+            if node is None:
+                return []
+
+        results = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            stack.extend(node[char] for char in sorted(node, reverse=True) if char)
+            if "" in node:
+                results.extend(sorted(node[""]))
+                if limit is not None and len(results) >= limit:
+                    return results[:limit]
+        return results
+
+
+def build_field_indexes(columns):
+    # Build one sorted index per searchable field
+    return {field: SortedFieldIndex(values) for field, values in columns.items()}
+
+
+def build_ngram_indexes(columns, fields, n=3):
+    # Build a trigram index for each selected field
+    return {field: NgramIndex(columns[field], n) for field in fields if field in columns}
+
+
+# Rows of one file (or one field value) in chronological order of date and start
+# time. Rows without a valid start time sort at the start of their day.
+class DateTimeIndex:
+    def __init__(self, store, positions):
+        date_ordinal, start_minutes = store.date_ordinal, store.start_minutes
+        keys = {position: datetime_key(date_ordinal[position], max(start_minutes[position], 0))
+                for position in positions}
+        order = sorted(keys, key=lambda position: (keys[position], position))
+        self.keys = array('q', (keys[position] for position in order))
+        self.positions = array('i', order)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def iter_from(self, key, timetable_data_list):
+        # Yield (key, row) for every session starting at or after 'key'
+        for i in range(bisect_left(self.keys, key), len(self.keys)):
+            yield self.keys[i], timetable_data_list[self.positions[i]]
+
+    def between(self, low_key, high_key):
+        # Positions of the sessions starting from low_key to high_key inclusive,
+        # in chronological order: two bisects and a slice, O(log n + k)
+        return self.positions[bisect_left(self.keys, low_key):bisect_right(self.keys, high_key)]
+
+    def count_between(self, low_key, high_key):
+        # Number of sessions between the keys, without copying their positions
+        return max(0, bisect_right(self.keys, high_key) - bisect_left(self.keys, low_key))
+
+    def iter_between(self, low_key, high_key, timetable_data_list):
+        # Yield (key, row) for every session starting from low_key to high_key
+        for i in range(bisect_left(self.keys, low_key), bisect_right(self.keys, high_key)):
+            yield self.keys[i], timetable_data_list[self.positions[i]]
+
+
+def build_session_indexes(store, columns, fields):
+    # One DateTimeIndex per distinct value of each field, e.g. per lecturer
+    return {
+        field: {value: DateTimeIndex(store, positions)
+                for value, positions in group_positions(columns[field]).items()}
+        for field in fields
+    }
+
+
+def build_datetime_index(store):
+    # Every row of the file in chronological order, for date and time window queries
+    return DateTimeIndex(store, store.row_ids)
+
+
+def sessions_between(sources, low_key, high_key):
+    # Merge the sessions of several files starting between two datetime keys
+    # into one chronological list: O(files log rows + k log files)
+    streams = [index.iter_between(low_key, high_key, timetable_data_list)
+               for index, timetable_data_list in sources]
+    return [row for _, row in heapq.merge(*streams, key=itemgetter(0))]
+
+
+def next_sessions(sources, key, n):
+    # Merge the chronological streams of several files and keep the first n:
+    # O(log rows + n log files) instead of sorting every match
+    streams = [index.iter_from(key, timetable_data_list) for index, timetable_data_list in sources]
+    return [row for _, row in islice(heapq.merge(*streams, key=itemgetter(0)), n)]
+
+
+def top_k(items, k, key, reverse=False):
+    # Bounded heap of size k: O(n log k) instead of sorting the whole result set
+    if reverse:
+        return heapq.nlargest(k, items, key=key)
+    return heapq.nsmallest(k, items, key=key)
@@ -0,0 +1,70 @@
+from datetime import date
+
+
+# Pre-parsed sort keys shared by the CLI and GUI
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday",
+                "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Value stored when a field cannot be parsed, so it sorts before valid rows
+INVALID_KEY = -1
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_date_ordinal(value):
+    # Convert a "%d/%m/%Y" date string into a proleptic Gregorian ordinal
+    try:
+        day, month, year = value.strip().split("/")
+        return date(int(year), int(month), int(day)).toordinal()
+    except ValueError:
+        return INVALID_KEY
+
+
+def parse_time_minutes(value):
+    # Convert "H:MM:SS" or "HH:MM:SS" (seconds optional) into minutes past midnight
+    try:
+        parts = value.strip().split(":")
+        if not 2 <= len(parts) <= 3:
+            return INVALID_KEY
+        hours, minutes = int(parts[0]), int(parts[1])
+        if not (0 <= hours < 24 and 0 <= minutes < 60):
+            return INVALID_KEY
+        return hours * 60 + minutes
+    except ValueError:
+        return INVALID_KEY
+
+
+def parse_duration_minutes(value):
+    # Convert a "H:MM" or "HH:MM" duration into a number of minutes
+    try:
+        parts = value.strip().split(":")
+        if len(parts) != 2:
+            return INVALID_KEY
+        return int(parts[0]) * 60 + int(parts[1])
+    except ValueError:
+        return INVALID_KEY
+
+
+def parse_day_index(value):
+    # Convert a day name into 0 (Monday) to 6 (Sunday)
+    day = value.strip().capitalize()
+    if day in DAYS_OF_WEEK:
+        return DAYS_OF_WEEK.index(day)
+    return INVALID_KEY
+
+
+def datetime_key(date_ordinal, minutes):
+    # Single integer ordering sessions by date, then start time
+    return date_ordinal * MINUTES_PER_DAY + minutes
+
+
+def day_range_keys(start_ordinal, end_ordinal):
+    # datetime_key bounds covering every minute of the days from start to end
+    return datetime_key(start_ordinal, 0), datetime_key(end_ordinal, MINUTES_PER_DAY - 1)
+
+
+def week_range(day=None):
+    # Ordinals of the Monday and Sunday of the week holding 'day' (default today)
+    day = day or date.today()
+    monday = day.toordinal() - day.weekday()
+    return monday, monday + 6
@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import sys
+import time
+from collections import Counter
+from timetable_server import DEFAULT_HOST, DEFAULT_PORT
+
+
+# Requests sent in turn by every connection when no --path is given
+DEFAULT_PATHS = [
+    "/search?field=Allocated_Staff_Name&term=Kelvin%20Wu&limit=50",
+    "/search?field=Description&term=Network&contains=1&limit=50",
+    "/search?field=Cohort&term=DICT-DNDFC%20221&sort=Activity_Dates_Individual&limit=20",
+    "/date-range?from=01/03/2023&to=07/03/2023&limit=100",
+    "/week?date=06/03/2023&limit=100",
+    "/query?eq=Scheduled_Days:Monday&starts_after=12:00&limit=50",
+    "/health"
+]
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def fetch(reader, writer, host, path):
+    # One GET over a kept-alive connection, returns (status, body)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ")[1])
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    body = await reader.readexactly(length)
+    return status, body
+
+
+class LoadTest:
+    def __init__(self, host, port, paths, concurrency, duration=None, total=None):
+        self.host = host
+        self.port = port
+        self.paths = paths
+        self.concurrency = concurrency
+        self.duration = duration
+        # Requests to send across every connection, None runs for 'duration' seconds
+        self.total = total
+        self.sent = 0
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.bytes = 0
+
+    def next_request(self, deadline):
+        if self.total is not None:
+            if self.sent >= self.total:
+                return None
+        elif time.perf_counter() >= deadline:
+            return None
+        path = self.paths[self.sent % len(self.paths)]
+        self.sent += 1
+        return path
+
+    async def connection(self, deadline):
+        reader = writer = None
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            while True:
+                path = self.next_request(deadline)
+                if path is None:
+                    break
+                start = time.perf_counter()
+                status, body = await fetch(reader, writer, self.host, path)
+                self.latencies.append(time.perf_counter() - start)
+                self.statuses[status] += 1
+                self.bytes += len(body)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            self.errors[type(e).__name__] += 1
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def run(self):
+        start = time.perf_counter()
+        deadline = start + (self.duration or 0)
+        await asyncio.gather(*(self.connection(deadline) for _ in range(self.concurrency)))
+        return time.perf_counter() - start
+
+    def report(self, seconds):
+        latencies = sorted(latency * 1000 for latency in self.latencies)
+        lines = [
+            f"requests      {len(latencies)} in {seconds:.2f} s over {self.concurrency} connections",
+            f"throughput    {len(latencies) / seconds:.1f} requests/s, {self.bytes / seconds / 1e6:.2f} MB/s",
+            f"latency ms    p50 {percentile(latencies, 0.5):.2f}  p90 {percentile(latencies, 0.9):.2f}  "
+            f"p99 {percentile(latencies, 0.99):.2f}  max {latencies[-1] if latencies else 0.0:.2f}",
+            "statuses      " + ", ".join(f"{status}: {count}" for status, count in sorted(self.statuses.items()))
+        ]
+        if self.errors:
+            lines.append("errors        " + ", ".join(f"{name}: {count}" for name, count in self.errors.items()))
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test a running timetable_server: throughput and latency percentiles.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"server address (default {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"server port (default {DEFAULT_PORT})")
+    parser.add_argument("--concurrency", type=int, default=16, help="keep-alive connections (default 16)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run (default 10)")
+    parser.add_argument("--requests", type=int, help="send this many requests instead of running for --duration")
+    parser.add_argument("--path", action="append", dest="paths",
+                        help="request path, may be given more than once (default: a mix of every query route)")
+    args = parser.parse_args()
+
+    load_test = LoadTest(args.host, args.port, args.paths or DEFAULT_PATHS, args.concurrency,
+                         args.duration, args.requests)
+    seconds = asyncio.run(load_test.run())
+    print(load_test.report(seconds))
+    return 1 if load_test.errors or any(status >= 500 for status in load_test.statuses) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+import csv
+import os
+import time
+from timetable_cache import file_signature
+from timetable_metrics import metrics
+from timetable_mmap import MappedStore
+from timetable_store import TimetableStore
+
+
+# Worker count used when none is given, overridable with TIMETABLE_WORKERS
+DEFAULT_WORKERS = int(os.environ.get("TIMETABLE_WORKERS", "0")) or os.cpu_count() or 1
+
+# Inputs smaller than this in total are parsed serially, a pool costs more to start
+MIN_PARALLEL_BYTES = 2 * 1024 * 1024
+
+
+# Raised between files when a load is cancelled
+class OperationCancelled(Exception):
+    pass
+
+
+# Outcome of parsing one CSV file
+class LoadResult:
+    def __init__(self, csv_filename, store=None, seconds=0.0, error=None, signature=None):
+        self.csv_filename = csv_filename
+        self.store = store
+        self.rows = len(store) if store is not None else 0
+        self.seconds = seconds
+        self.error = error
+        self.signature = signature  # (size, mtime) taken before parsing
+        self.indexes = None         # Set when the indexes also came from the cache
+        self.cached = False
+
+    def __str__(self):
+        if self.error is not None:
+            return f"{self.csv_filename}: failed after {self.seconds:.3f}s ({self.error})"
+        source = "from cache" if self.cached else "parsed"
+        return f"{self.csv_filename}: {self.rows} rows {source} in {self.seconds:.3f}s"
+
+
+def parse_file(csv_filename):
+    # Parse one file into a store, recording the time taken and any error
+    start = time.perf_counter()
+    signature = None
+    try:
+        signature = file_signature(csv_filename)
+        store = TimetableStore.from_csv(csv_filename)
+    except (OSError, ValueError, IndexError, csv.Error) as e:
+        return LoadResult(csv_filename, seconds=time.perf_counter() - start, error=str(e),
+                          signature=signature)
+    return LoadResult(csv_filename, store, time.perf_counter() - start, signature=signature)
+
+
+def load_cached(cache, csv_filename, indexes_key=None):
+    # Read one file from the parsed-data cache, or return None on a miss
+    start = time.perf_counter()
+    entry = cache.load(csv_filename, indexes_key)
+    if entry is None:
+        return None
+    try:
+        signature = file_signature(csv_filename)
+    except OSError:
+        return None
+    result = LoadResult(csv_filename, entry.store, time.perf_counter() - start, signature=signature)
+    result.indexes = entry.indexes
+    result.cached = True
+    return result
+
+
+def total_size(csv_filepaths):
+    size = 0
+    for csv_filepath in csv_filepaths:
+        try:
+            size += os.path.getsize(csv_filepath)
+        except OSError:
+            pass
+    return size
+
+
+def check_cancelled(cancelled):
+    if cancelled is not None and cancelled():
+        raise OperationCancelled()
+
+
+def map_file(csv_filename):
+    # Memory-map one file and index where its rows and fields are, without decoding them
+    start = time.perf_counter()
+    signature = None
+    try:
+        signature = file_signature(csv_filename)
+        store = MappedStore(csv_filename)
+    except (OSError, ValueError, csv.Error) as e:
+        return LoadResult(csv_filename, seconds=time.perf_counter() - start, error=str(e),
+                          signature=signature)
+    return LoadResult(csv_filename, store, time.perf_counter() - start, signature=signature)
+
+
+def map_stores(csv_filepaths, progress=None, cancelled=None):
+    # Map the files one after another in input order: the offset pass is cheap,
+    # and a mapped store cannot be sent back from a worker process
+    csv_filepaths = list(csv_filepaths)
+    results = []
+    for csv_filepath in csv_filepaths:
+        check_cancelled(cancelled)
+        result = map_file(csv_filepath)
+        metrics.record("load.mapped_file", result.seconds)
+        results.append(result)
+        if progress is not None:
+            progress(len(results), len(csv_filepaths), csv_filepath)
+    return results
+
+
+def parse_serially(csv_filepaths, on_result, cancelled=None):
+    results = []
+    for csv_filepath in csv_filepaths:
+        check_cancelled(cancelled)
+        results.append(parse_file(csv_filepath))
+        on_result(results[-1])
+    return results
+
+
+def parse_files(csv_filepaths, workers=None, on_result=lambda result: None, cancelled=None):
+    # Parse the files across a process pool, results come back in input order.
+    # on_result is called as each file finishes and cancelled() is checked in between.
+    workers = min(workers or DEFAULT_WORKERS, len(csv_filepaths))
+
+    if workers <= 1 or total_size(csv_filepaths) < MIN_PARALLEL_BYTES:
+        return parse_serially(csv_filepaths, on_result, cancelled)
+
+    # Imported here so small loads and startup never pay for multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(parse_file, csv_filepath): i
+                       for i, csv_filepath in enumerate(csv_filepaths)}
+            results = [None] * len(csv_filepaths)
+            for future in as_completed(futures):
+                if cancelled is not None and cancelled():
+                    for pending in futures:
+                        pending.cancel()
+                    raise OperationCancelled()
+                results[futures[future]] = future.result()
+                on_result(results[futures[future]])
+            return results
+    except (OSError, NotImplementedError, BrokenProcessPool):
+        # Platforms without working multiprocessing fall back to serial parsing
+        return parse_serially(csv_filepaths, on_result, cancelled)
+
+
+def load_stores(csv_filepaths, workers=None, cache=None, indexes_key=None,
+                progress=None, cancelled=None):
+    # Serve unchanged files from the cache and parse the rest, in input order.
+    # progress(done, total, csv_filename) is called after every file.
+    csv_filepaths = list(csv_filepaths)
+    total = len(csv_filepaths)
+    done = 0
+
+    def on_result(result):
+        nonlocal done
+        done += 1
+        # Parse time per file, measured where the file was parsed
+        metrics.record("load.cached_file" if result.cached else "parse.file", result.seconds)
+        if result.error is not None:
+            metrics.count("parse.errors")
+        else:
+            metrics.count("parse.rows", len(result.store))
+        if progress is not None:
+            progress(done, total, result.csv_filename)
+
+    results = [None] * total
+    if cache is not None:
+        for i, csv_filepath in enumerate(csv_filepaths):
+            check_cancelled(cancelled)
+            results[i] = load_cached(cache, csv_filepath, indexes_key)
+            if results[i] is not None:
+                on_result(results[i])
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    parsed = parse_files([csv_filepaths[i] for i in missing], workers, on_result, cancelled)
+    for i, result in zip(missing, parsed):
+        results[i] = result
+    return results
+
+
+# CSV files that changed in the loaded folders since they were last loaded
+class FolderChanges:
+    def __init__(self, added, modified, removed):
+        self.added = added
+        self.modified = modified
+        self.removed = removed
+        self.results = []   # LoadResults of re-parsing the added and modified files
+        self.prepared = []  # (csv_filename, data_by_file entry) ready to be applied
+
+    def __bool__(self):
+        return bool(self.added or self.modified or self.removed)
+
+    def __str__(self):
+        return f"{len(self.added)} added, {len(self.modified)} modified, {len(self.removed)} removed"
+
+
+def list_csv_files(directory_path):
+    # Full paths of the CSV files in a directory, joined the same way as at load
+    return [os.path.join(directory_path, file) for file in os.listdir(directory_path)
+            if file.endswith('.csv')]
+
+
+def scan_changes(data_by_file, directories, failed_signatures=None):
+    # Compare the directory listings with data_by_file using the file signatures.
+    # Files that failed to load are only retried once their signature changes.
+    failed_signatures = failed_signatures or {}
+    added, modified, removed = [], [], []
+    seen = set()
+    for directory_path in dict.fromkeys(directories):
+        try:
+            csv_filepaths = list_csv_files(directory_path)
+        except OSError:
+            csv_filepaths = []
+        for csv_filepath in csv_filepaths:
+            seen.add(csv_filepath)
+            data = data_by_file.get(csv_filepath)
+            if data is None and csv_filepath not in failed_signatures:
+                added.append(csv_filepath)
+                continue
+            try:
+                signature = file_signature(csv_filepath)
+            except OSError:
+                continue    # Deleted while scanning, picked up by the next scan
+            if data is None:
+                if failed_signatures[csv_filepath] != signature:
+                    added.append(csv_filepath)
+            elif data.get("signature") != signature:
+                modified.append(csv_filepath)
+
+    directory_set = {os.path.normpath(directory_path) for directory_path in directories}
+    for csv_filename in data_by_file:
+        if csv_filename not in seen and os.path.normpath(os.path.dirname(csv_filename)) in directory_set:
+            removed.append(csv_filename)
+
+    return FolderChanges(added, modified, removed)
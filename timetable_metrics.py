@@ -0,0 +1,239 @@
+import functools
+import io
+import json
+import os
+import threading
+import time
+
+
+# Histogram bucket upper bounds in milliseconds, slower calls go in a last open bucket
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# Functions listed in the text report of a cProfile capture
+PROFILE_REPORT_LINES = 25
+
+
+# Latency histogram of one operation, with the exact count, total and maximum
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        milliseconds = seconds * 1000
+        for i, bound in enumerate(BUCKETS_MS):
+            if milliseconds <= bound:
+                break
+        else:
+            i = len(BUCKETS_MS)
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        # Upper bound in ms of the bucket holding the given fraction of calls,
+        # or the maximum for the open bucket
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max * 1000
+        return 0.0
+
+    def to_dict(self):
+        labels = [f"<={bound}ms" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"]
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "buckets": {label: count for label, count in zip(labels, self.buckets) if count}
+        }
+
+
+# Context manager used while metrics are off, so timing costs nothing
+class NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_TIMER = NoTimer()
+
+
+class Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# Runs one operation under cProfile and keeps the report
+class ProfileTimer(Timer):
+    def __enter__(self):
+        import cProfile
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        return super().__enter__()
+
+    def __exit__(self, *exc_info):
+        super().__exit__(*exc_info)
+        self.profiler.disable()
+        self.metrics.save_profile(self.name, self.profiler)
+        return False
+
+
+# Counters and latency histograms of the hot paths. Off unless TIMETABLE_METRICS
+# is set (or the CLI is given --metrics), and then each call costs one check.
+class Metrics:
+    def __init__(self, enabled=False, profile=None, profile_output=None):
+        self.enabled = enabled
+        self.histograms = {}    # operation name -> Histogram
+        self.counters = {}      # counter name -> int
+        self.last = None        # (operation name, seconds) of the latest call
+        # Name of one operation to run under cProfile, cleared once it has run
+        self.profile = profile
+        # .prof file the capture is saved to, for pstats or snakeviz
+        self.profile_output = profile_output
+        self.profile_report = None
+        self.profiled = None
+        # Background jobs record from their worker threads
+        self.lock = threading.Lock()
+
+    def active(self):
+        return self.enabled or self.profile is not None
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.last = None
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds)
+            self.last = (name, seconds)
+
+    def timer(self, name):
+        # with metrics.timer("export.excel"): ... records the block's duration
+        if name == self.profile:
+            # Checked again under the lock: background jobs time from worker
+            # threads, and only one of them may take the capture
+            with self.lock:
+                profiled = name == self.profile
+                if profiled:
+                    self.profile = None
+            if profiled:
+                return ProfileTimer(self, name)
+        if not self.enabled:
+            return NO_TIMER
+        return Timer(self, name)
+
+    def save_profile(self, name, profiler):
+        import pstats
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+        self.profile_report = f"Profile of {name}:\n{report.getvalue()}"
+        self.profiled = name
+        if self.profile_output:
+            profiler.dump_stats(self.profile_output)
+
+    def status_text(self):
+        # One line for a status bar: the latest operation and the call count
+        if self.last is None:
+            # With metrics off nothing is recorded, only the profile capture
+            if self.profiled is not None and not self.enabled:
+                return f"{self.profiled} profiled"
+            text = "Metrics on, no operations yet" if self.enabled else f"Waiting to profile {self.profile}"
+        else:
+            name, seconds = self.last
+            calls = sum(histogram.count for histogram in self.histograms.values())
+            text = f"{name}: {seconds * 1000:.1f} ms | {calls} operations timed"
+        if self.profiled is not None:
+            text += f" | {self.profiled} profiled"
+        return text
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "timings": {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())},
+                "counters": dict(sorted(self.counters.items()))
+            }
+
+    def summary(self):
+        data = self.to_dict()
+        lines = [f"{'operation':<24} {'calls':>7} {'total ms':>10} {'mean ms':>9} "
+                 f"{'p50 ms':>8} {'p95 ms':>8} {'max ms':>9}"]
+        for name, timing in data["timings"].items():
+            lines.append(f"{name:<24} {timing['count']:>7} {timing['total_ms']:>10.1f} {timing['mean_ms']:>9.2f} "
+                         f"{timing['p50_ms']:>8g} {timing['p95_ms']:>8g} {timing['max_ms']:>9.2f}")
+        for name, value in data["counters"].items():
+            lines.append(f"{name:<24} {value:>7}")
+        if self.profile_report:
+            lines.append(self.profile_report)
+        return "\n".join(lines)
+
+    def write_json(self, output_filename):
+        with open(output_filename, 'w') as output_file:
+            json.dump(self.to_dict(), output_file, indent=2)
+
+
+# Shared by every module, configured from the environment:
+#   TIMETABLE_METRICS=1               record timings and counters
+#   TIMETABLE_METRICS_FILE=path.json  where front-ends write them on exit
+#   TIMETABLE_PROFILE=operation       run the next such operation under cProfile
+#   TIMETABLE_PROFILE_FILE=path.prof  where that profile is saved
+metrics = Metrics(
+    enabled=os.environ.get("TIMETABLE_METRICS", "") not in ("", "0"),
+    profile=os.environ.get("TIMETABLE_PROFILE") or None,
+    profile_output=os.environ.get("TIMETABLE_PROFILE_FILE") or None)
+
+
+def timed(name):
+    # Decorator recording every call of the function under 'name'
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled and metrics.profile is None:
+                return function(*args, **kwargs)
+            with metrics.timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def write_report(output_filename=None, out=None):
+    # At exit: print the summary to 'out' and write the JSON file, if asked for
+    output_filename = output_filename or os.environ.get("TIMETABLE_METRICS_FILE")
+    if not metrics.enabled and metrics.profile_report is None:
+        return
+    if out is not None:
+        print(metrics.summary(), file=out)
+    if output_filename and metrics.enabled:
+        metrics.write_json(output_filename)
@@ -0,0 +1,207 @@
+import csv
+import locale
+import mmap
+from array import array
+from itertools import accumulate
+from operator import add
+from timetable_store import FIELDS, KEY_COLUMNS
+
+
+# Same encoding as TimetableStore.from_csv, which opens the file in text mode
+ENCODING = locale.getpreferredencoding(False)
+
+# CSV column read for each field, the others are parts of the column 1 name
+FIELD_COLUMNS = {
+    "Description": 2,
+    "Allocated_Location_Name": 8,
+    "Planned_Size": 9,
+    "Allocated_Staff_Name": 10,
+    "Zone_Name": 11,
+    "Activity_Dates_Individual": 3,
+    "Scheduled_Days": 4,
+    "Scheduled_Start_Time": 5,
+    "Scheduled_End_Time": 6,
+    "Duration": 7
+}
+
+# Fields split out of the column 1 name, e.g. DICT-DNDFC_221_FT_ND_Lec01 (see parse_csv_row)
+NAME_PARTS = {
+    "Cohort": lambda parts: parts[0] + " " + parts[1],
+    "Study_Mode": lambda parts: parts[2],
+    "Module_Code": lambda parts: parts[3],
+    "Class_Type": lambda parts: parts[4]
+}
+
+# Columns a timetable row needs, rows with fewer fail the load like in from_csv
+COLUMN_COUNT = 12
+
+# Offsets kept per row: the end of each of the first COLUMN_COUNT columns and
+# the end of the row, relative to the start of the row
+OFFSETS_PER_ROW = COLUMN_COUNT + 1
+
+
+def has_quoted_field(line):
+    # As in csv, a quote only starts a quoted field at the start of a field,
+    # anywhere else (e.g. 12" screen) it is part of the value
+    return line.startswith(b'"') or b',"' in line
+
+
+def quoted_field_open(line):
+    # Whether a quoted field is still open at the end of the line, i.e. the
+    # row goes on on the next line
+    position = 0
+    while True:
+        if line.startswith(b'"', position):
+            position += 1
+            while True:
+                end = line.find(b'"', position)
+                if end == -1:
+                    return True
+                position = end + 1
+                if not line.startswith(b'"', position):
+                    break
+                position += 1   # Doubled quote inside the field
+        comma = line.find(b",", position)
+        if comma == -1:
+            return False
+        position = comma + 1
+
+
+# One field of a MappedStore, decoded row by row as it is read
+class MappedColumn:
+    def __init__(self, store, field):
+        self.store = store
+        self.field = field
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, row):
+        return self.store.value(row, self.field)
+
+    def __iter__(self):
+        value, field = self.store.value, self.field
+        return (value(row, field) for row in self.store.row_ids)
+
+
+# Read-only TimetableStore over a memory-mapped CSV file. The first pass only
+# records where each row and field starts; fields are decoded when a query
+# reads them, so memory stays close to the file size and queries can start
+# before the file is decoded. Row views (TimetableData) work unchanged.
+# The file must not be truncated or rewritten in place while it is mapped:
+# reading a page past its new end crashes the process (SIGBUS).
+class MappedStore:
+    def __init__(self, csv_filename):
+        self.csv_filename = csv_filename
+        with open(csv_filename, 'rb') as csv_file:
+            try:
+                self.data = mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self.data = b""     # Empty files cannot be mapped
+        self.row_starts = array('Q')
+        # Two bytes per offset unless a row is longer than 64 KiB
+        self.offsets = array('H')
+        # Rows with quoted fields, decoded with the csv module instead of the offsets
+        self.quoted_rows = set()
+        self.columns = {field: MappedColumn(self, field) for field in FIELDS}
+        self.build_offsets()
+
+    def build_offsets(self):
+        data = self.data
+        position, size = 0, len(data)
+        while position < size:
+            start = position
+            end = data.find(b"\n", position)
+            end = size if end == -1 else end
+            line = data[start:end]
+            if has_quoted_field(line):
+                # A quoted field may hold newlines, read on until it is closed
+                while quoted_field_open(line) and end < size:
+                    next_end = data.find(b"\n", end + 1)
+                    end = size if next_end == -1 else next_end
+                    line = data[start:end]
+            position = end + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            self.add_row(start, line)
+
+    def add_row(self, start, line):
+        quoted = has_quoted_field(line)
+        if quoted:
+            columns = next(csv.reader([self.decode(line)]), [])
+        else:
+            columns = line.split(b",", COLUMN_COUNT)
+        if len(columns) < 2:
+            raise ValueError(f"{self.csv_filename}: row at byte {start} has no name column")
+
+        # Skip the rows that are not timetable activities, e.g. the header
+        name = columns[1] if quoted else columns[1].decode(ENCODING)
+        parts = name.split("_")
+        if len(parts) < 2:
+            return
+        if len(columns) < COLUMN_COUNT or len(parts) < 5:
+            raise ValueError(f"{self.csv_filename}: row at byte {start} is not a timetable activity")
+
+        row = len(self.row_starts)
+        self.row_starts.append(start)
+        if quoted:
+            self.quoted_rows.add(row)
+            offsets = [0] * COLUMN_COUNT
+        else:
+            # Column i ends after the lengths of columns 0..i and i commas
+            offsets = list(map(add, accumulate(map(len, columns[:COLUMN_COUNT])), range(COLUMN_COUNT)))
+        offsets.append(len(line))
+        if offsets[-1] > 0xFFFF and self.offsets.typecode == 'H':
+            self.offsets = array('I', self.offsets)
+        self.offsets.extend(offsets)
+
+    def close(self):
+        # Unmap the file once the store is replaced or dropped. Reading it
+        # afterwards raises ValueError instead of touching a stale mapping.
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def decode(self, raw):
+        # Text mode (as used by from_csv) reads \r\n inside quoted fields as \n
+        return raw.decode(ENCODING).replace("\r\n", "\n")
+
+    def __len__(self):
+        return len(self.row_starts)
+
+    @property
+    def row_ids(self):
+        return range(len(self))
+
+    def column_value(self, row, column):
+        # Decode one CSV column of one row
+        start = self.row_starts[row]
+        base = row * OFFSETS_PER_ROW
+        if row in self.quoted_rows:
+            line = self.data[start:start + self.offsets[base + COLUMN_COUNT]]
+            return next(csv.reader([self.decode(line)]))[column]
+        field_start = start + (self.offsets[base + column - 1] + 1 if column else 0)
+        return self.data[field_start:start + self.offsets[base + column]].decode(ENCODING)
+
+    def value(self, row, field):
+        column = FIELD_COLUMNS.get(field)
+        if column is not None:
+            return self.column_value(row, column)
+        return NAME_PARTS[field](self.column_value(row, 1).split("_"))
+
+    def row_values(self, row):
+        return tuple(self.value(row, field) for field in FIELDS)
+
+    def __getattr__(self, name):
+        # Pre-parsed key columns (see KEY_COLUMNS) are built the first time
+        # they are read, then kept as plain attributes
+        if name not in KEY_COLUMNS:
+            raise AttributeError(name)
+        field, parser = KEY_COLUMNS[name]
+        keys, parsed = array('i'), {}
+        for value in self.columns[field]:
+            key = parsed.get(value)
+            if key is None:
+                key = parsed[value] = parser(value)
+            keys.append(key)
+        setattr(self, name, keys)
+        return keys
@@ -0,0 +1,162 @@
+from datetime import date
+from timetable_keys import INVALID_KEY, day_range_keys
+
+
+# Intersect with an indexed predicate's rows while it matches at most this many
+# times as many rows as are left, otherwise check the remaining rows one by one
+INTERSECT_RATIO = 4
+
+
+# Field equals a value, answered by the field's SortedFieldIndex
+class Equals:
+    indexed = True
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def key(self):
+        return ("eq", self.field, self.value)
+
+    def estimate(self, data):
+        return data["indexes"][self.field].count(self.value)
+
+    def positions(self, data):
+        return data["indexes"][self.field].lookup(self.value)
+
+    def matches(self, data, row, get_value):
+        return get_value(data, self.field, row) == self.value
+
+
+# Field contains a substring, answered from the distinct values of the field's index
+class Contains:
+    indexed = True
+
+    def __init__(self, field, term):
+        self.field = field
+        self.term = term
+
+    def key(self):
+        return ("contains", self.field, self.term)
+
+    def matching_ranges(self, index):
+        # Only the distinct values are compared, not every row
+        return [(index.starts[i], index.starts[i + 1])
+                for i, value in enumerate(index.keys) if self.term in value]
+
+    def estimate(self, data):
+        return sum(end - start for start, end in self.matching_ranges(data["indexes"][self.field]))
+
+    def positions(self, data):
+        index = data["indexes"][self.field]
+        positions = []
+        for start, end in self.matching_ranges(index):
+            positions.extend(index.positions[start:end])
+        positions.sort()
+        return positions
+
+    def matches(self, data, row, get_value):
+        return self.term in get_value(data, self.field, row)
+
+
+# Inclusive range over one of the store's pre-parsed key columns (see KEY_COLUMNS),
+# e.g. date_ordinal or start_minutes. Either bound may be None. Date ranges are
+# answered by the file's datetime_index, the other ranges are checked row by row.
+class Range:
+    def __init__(self, key_column, low=None, high=None):
+        self.key_column = key_column
+        self.low = low
+        self.high = high
+
+    @property
+    def indexed(self):
+        return self.key_column == "date_ordinal"
+
+    def key(self):
+        return ("range", self.key_column, self.low, self.high)
+
+    def datetime_keys(self):
+        # Bounds in the datetime_index covering every minute of the dates. Rows
+        # without a valid date have negative keys, below any real date.
+        low = self.low if self.low is not None else 1
+        high = self.high if self.high is not None else date.max.toordinal()
+        return day_range_keys(max(low, 1), high)
+
+    def estimate(self, data):
+        return data["datetime_index"].count_between(*self.datetime_keys())
+
+    def positions(self, data):
+        positions = list(data["datetime_index"].between(*self.datetime_keys()))
+        positions.sort()
+        return positions
+
+    def matches(self, data, row, get_value):
+        key = getattr(data["store"], self.key_column)[row]
+        if key == INVALID_KEY:
+            return False
+        return (self.low is None or key >= self.low) and (self.high is None or key <= self.high)
+
+
+def range_predicate(key_column, parser, low_text, high_text):
+    # Range over key_column between two optional texts, e.g. dates parsed with
+    # parse_date_ordinal, or None when both are blank
+    if not low_text and not high_text:
+        return None
+    bounds = []
+    for text in (low_text, high_text):
+        key = parser(text) if text else None
+        if key == INVALID_KEY:
+            raise ValueError(f"Invalid value: {text}")
+        bounds.append(key)
+    return Range(key_column, *bounds)
+
+
+def plan(data, predicates):
+    # Indexed predicates ordered by the number of rows they match, most
+    # selective first, as (estimate, predicate), then the scanned predicates
+    indexed = sorted(((predicate.estimate(data), i, predicate)
+                      for i, predicate in enumerate(predicates) if predicate.indexed),
+                     key=lambda entry: entry[:2])
+    scanned = [predicate for predicate in predicates if not predicate.indexed]
+    return [(estimate, predicate) for estimate, _, predicate in indexed], scanned
+
+
+def query_file(data, predicates, get_value):
+    # Row positions of one file matching every predicate, in CSV order.
+    # get_value(data, field, row) reads the field value the predicates compare.
+    indexed, scanned = plan(data, predicates)
+    if indexed and indexed[0][0] == 0:
+        return []
+
+    # Start from the most selective index instead of every row
+    if indexed:
+        candidates = indexed[0][1].positions(data)
+        indexed = indexed[1:]
+    else:
+        candidates = range(len(data["store"]))
+
+    checks = []
+    for estimate, predicate in indexed:
+        if estimate <= INTERSECT_RATIO * len(candidates):
+            row_ids = set(predicate.positions(data))
+            candidates = [row for row in candidates if row in row_ids]
+        else:
+            checks.append(predicate)
+        if not candidates:
+            return []
+
+    # Only what is left after the intersections is checked row by row
+    checks.extend(scanned)
+    if checks:
+        candidates = [row for row in candidates
+                      if all(predicate.matches(data, row, get_value) for predicate in checks)]
+    return list(candidates)
+
+
+def query_files(data_by_file, predicates, get_value):
+    # Matching rows of every loaded file, in file order
+    results = []
+    for data in data_by_file.values():
+        timetable_data_list = data["timetable_data_list"]
+        results.extend(timetable_data_list[row] for row in query_file(data, predicates, get_value))
+    return results
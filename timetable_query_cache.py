@@ -0,0 +1,58 @@
+import os
+from collections import OrderedDict
+from timetable_metrics import metrics
+
+
+# Result rows held by a QueryCache before the least recently used results are
+# dropped, overridable with TIMETABLE_QUERY_CACHE_ROWS. Rows are shared views,
+# so each costs one pointer in the cached tuple.
+DEFAULT_MAX_ROWS = int(os.environ.get("TIMETABLE_QUERY_CACHE_ROWS", "0")) or 1000000
+
+
+# Bounded LRU cache of query results. Every entry belongs to one generation of
+# the loaded data, so results of earlier loads are never served.
+class QueryCache:
+    def __init__(self, max_rows=DEFAULT_MAX_ROWS):
+        self.max_rows = max_rows
+        self.entries = OrderedDict()    # (query key, generation) -> tuple of rows
+        self.rows = 0
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return f"{len(self.entries)} results ({self.rows} rows), {self.hits} hits, {self.misses} misses"
+
+    def clear(self):
+        self.entries.clear()
+        self.rows = 0
+
+    def lookup(self, key, generation, compute):
+        # Return the cached results of 'key', or compute(), cache and return them.
+        # Results are stored as tuples so callers cannot change them in place.
+        if generation != self.generation:
+            # The data was (re)loaded, no earlier result can be served again
+            self.clear()
+            self.generation = generation
+
+        full_key = (key, generation)
+        results = self.entries.get(full_key)
+        if results is not None:
+            self.hits += 1
+            metrics.count("query_cache.hits")
+            self.entries.move_to_end(full_key)
+            return results
+
+        self.misses += 1
+        metrics.count("query_cache.misses")
+        results = tuple(compute())
+        if len(results) <= self.max_rows:
+            self.entries[full_key] = results
+            self.rows += len(results)
+            while self.rows > self.max_rows:
+                _, evicted = self.entries.popitem(last=False)
+                self.rows -= len(evicted)
+        return results
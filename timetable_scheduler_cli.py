@@ -1,235 +1,405 @@
+import argparse
 import csv
+import json
 import os
+import shlex
+import sys
 from datetime import datetime
+from itertools import chain
+from timetable_index import (LazyIndexes, NgramIndex, SortedFieldIndex, build_datetime_index,
+                             build_field_indexes, build_ngram_indexes, build_session_indexes,
+                             next_sessions, sessions_between, top_k)
+from timetable_keys import datetime_key, day_range_keys, parse_date_ordinal, parse_time_minutes, week_range
+from timetable_clash import find_clashes
+from timetable_cache import DEFAULT_CACHE_DIR, ParsedDataCache, file_signature
+from timetable_loader import list_csv_files, load_stores, map_stores, scan_changes
+from timetable_mmap import MappedStore
+from timetable_metrics import metrics, timed, write_report
+from timetable_query import Contains, Equals, Range, query_files, range_predicate
+from timetable_query_cache import QueryCache
+from timetable_sqlite import CHRONOLOGICAL_ORDER, DEFAULT_DB_PATH, FILE_ORDER, SqliteBackend, sort_order
+from timetable_store import FIELDS, TimetableStore, TimetableRow, row_views
+from timetable_stream import iter_files, matching, in_date_range, limited
+
+
+# Get Timetable Data, a lightweight view of one row of a TimetableStore
+class TimetableData(TimetableRow):
+    __slots__ = ()
 
-
-# Get Timetable Data
-class TimetableData:
     def __init__(self, Description, Module_Code, Study_Mode, Cohort, Allocated_Location_Name, Planned_Size, Allocated_Staff_Name, Zone_Name, Activity_Dates_Individual, Scheduled_Days, Scheduled_Start_Time, Scheduled_End_Time, Duration, Class_Type):
-        # Make all attributes private with leading underscores
-        self.__Description = Description
-        self.__Module_Code = Module_Code
-        self.__Study_Mode = Study_Mode
-        self.__Cohort = Cohort
-        self.__Allocated_Location_Name = Allocated_Location_Name
-        self.__Planned_Size = Planned_Size
-        self.__Allocated_Staff_Name = Allocated_Staff_Name
-        self.__Zone_Name = Zone_Name
-        self.__Activity_Dates_Individual = Activity_Dates_Individual
-        self.__Scheduled_Days = Scheduled_Days
-        self.__Scheduled_Start_Time = Scheduled_Start_Time
-        self.__Scheduled_End_Time = Scheduled_End_Time
-        self.__Duration = Duration
-        self.__Class_Type = Class_Type
+        super().__init__(Description, Module_Code, Study_Mode, Cohort, Allocated_Location_Name, Planned_Size, Allocated_Staff_Name,
+                         Zone_Name, Activity_Dates_Individual, Scheduled_Days, Scheduled_Start_Time, Scheduled_End_Time, Duration, Class_Type)
 
     def get_items(self):
         # Return all attributes as a dictionary
-        return {
-            'Description': self.__Description,
-            'Module_Code': self.__Module_Code,
-            'Study_Mode': self.__Study_Mode,
-            'Cohort': self.__Cohort,
-            'Allocated_Location_Name': self.__Allocated_Location_Name,
-            'Planned_Size': self.__Planned_Size,
-            'Allocated_Staff_Name': self.__Allocated_Staff_Name,
-            'Zone_Name': self.__Zone_Name,
-            'Activity_Dates_Individual': self.__Activity_Dates_Individual,
-            'Scheduled_Days': self.__Scheduled_Days,
-            'Scheduled_Start_Time': self.__Scheduled_Start_Time,
-            'Scheduled_End_Time': self.__Scheduled_End_Time,
-            'Duration': self.__Duration,
-            'Class_Type': self.__Class_Type
-        }
+        columns, row = self._store.columns, self._row
+        return {field: columns[field][row] for field in FIELDS}
 
     def __str__(self):
+        get = self.get_item
         return f"""
-Module Name: {self.__Description}
-Module Code: {self.__Module_Code}
-Study Mode: {self.__Study_Mode}
-Cohort: {self.__Cohort}
-Location: {self.__Allocated_Location_Name} ({self.__Zone_Name})
-Planned Size: {self.__Planned_Size}
-Lecturer: {self.__Allocated_Staff_Name}
-Schedule: {self.__Activity_Dates_Individual}
-Scheduled Day: {self.__Scheduled_Days}
-Start Time: {self.__Scheduled_Start_Time}
-End Time: {self.__Scheduled_End_Time}
-Duration: {self.__Duration}
-Class Type: {self.__Class_Type}
+Module Name: {get("Description")}
+Module Code: {get("Module_Code")}
+Study Mode: {get("Study_Mode")}
+Cohort: {get("Cohort")}
+Location: {get("Allocated_Location_Name")} ({get("Zone_Name")})
+Planned Size: {get("Planned_Size")}
+Lecturer: {get("Allocated_Staff_Name")}
+Schedule: {get("Activity_Dates_Individual")}
+Scheduled Day: {get("Scheduled_Days")}
+Start Time: {get("Scheduled_Start_Time")}
+End Time: {get("Scheduled_End_Time")}
+Duration: {get("Duration")}
+Class Type: {get("Class_Type")}
 """
 
 
 # Implement Heap Sort and Binary Search Algorithm
 class TimetableManager:
-    def __init__(self):
-        self.data_manager = DataManager()
-
-    def heap_sort(self, arr, reverse=False):
+    def __init__(self, cache=None, query_cache=None, lazy=False):
+        self.data_manager = DataManager(cache=cache, lazy=lazy)
+        # Results of repeated searches and sorts, dropped whenever the data changes
+        self.query_cache = query_cache if query_cache is not None else QueryCache()
+
+    def cached(self, key, compute):
+        return self.query_cache.lookup(key, self.data_manager.generation, compute)
+
+    # Sorts by the pre-parsed date and start time, like top_k, unless another
+    # key is given, 'key' is evaluated once per element
+    @timed("sort.heap_sort")
+    def heap_sort(self, arr, reverse=False, key=lambda item: (item.date_ordinal, item.start_minutes)):
         n = len(arr)
+        # The position breaks ties, so equal keys keep their input order as in top_k
+        keys = [(key(item), -i if reverse else i) for i, item in enumerate(arr)]
 
         for i in range(n // 2 - 1, -1, -1):
-            self.heapify(arr, n, i, reverse)
+            self.heapify(arr, keys, n, i, reverse)
 
         for i in range(n - 1, 0, -1):
             arr[i], arr[0] = arr[0], arr[i]
-            self.heapify(arr, i, 0, reverse)
+            keys[i], keys[0] = keys[0], keys[i]
+            self.heapify(arr, keys, i, 0, reverse)
 
-    def heapify(self, arr, n, i, reverse=False):
+    def heapify(self, arr, keys, n, i, reverse=False):
         largest = i
         left = 2 * i + 1
         right = 2 * i + 2
 
-        # Compare based on the 'Activity_Dates_Individual' attribute as datetime objects
-        if left < n and ((datetime.strptime(arr[i].get_items()["Activity_Dates_Individual"], "%d/%m/%Y") 
-                          < datetime.strptime(arr[left].get_items()["Activity_Dates_Individual"], "%d/%m/%Y")) 
-                         if not reverse else (datetime.strptime(arr[i].get_items()["Activity_Dates_Individual"], "%d/%m/%Y") 
-                                              > datetime.strptime(arr[left].get_items()["Activity_Dates_Individual"], "%d/%m/%Y"))):
+        if left < n and ((keys[i] < keys[left]) if not reverse else (keys[i] > keys[left])):
             largest = left
 
-        if right < n and ((datetime.strptime(arr[largest].get_items()["Activity_Dates_Individual"], "%d/%m/%Y") 
-                           < datetime.strptime(arr[right].get_items()["Activity_Dates_Individual"], "%d/%m/%Y")) 
-                          if not reverse else (datetime.strptime(arr[largest].get_items()["Activity_Dates_Individual"], "%d/%m/%Y") 
-                                               > datetime.strptime(arr[right].get_items()["Activity_Dates_Individual"], "%d/%m/%Y"))):
+        if right < n and ((keys[largest] < keys[right]) if not reverse else (keys[largest] > keys[right])):
             largest = right
 
         if largest != i:
             arr[i], arr[largest] = arr[largest], arr[i]
-            self.heapify(arr, n, largest, reverse)
+            keys[i], keys[largest] = keys[largest], keys[i]
+            self.heapify(arr, keys, n, largest, reverse)
+
+    @timed("sort.top_k")
+    def top_k(self, arr, k, reverse=False, key=lambda item: (item.date_ordinal, item.start_minutes)):
+        # First k schedules by date and start time, without sorting all of arr
+        return top_k(arr, k, key=key, reverse=reverse)
+
+    @timed("sort.by_field")
+    def sort_by_field(self, results, field, reverse=False, limit=None):
+        # --sort and --limit of the batch commands. Both paths are stable, so
+        # ties keep the input order like the SQLite backend's ORDER BY
+        key = SORT_KEYS.get(field) or (lambda item: item.get_item(field))
+        if limit is not None:
+            return self.top_k(results, limit, reverse=reverse, key=key)
+        return sorted(results, key=key, reverse=reverse)
+
+    @timed("query.next_sessions")
+    def next_sessions(self, field, value, n, now=None):
+        # Next n sessions of a lecturer, location or cohort starting at or after
+        # 'now', read from the per-value chronological indexes of every file
+        now = now or datetime.now()
+        key = datetime_key(now.toordinal(), now.hour * 60 + now.minute)
+        sources = []
+        for data in self.data_manager.data_by_file.values():
+            index = data["session_indexes"][field].get(value)
+            if index is not None:
+                sources.append((index, data["timetable_data_list"]))
+        return next_sessions(sources, key, n)
+
+    @timed("query.between")
+    def schedules_between(self, start_ordinal, end_ordinal):
+        # Schedules of every file from the start date to the end date inclusive,
+        # in chronological order, bisected from each file's datetime index
+        def compute():
+            sources = [(data["datetime_index"], data["timetable_data_list"])
+                       for data in self.data_manager.data_by_file.values()]
+            return sessions_between(sources, *day_range_keys(start_ordinal, end_ordinal))
+        return self.cached(("between", start_ordinal, end_ordinal), compute)
+
+    @timed("query.clashes")
+    def find_clashes(self):
+        # Double-booked rooms and lecturers across every loaded file
+        return find_clashes(self.data_manager.data_by_file)
 
     def binary_search(self, csv_filename, search_key, search_criteria):
-        data = self.data_manager.data_by_file[csv_filename]["timetable_data_list"]
-        left, right = 0, len(data) - 1
+        data = self.data_manager.data_by_file[csv_filename]
+        timetable_data_list = data["timetable_data_list"]
+        if not timetable_data_list:
+            return []
+
+        # Bisect the per-field sorted index built in data_filter
+        positions = data["indexes"][search_criteria].lookup(search_key)
+        # Return list of schedules matching the search criteria
+        return [timetable_data_list[position] for position in positions]
+
+    @timed("query.search")
+    def binary_search_all(self, search_key, search_criteria):
+        # Exact-match lookup across every loaded file
         results = []
+        for csv_filename in self.data_manager.data_by_file:
+            results.extend(self.binary_search(
+                csv_filename, search_key, search_criteria))
+        return results
+
+    @timed("query.filter")
+    def compound_search(self, predicates):
+        # Schedules matching every predicate, planned per file from the indexes
+        return self.cached(("query",) + tuple(predicate.key() for predicate in predicates),
+                           lambda: query_files(self.data_manager.data_by_file, predicates, store_value))
 
-        while left <= right:
-            mid = (left + right) // 2
-            current_item = data[mid].get_items()[search_criteria]
-
-            if current_item == search_key:
-                results.append(data[mid])  # Found a match
-                # Continue searching for additional matches to the left
-                left = mid - 1
-                while left >= 0 and data[left].get_items()[search_criteria] == search_key:
-                    results.append(data[left])
-                    left -= 1
-                # Continue searching for additional matches to the right
-                right = mid + 1
-                while right < len(data) and data[right].get_items()[search_criteria] == search_key:
-                    results.append(data[right])
-                    right += 1
-                break
-            elif current_item < search_key:
-                left = mid + 1
-            else:
-                right = mid - 1
 
-        return results  # Return list of schedules matching the search criteria
+def store_value(data, field, row):
+    # Raw field value of one row, as compared by the query predicates
+    return data["store"].columns[field][row]
 
 
 # Filter the Data
 class DataManager:
-    def __init__(self):
+    # Fields searched by the list_schedules_by_* methods, trigram indexed by default
+    NGRAM_FIELDS = (
+        "Description",
+        "Allocated_Staff_Name",
+        "Allocated_Location_Name",
+        "Scheduled_Start_Time",
+        "Duration",
+        "Scheduled_Days"
+    )
+
+    # Fields with a chronological index per value, for "next N sessions" queries
+    SESSION_FIELDS = ("Allocated_Staff_Name", "Allocated_Location_Name", "Cohort")
+
+    # Entries of data_by_file that hold indexes, saved to the cache with the store
+    INDEX_KEYS = ("indexes", "ngram_indexes", "session_indexes", "datetime_index")
+
+    def __init__(self, ngram_fields=NGRAM_FIELDS, cache=None, lazy=False):
         self.data_by_file = {}
+        # Fields to build a trigram index for at load, the others are scanned
+        self.ngram_fields = tuple(ngram_fields)
+        # Optional ParsedDataCache used to skip re-parsing unchanged files
+        self.cache = cache
+        # Memory-map the files and decode fields and build indexes only when a
+        # query reads them (see timetable_mmap), the cache is not used
+        self.lazy = lazy
+        # Bumped whenever data_by_file changes, cached query results of older
+        # generations are never served
+        self.generation = 0
+        # Signatures of the files that failed to load, see record_failures
+        self.failed_signatures = {}
+
+    def indexes_key(self):
+        # Identifies how cached indexes were built, so they are only reused when they match
+        return "cli:" + ",".join(self.ngram_fields)
 
     def data_filter(self, csv_filename):
-        # Initialize the data dictionary for this file
-        self.data_by_file[csv_filename] = {
-            "timetable_data_list": []
+        if self.lazy:
+            signature = file_signature(csv_filename)
+            self.release_file(csv_filename)
+            self.data_by_file[csv_filename] = self.build_lazy_file_data(MappedStore(csv_filename), signature)
+            self.generation += 1
+            return
+
+        # Read the file from the cache when it is unchanged
+        if self.cache is not None:
+            entry = self.cache.load(csv_filename, self.indexes_key())
+            if entry is not None:
+                self.set_file_data(csv_filename, entry.store, entry.indexes,
+                                   file_signature(csv_filename))
+                return
+
+        # Otherwise parse it into a column store and (re)build its indexes
+        signature = file_signature(csv_filename)
+        self.set_file_data(csv_filename, TimetableStore.from_csv(csv_filename), signature=signature)
+        self.save_to_cache(csv_filename, self.data_by_file[csv_filename])
+
+    @timed("load")
+    def prepare_files(self, csv_filepaths, workers=None, progress=None, cancelled=None):
+        # Parse the files in parallel and build their entries without touching
+        # data_by_file, so this can run off the main thread
+        if self.lazy:
+            results = map_stores(csv_filepaths, progress, cancelled)
+            return results, [(result.csv_filename, self.build_lazy_file_data(result.store, result.signature))
+                             for result in results if result.error is None]
+        results = load_stores(csv_filepaths, workers, self.cache, self.indexes_key(),
+                              progress, cancelled)
+        prepared = []
+        for result in results:
+            if result.error is None:
+                data = self.build_file_data(result.store, result.indexes, result.signature)
+                if not result.cached:
+                    self.save_to_cache(result.csv_filename, data)
+                prepared.append((result.csv_filename, data))
+        return results, prepared
+
+    def load_files(self, csv_filepaths, workers=None):
+        # Parse the files in parallel, then merge them in the given order
+        results, prepared = self.prepare_files(csv_filepaths, workers)
+        self.record_failures(results)
+        for csv_filename, _ in prepared:
+            self.release_file(csv_filename)
+        self.data_by_file.update(prepared)
+        self.generation += 1
+        return results
+
+    def prepare_refresh(self, directories, workers=None, progress=None, cancelled=None):
+        # Re-parse only the CSV files added or modified in the directories since
+        # they were loaded. Indexes are per file, so the unchanged files keep theirs.
+        changes = scan_changes(self.data_by_file, directories, self.failed_signatures)
+        changes.results, changes.prepared = self.prepare_files(
+            changes.added + changes.modified, workers, progress, cancelled)
+        return changes
+
+    def apply_changes(self, changes):
+        # Drop the deleted files and the ones that no longer load (as the
+        # SQLite backend does), then install the re-parsed ones in one step
+        self.record_failures(changes.results)
+        changed = bool(changes.prepared)
+        failed = [result.csv_filename for result in changes.results if result.error is not None]
+        for csv_filename in changes.removed + failed:
+            self.release_file(csv_filename)
+            changed |= self.data_by_file.pop(csv_filename, None) is not None
+        for csv_filename, _ in changes.prepared:
+            self.release_file(csv_filename)
+        self.data_by_file.update(changes.prepared)
+        if changed:
+            self.generation += 1
+
+    def record_failures(self, results):
+        # Remember the signature of each file that failed to load, so a refresh
+        # only retries it once the file changes again
+        for result in results:
+            if result.error is None:
+                self.failed_signatures.pop(result.csv_filename, None)
+            else:
+                self.failed_signatures[result.csv_filename] = result.signature
+
+    def refresh(self, directories, workers=None):
+        changes = self.prepare_refresh(directories, workers)
+        self.apply_changes(changes)
+        return changes
+
+    def release_file(self, csv_filename):
+        # Unmap a lazily loaded file before its entry is replaced or dropped
+        data = self.data_by_file.get(csv_filename)
+        if data is not None and isinstance(data["store"], MappedStore):
+            data["store"].close()
+
+    def save_to_cache(self, csv_filename, data):
+        if self.cache is None:
+            return
+        indexes = {key: data[key] for key in self.INDEX_KEYS}
+        self.cache.save(csv_filename, data["signature"], data["store"], indexes, self.indexes_key())
+
+    def set_file_data(self, csv_filename, store, indexes=None, signature=None):
+        self.release_file(csv_filename)
+        self.data_by_file[csv_filename] = self.build_file_data(store, indexes, signature)
+        self.generation += 1
+
+    def build_file_data(self, store, indexes=None, signature=None):
+        # Build the indexes unless they were read from the cache
+        if indexes is None:
+            with metrics.timer("index.build"):
+                indexes = {
+                    "indexes": build_field_indexes(store.columns),
+                    "ngram_indexes": build_ngram_indexes(store.columns, self.ngram_fields),
+                    "session_indexes": build_session_indexes(store, store.columns, self.SESSION_FIELDS),
+                    "datetime_index": build_datetime_index(store)
+                }
+
+        # Initialize the data dictionary for this file, the row views and
+        # indexes all read from the store's columns
+        return {
+            "store": store,
+            "signature": signature,     # (size, mtime) of the file when it was read
+            "timetable_data_list": row_views(store, TimetableData),
+            **indexes
         }
 
-        with open(csv_filename, 'r') as csv_file:
-            csv_reader = csv.reader(csv_file)
-            for column in csv_reader:
-                name = column[1]
-                parts = name.split("_")
-                # Check if there are enough parts before accessing indices. Prevent (IndexError: list index out of range)
-                if len(parts) >= 2:
-                    timetable_data = TimetableData(
-                        Description=column[2],
-                        Module_Code=parts[3],
-                        Study_Mode=parts[2],
-                        Cohort=parts[0] + " " + parts[1],
-                        Allocated_Location_Name=column[8],
-                        Planned_Size=column[9],
-                        Allocated_Staff_Name=column[10],
-                        Zone_Name=column[11],
-                        Activity_Dates_Individual=column[3],
-                        Scheduled_Days=column[4],
-                        Scheduled_Start_Time=column[5],
-                        Scheduled_End_Time=column[6],
-                        Duration=column[7],
-                        Class_Type=parts[4]
-                    )
-
-                    data = self.data_by_file[csv_filename]
-                    data["timetable_data_list"].append(timetable_data)
-
-    def list_schedules_by_module_name(self, csv_filename, module_name):
+    def build_lazy_file_data(self, store, signature=None):
+        # The entries of build_file_data, each index built the first time it is
+        # read, and per field, so a query only decodes the columns it touches
+        def per_field(fields, build):
+            return lambda key: LazyIndexes(dict.fromkeys(fields, build))
+
+        return LazyIndexes({
+            "timetable_data_list": lambda key: row_views(store, TimetableData),
+            "indexes": per_field(FIELDS, lambda field: SortedFieldIndex(store.columns[field])),
+            "ngram_indexes": per_field(self.ngram_fields, lambda field: NgramIndex(store.columns[field])),
+            "session_indexes": per_field(self.SESSION_FIELDS, lambda field: build_session_indexes(
+                store, store.columns, [field])[field]),
+            "datetime_index": lambda key: build_datetime_index(store)
+        }, store=store, signature=signature)
+
+    @timed("query.substring")
+    def substring_search(self, csv_filename, field, term):
         data = self.data_by_file[csv_filename]
-        filtered_schedules = []
-        for timetable_data in data["timetable_data_list"]:
-            if module_name in timetable_data.get_items()["Description"]:
-                filtered_schedules.append(timetable_data)
+        timetable_data_list = data["timetable_data_list"]
+        ngram_index = data["ngram_indexes"].get(field)
 
-        return filtered_schedules
+        # Fields without a trigram index fall back to a linear scan of the column
+        if ngram_index is None:
+            values = data["store"].columns[field]
+            return [timetable_data_list[position] for position, value in enumerate(values)
+                    if term in value]
 
-    def list_schedules_by_lecturer_name(self, csv_filename, lecturer_name):
-        data = self.data_by_file[csv_filename]
-        filtered_schedules = []
-        for timetable_data in data["timetable_data_list"]:
-            if lecturer_name in timetable_data.get_items()["Allocated_Staff_Name"]:
-                filtered_schedules.append(timetable_data)
+        return [timetable_data_list[position] for position in ngram_index.search(term)]
 
-        return filtered_schedules
+    def list_schedules_by_module_name(self, csv_filename, module_name):
+        return self.substring_search(csv_filename, "Description", module_name)
+
+    def list_schedules_by_lecturer_name(self, csv_filename, lecturer_name):
+        return self.substring_search(csv_filename, "Allocated_Staff_Name", lecturer_name)
 
+    @timed("query.date_range")
     def list_schedules_by_date_range(self, csv_filename, start_date, end_date):
         data = self.data_by_file[csv_filename]
-        start_date = datetime.strptime(start_date, "%d/%m/%Y")
-        end_date = datetime.strptime(end_date, "%d/%m/%Y")
-        filtered_schedules = []
-        for timetable_data in data["timetable_data_list"]:
-            schedule_date = datetime.strptime(
-                timetable_data.get_items()["Activity_Dates_Individual"], "%d/%m/%Y")
-            if start_date <= schedule_date <= end_date:
-                filtered_schedules.append(timetable_data)
-
-        return filtered_schedules
+        start_date = datetime.strptime(start_date, "%d/%m/%Y").toordinal()
+        end_date = datetime.strptime(end_date, "%d/%m/%Y").toordinal()
+        # Bisect the chronological index instead of comparing every row's date
+        timetable_data_list = data["timetable_data_list"]
+        positions = data["datetime_index"].between(*day_range_keys(start_date, end_date))
+        return [timetable_data_list[position] for position in positions]
 
     def list_schedules_by_location(self, csv_filename, location_name):
-        data = self.data_by_file[csv_filename]
-        filtered_schedules = []
-        for timetable_data in data["timetable_data_list"]:
-            if location_name in timetable_data.get_items()["Allocated_Location_Name"]:
-                filtered_schedules.append(timetable_data)
-
-        return filtered_schedules
+        return self.substring_search(csv_filename, "Allocated_Location_Name", location_name)
 
     def list_schedules_by_specific_time(self, csv_filename, specific_time):
-        data = self.data_by_file[csv_filename]
-        filtered_schedules = []
-        for timetable_data in data["timetable_data_list"]:
-            if specific_time in timetable_data.get_items()["Scheduled_Start_Time"]:
-                filtered_schedules.append(timetable_data)
-
-        return filtered_schedules
+        return self.substring_search(csv_filename, "Scheduled_Start_Time", specific_time)
 
     def list_schedules_by_duration(self, csv_filename, duration):
-        data = self.data_by_file[csv_filename]
-        filtered_schedules = []
-        for timetable_data in data["timetable_data_list"]:
-            if duration in timetable_data.get_items()["Duration"]:
-                filtered_schedules.append(timetable_data)
-
-        return filtered_schedules
+        return self.substring_search(csv_filename, "Duration", duration)
 
     def list_schedules_by_day(self, csv_filename, day):
-        data = self.data_by_file[csv_filename]
-        filtered_schedules = []
-        for timetable_data in data["timetable_data_list"]:
-            if day in timetable_data.get_items()["Scheduled_Days"]:
-                filtered_schedules.append(timetable_data)
-
-        return filtered_schedules
+        return self.substring_search(csv_filename, "Scheduled_Days", day)
+
+    def stream_schedules(self, csv_filenames, field=None, term=None, exact=False,
+                         start_ordinal=None, end_ordinal=None, limit=None, on_error=None):
+        # Read and filter matching schedules one row at a time without loading
+        # the files into data_by_file, stopping after 'limit' matches. Yields
+        # tuples in FIELDS order, in file order even for date ranges. Files
+        # that fail are passed to on_error (see iter_files).
+        records = iter_files(csv_filenames, on_error)
+        if field is not None:
+            records = matching(records, field, term, exact)
+        if start_ordinal is not None and end_ordinal is not None:
+            records = in_date_range(records, start_ordinal, end_ordinal)
+        return limited(records, limit)
 
     def print_data(self, csv_filename):
         data = self.data_by_file[csv_filename]["timetable_data_list"]
@@ -240,8 +410,12 @@ class DataManager:
 
 # Main Function
 class Main:
-    def __init__(self):
-        self.timetable_manager = TimetableManager()
+    def __init__(self, workers=None, cache_dir=DEFAULT_CACHE_DIR):
+        # Pass cache_dir=None to always re-parse the CSV files
+        cache = ParsedDataCache(cache_dir) if cache_dir else None
+        self.timetable_manager = TimetableManager(cache=cache)
+        self.workers = workers
+        self.directories = []
 
     def load_csv_files(self, directory_path):
         csv_filepaths = []  # Create a list to store valid CSV file paths
@@ -294,12 +468,16 @@ class Main:
         else:
             csv_filepaths2 = []
 
-        # Load and process all CSV files in the specified directories
-        for csv_filepath in csv_filepaths:
-            self.timetable_manager.data_manager.data_filter(csv_filepath)
+        # Remember the loaded directories so they can be refreshed later
+        self.directories = [directory_path]
+        if csv_filepaths2:
+            self.directories.append(directory_path2)
 
-        for csv_filepath in csv_filepaths2:
-            self.timetable_manager.data_manager.data_filter(csv_filepath)
+        # Load and process all CSV files in the specified directories
+        results = self.timetable_manager.data_manager.load_files(
+            csv_filepaths + csv_filepaths2, self.workers)
+        for result in results:
+            print(result)
 
         while True:
             print("Options:")
@@ -310,7 +488,12 @@ class Main:
             print("5. Search schedules by Duration")
             print("6. Search schedules by Day")
             print("7. Print All Schedules")
-            print("8. Quit")
+            print("8. Show Next Sessions of a Lecturer, Location or Cohort")
+            print("9. Show Room and Lecturer Clashes")
+            print("10. Refresh Changed CSV Files")
+            print("11. List Schedules Between Two Dates")
+            print("12. List Schedules This Week")
+            print("13. Quit")
 
             choice = input("Enter your choice: ")
 
@@ -346,11 +529,90 @@ class Main:
                         csv_filename)
 
             elif choice == "8":
+                self.show_next_sessions()
+
+            elif choice == "9":
+                self.show_clashes()
+
+            elif choice == "10":
+                self.refresh_data()
+
+            elif choice == "11":
+                self.show_schedules_between_dates()
+
+            elif choice == "12":
+                start_ordinal, end_ordinal = week_range()
+                self.show_schedules_between(start_ordinal, end_ordinal)
+
+            elif choice == "13":
                 break
 
             else:
                 print("Invalid choice. Please select a valid option.")
 
+    def show_clashes(self):
+        clashes = self.timetable_manager.find_clashes()
+        if not clashes:
+            print("\nNo room or lecturer clashes found.")
+            return
+        print(f"\n{len(clashes)} clashes found:")
+        for clash in clashes:
+            print(clash)
+
+    def refresh_data(self):
+        # Re-parse only the CSV files that changed since they were loaded
+        changes = self.timetable_manager.data_manager.refresh(
+            self.directories, self.workers)
+        print(f"Refreshed CSV files: {changes}")
+        for result in changes.results:
+            print(result)
+        for csv_filename in changes.removed:
+            print(f"{csv_filename}: removed")
+
+    def read_count(self, prompt):
+        # Read a positive number, blank or invalid input means no limit
+        value = input(prompt).strip()
+        return int(value) if value.isdigit() and int(value) > 0 else None
+
+    def show_schedules_between_dates(self):
+        try:
+            start_ordinal = datetime.strptime(input("Enter the start date (DD/MM/YYYY): "), "%d/%m/%Y").toordinal()
+            end_ordinal = datetime.strptime(input("Enter the end date (DD/MM/YYYY): "), "%d/%m/%Y").toordinal()
+        except ValueError:
+            print("Invalid date. Please use the DD/MM/YYYY format.")
+            return
+        self.show_schedules_between(start_ordinal, end_ordinal)
+
+    def show_schedules_between(self, start_ordinal, end_ordinal):
+        results = self.timetable_manager.schedules_between(start_ordinal, end_ordinal)
+        period = f"{datetime.fromordinal(start_ordinal):%d/%m/%Y} to {datetime.fromordinal(end_ordinal):%d/%m/%Y}"
+        if not results:
+            print(f"\nNo schedules found from {period}.")
+            return
+        print(f"\n{len(results)} schedules found from {period}:")
+        for result in results:
+            print(result)
+
+    def show_next_sessions(self):
+        fields = {
+            "1": "Allocated_Staff_Name",
+            "2": "Allocated_Location_Name",
+            "3": "Cohort"
+        }
+        field = fields.get(input(
+            "Show next sessions of \n1. Lecturer\n2. Location\n3. Cohort\nEnter your choice:"))
+        if field is None:
+            print("Invalid choice. Please select a valid option.")
+            return
+
+        value = input("Enter the exact name to search: ")
+        count = self.read_count("Number of sessions to show (default 5): ") or 5
+        results = self.timetable_manager.next_sessions(field, value, count)
+        if not results:
+            print(f"\nNo upcoming sessions found for '{value}'.")
+        for result in results:
+            print(result)
+
     def search_schedules(self, search_criteria, search_key):
         sort_option = input(
             "Select Sorting Option \n1. Ascending Order\n2. Descending Order\nEnter your choice:")
@@ -358,19 +620,394 @@ class Main:
         if sort_option == "2":
             ascending = False
 
-        for csv_filename in self.timetable_manager.data_manager.data_by_file:
-            results = self.timetable_manager.binary_search(
-                csv_filename, search_key, search_criteria)
+        limit = self.read_count(
+            "Number of schedules to show (leave blank for all): ")
+        manager = self.timetable_manager
+        if limit is not None:
+            # Keep only the first schedules across all files with a bounded heap
+            results = manager.cached(
+                ("top", search_criteria, search_key, ascending, limit),
+                lambda: manager.top_k(manager.binary_search_all(search_key, search_criteria),
+                                      limit, reverse=not ascending))
+            print(
+                f"\nFirst {len(results)} schedules found for '{search_criteria}' with '{search_key}':")
+            for result in results:
+                print(result)
+            return
+
+        def sorted_results(csv_filename):
+            results = manager.binary_search(csv_filename, search_key, search_criteria)
+            # Sort the results based on user's choice
+            manager.heap_sort(results, reverse=not ascending)
+            return results
+
+        for csv_filename in manager.data_manager.data_by_file:
+            results = manager.cached(
+                ("search", csv_filename, search_criteria, search_key, ascending),
+                lambda: sorted_results(csv_filename))
             if len(results) > 0:
                 print(
                     f"\nSchedules found for '{search_criteria}' with '{search_key}' in path '{csv_filename}':")
-                # Sort the results based on user's choice
-                self.timetable_manager.heap_sort(
-                    results, reverse=not ascending)
                 for result in results:
                     print(result)
 
 
+# Sort keys for --sort, the date and time fields sort by their pre-parsed keys
+SORT_KEYS = {
+    "Activity_Dates_Individual": lambda item: (item.date_ordinal, item.start_minutes),
+    "Scheduled_Days": lambda item: item.day_index,
+    "Scheduled_Start_Time": lambda item: item.start_minutes,
+    "Scheduled_End_Time": lambda item: item.end_minutes,
+    "Duration": lambda item: item.duration_minutes
+}
+
+LOAD_COLUMNS = ("csv_filename", "rows", "source", "seconds", "error")
+
+
+# argparse parser whose errors can be caught, so one bad batch query does not end the run
+class QueryParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise ValueError(message)
+
+
+def count_argument(text):
+    value = int(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError("must not be negative")
+    return value
+
+
+def add_query_commands(subparsers):
+    search_parser = subparsers.add_parser("search", help="schedules whose field matches a term")
+    search_parser.add_argument("--field", required=True, choices=FIELDS)
+    search_parser.add_argument("--term", required=True)
+    search_parser.add_argument("--contains", action="store_true",
+                               help="match the term anywhere in the field instead of exactly")
+
+    date_range_parser = subparsers.add_parser("date-range", help="schedules between two dates")
+    date_range_parser.add_argument("--from", dest="start_date", required=True, help="DD/MM/YYYY")
+    date_range_parser.add_argument("--to", dest="end_date", required=True, help="DD/MM/YYYY")
+
+    week_parser = subparsers.add_parser("week", help="schedules of one Monday to Sunday week")
+    week_parser.add_argument("--date", help="any day of the week as DD/MM/YYYY (default today)")
+
+    query_parser = subparsers.add_parser(
+        "query", help="schedules matching every given condition, using the most selective index first")
+    query_parser.add_argument("--eq", nargs=2, action="append", default=[], metavar=("FIELD", "VALUE"),
+                              help="field equals value, may be given more than once")
+    query_parser.add_argument("--contains", nargs=2, action="append", default=[], metavar=("FIELD", "TERM"),
+                              help="field contains term, may be given more than once")
+    query_parser.add_argument("--from", dest="start_date", help="on or after DD/MM/YYYY")
+    query_parser.add_argument("--to", dest="end_date", help="on or before DD/MM/YYYY")
+    query_parser.add_argument("--starts-after", help="starting at or after HH:MM")
+    query_parser.add_argument("--starts-before", help="starting at or before HH:MM")
+
+    for query_parser in (search_parser, date_range_parser, week_parser, query_parser):
+        query_parser.add_argument("--sort", choices=FIELDS, help="field to sort the results by")
+        query_parser.add_argument("--reverse", action="store_true", help="sort in descending order")
+        query_parser.add_argument("--limit", type=count_argument, help="only output the first N results")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Query timetable CSV files without the interactive menu. "
+                    "Run without arguments for the menu.")
+    parser.add_argument("--dir", dest="directories", action="append", required=True,
+                        help="directory of CSV files to load, may be given more than once")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl",
+                        help="output format on stdout (default jsonl)")
+    parser.add_argument("--workers", type=int, help="processes used to parse the CSV files")
+    parser.add_argument("--no-cache", action="store_true", help="always re-parse the CSV files")
+    parser.add_argument("--stream", action="store_true",
+                        help="search, date-range and week only: read, filter and write one row at a time "
+                             "without loading the files. Rows come out in file order, not by date, "
+                             "and --sort is not available")
+    parser.add_argument("--lazy", action="store_true",
+                        help="memory-map the CSV files and decode fields only when a query reads them "
+                             "(memory backend only; the files must not be rewritten in place while in use)")
+    parser.add_argument("--backend", choices=("memory", "sqlite"), default="memory",
+                        help="keep the schedules in memory (default) or in a local SQLite database")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help=f"SQLite database of the sqlite backend (default {DEFAULT_DB_PATH})")
+    parser.add_argument("--metrics", action="store_true",
+                        help="time the load and queries, the summary goes to stderr (or set TIMETABLE_METRICS=1)")
+    parser.add_argument("--metrics-output", help="also write the timings and counters to this JSON file")
+    parser.add_argument("--profile", metavar="OPERATION",
+                        help="run the first OPERATION (e.g. load, query.search, batch.query) under cProfile")
+    parser.add_argument("--profile-output", help="save the cProfile capture to this .prof file")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("load", help="load the files and report each one")
+    add_query_commands(subparsers)
+    batch_parser = subparsers.add_parser(
+        "batch", help="run one query per line (search, date-range, week or query arguments) against one load")
+    batch_parser.add_argument("--queries", default="-", help="file of queries, - for stdin (default)")
+    return parser
+
+
+def build_predicates(args):
+    # Predicates of a 'query' command, raises ValueError for invalid conditions
+    predicates = []
+    for predicate_class, conditions in ((Equals, args.eq), (Contains, args.contains)):
+        for field, value in conditions:
+            if field not in FIELDS:
+                raise ValueError(f"unknown field '{field}'")
+            predicates.append(predicate_class(field, value))
+    for predicate in (range_predicate("date_ordinal", parse_date_ordinal, args.start_date, args.end_date),
+                      range_predicate("start_minutes", parse_time_minutes, args.starts_after, args.starts_before)):
+        if predicate is not None:
+            predicates.append(predicate)
+    if not predicates:
+        raise ValueError("give at least one condition")
+    return predicates
+
+
+def date_bounds(args):
+    # (start, end) date ordinals of a 'week' or 'date-range' command
+    if args.command == "week":
+        return week_range(datetime.strptime(args.date, "%d/%m/%Y") if args.date else None)
+    return tuple(datetime.strptime(date_text, "%d/%m/%Y").toordinal()
+                 for date_text in (args.start_date, args.end_date))
+
+
+def build_query_parser():
+    # Parses one line of a batch file, e.g.: search --field Cohort --term "DICT-DNDFC 221" --limit 5
+    # or: query --eq Allocated_Staff_Name "Kelvin Wu" --eq Scheduled_Days Wednesday --from 01/03/2023
+    parser = QueryParser(prog="query")
+    add_query_commands(parser.add_subparsers(dest="command", required=True))
+    return parser
+
+
+# Writes records to a stream as JSON Lines or CSV, one record as soon as it is produced
+class RecordWriter:
+    def __init__(self, out, output_format, columns):
+        self.out = out
+        self.columns = columns
+        self.csv_writer = None
+        if output_format == "csv":
+            self.csv_writer = csv.writer(out)
+            self.csv_writer.writerow(columns)
+
+    def write(self, record):
+        if self.csv_writer is not None:
+            self.csv_writer.writerow([record.get(column, "") for column in self.columns])
+        else:
+            self.out.write(json.dumps(record) + "\n")
+
+
+# Non-interactive front end: loads the directories once, then answers any number of queries
+class BatchRunner:
+    def __init__(self, directories, workers=None, cache_dir=DEFAULT_CACHE_DIR, lazy=False):
+        cache = ParsedDataCache(cache_dir) if cache_dir else None
+        self.timetable_manager = TimetableManager(cache=cache, lazy=lazy)
+        self.directories = directories
+        self.workers = workers
+
+    def csv_filepaths(self):
+        csv_filepaths = []
+        for directory_path in self.directories:
+            csv_filepaths.extend(list_csv_files(directory_path))
+        return csv_filepaths
+
+    def load(self):
+        return self.timetable_manager.data_manager.load_files(self.csv_filepaths(), self.workers)
+
+    def query(self, args):
+        # Sorted or limited results are served from the query cache when the same
+        # query was already run, the others are streamed straight from the indexes
+        if args.sort is None and args.limit is None:
+            return self.compute_query(args)
+        options = dict(vars(args))
+        if args.command == "week":
+            # Without --date the week depends on today, key it on the dates it covers
+            options["date"] = date_bounds(args)
+        # The repeated conditions of 'query' (e.g. --eq) are lists of lists
+        key = ("batch",) + tuple((name, tuple(map(tuple, value)) if isinstance(value, list) else value)
+                                 for name, value in sorted(options.items()))
+        return self.timetable_manager.cached(key, lambda: self.compute_query(args))
+
+    def compute_query(self, args):
+        # Matching schedules of every loaded file, produced lazily unless they are sorted
+        manager = self.timetable_manager
+        data_manager = manager.data_manager
+        csv_filenames = list(data_manager.data_by_file)
+
+        if args.command == "query":
+            results = manager.compound_search(build_predicates(args))
+        elif args.command == "search":
+            if args.contains:
+                per_file = (data_manager.substring_search(csv_filename, args.field, args.term)
+                            for csv_filename in csv_filenames)
+            else:
+                per_file = (manager.binary_search(csv_filename, args.term, args.field)
+                            for csv_filename in csv_filenames)
+        else:
+            results = manager.schedules_between(*date_bounds(args))
+        if args.command == "search":
+            results = chain.from_iterable(per_file)
+
+        if args.sort is None:
+            return limited(results, args.limit)
+        return manager.sort_by_field(results, args.sort, args.reverse, args.limit)
+
+    def run_batch(self, lines, writer):
+        # One query per line, blank lines and lines starting with # are skipped.
+        # Returns the number of queries that failed.
+        query_parser = build_query_parser()
+        failures = 0
+        for query_number, line in enumerate(lines, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            try:
+                with metrics.timer("batch.query"):
+                    results = self.query(query_parser.parse_args(shlex.split(line)))
+                    for timetable_data in results:
+                        writer.write({"query": query_number, **timetable_data.get_items()})
+            except ValueError as e:
+                failures += 1
+                print(f"query {query_number}: {e}", file=sys.stderr)
+            writer.out.flush()
+        return failures
+
+
+# Batch front end over the SQLite backend: the same commands and results, with
+# the filtering, date ranges, sorting and limits run as SQL queries
+class SqliteBatchRunner(BatchRunner):
+    def __init__(self, directories, workers=None, db_path=DEFAULT_DB_PATH):
+        super().__init__(directories, workers, cache_dir=None)
+        self.backend = SqliteBackend(db_path, TimetableData)
+
+    def load(self):
+        # The database only keeps the files of these directories
+        return self.backend.load_files(self.csv_filepaths(), self.workers, replace=True)
+
+    def query(self, args):
+        # SQLite has its own page cache, results are not cached again
+        return self.compute_query(args)
+
+    def compute_query(self, args):
+        if args.command == "query":
+            predicates, order = build_predicates(args), FILE_ORDER
+        elif args.command == "search":
+            predicates, order = [(Contains if args.contains else Equals)(args.field, args.term)], FILE_ORDER
+        else:
+            predicates, order = [Range("date_ordinal", *date_bounds(args))], CHRONOLOGICAL_ORDER
+        if args.sort is not None:
+            order = sort_order(args.sort, args.reverse, order)
+        return self.backend.find(predicates, order, args.limit)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        # The menu is configured from TIMETABLE_METRICS and TIMETABLE_PROFILE
+        try:
+            Main().run()
+        finally:
+            write_report(out=sys.stderr)
+        return 0
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    metrics.enabled = metrics.enabled or args.metrics or bool(args.metrics_output)
+    metrics.profile = args.profile or metrics.profile
+    metrics.profile_output = args.profile_output or metrics.profile_output
+    try:
+        return run_command(parser, args)
+    finally:
+        write_report(args.metrics_output, sys.stderr)
+
+
+STREAM_COMMANDS = ("search", "date-range", "week")
+
+
+def stream_command(parser, args):
+    # --stream: one-off reports over files too large to load, each matching
+    # row is written as soon as it is read
+    if args.command not in STREAM_COMMANDS:
+        parser.error(f"--stream works with {', '.join(STREAM_COMMANDS)}, not {args.command}")
+    if args.sort is not None:
+        parser.error("--stream writes rows in file order and cannot --sort")
+    if args.lazy or args.backend != "memory":
+        parser.error("--stream reads the files directly, without --lazy or --backend")
+
+    try:
+        if args.command == "search":
+            filters = {"field": args.field, "term": args.term, "exact": not args.contains}
+        else:
+            start_ordinal, end_ordinal = date_bounds(args)
+            filters = {"start_ordinal": start_ordinal, "end_ordinal": end_ordinal}
+        csv_filenames = BatchRunner(args.directories, cache_dir=None).csv_filepaths()
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    # Files that fail are reported on stderr as by a load, the others still answer
+    def report(result):
+        print(result, file=sys.stderr)
+
+    writer = RecordWriter(sys.stdout, args.format, FIELDS)
+    with metrics.timer("batch.stream"):
+        for values in DataManager().stream_schedules(csv_filenames, limit=args.limit, on_error=report,
+                                                     **filters):
+            writer.write(dict(zip(FIELDS, values)))
+    return 0
+
+
+def run_command(parser, args):
+    if args.stream:
+        return stream_command(parser, args)
+    if args.lazy and args.backend != "memory":
+        parser.error("--lazy only applies to the memory backend")
+    if args.backend == "sqlite":
+        runner = SqliteBatchRunner(args.directories, args.workers, args.db)
+    else:
+        runner = BatchRunner(args.directories, args.workers, None if args.no_cache else DEFAULT_CACHE_DIR,
+                             args.lazy)
+    try:
+        results = runner.load()
+    except OSError as e:
+        parser.error(str(e))
+
+    out = sys.stdout
+    if args.command == "load":
+        writer = RecordWriter(out, args.format, LOAD_COLUMNS)
+        for result in results:
+            writer.write({
+                "csv_filename": result.csv_filename,
+                "rows": result.rows,
+                "source": "cache" if result.cached else "parsed",
+                "seconds": round(result.seconds, 6),
+                "error": result.error
+            })
+        return 0 if all(result.error is None for result in results) else 1
+
+    # Load problems go to stderr so stdout only holds records
+    for result in results:
+        if result.error is not None:
+            print(result, file=sys.stderr)
+
+    if args.command == "batch":
+        writer = RecordWriter(out, args.format, ("query",) + FIELDS)
+        if args.queries == "-":
+            return 1 if runner.run_batch(sys.stdin, writer) else 0
+        with open(args.queries, 'r') as queries_file:
+            return 1 if runner.run_batch(queries_file, writer) else 0
+
+    writer = RecordWriter(out, args.format, FIELDS)
+    with metrics.timer("batch.query"):
+        try:
+            results = runner.query(args)
+        except ValueError as e:
+            parser.error(str(e))
+        for timetable_data in results:
+            writer.write(timetable_data.get_items())
+    return 0
+
+
 if __name__ == "__main__":
-    main = Main()
-    main.run()
+    try:
+        sys.exit(main())
+    except BrokenPipeError:
+        # The reader closed the pipe early (e.g. head), stop without a traceback
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
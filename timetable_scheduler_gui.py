@@ -1,279 +1,567 @@
-import csv
 import os
-from datetime import datetime
+import queue
+import sys
+import threading
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog, messagebox
-from openpyxl import Workbook
-from reportlab.lib.pagesizes import landscape, letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
-from reportlab.platypus import PageBreak
-
+from datetime import datetime
+from timetable_index import (PrefixTrie, build_datetime_index, build_field_indexes, build_session_indexes,
+                             next_sessions, sessions_between, top_k)
+from timetable_keys import datetime_key, day_range_keys, parse_date_ordinal, parse_time_minutes, week_range
+from timetable_clash import find_clashes, format_minutes
+from timetable_cache import DEFAULT_CACHE_DIR, ParsedDataCache, file_signature
+from timetable_loader import OperationCancelled, list_csv_files, load_stores, scan_changes
+from timetable_metrics import metrics, timed, write_report
+from timetable_query import Contains, Equals, query_files, range_predicate
+from timetable_query_cache import QueryCache
+from timetable_store import TimetableStore, TimetableRow, row_views
+
+
+# Display names used by the GUI and the raw store field behind each of them
+DISPLAY_FIELDS = {
+    'Module Name': "Description",
+    'Module Code': "Module_Code",
+    'Study Mode': "Study_Mode",
+    'Cohort': "Cohort",
+    'Location': "Allocated_Location_Name",  # Shown together with Zone_Name
+    'Planned Size': "Planned_Size",
+    'Lecturer': "Allocated_Staff_Name",
+    'Scheduled Date': "Activity_Dates_Individual",
+    'Scheduled Day': "Scheduled_Days",
+    'Lecture Start Time': "Scheduled_Start_Time",
+    'Lecture End Time': "Scheduled_End_Time",
+    'Duration': "Duration",
+    'Class Type': "Class_Type"
+}
+
+
+# Manage and Get Timetable Data, a lightweight view of one row of a TimetableStore
+class TimetableData(TimetableRow):
+    __slots__ = ()
 
-# Manage and Get Timetable Data
-class TimetableData:
     def __init__(self, Description, Module_Code, Study_Mode, Cohort, Allocated_Location_Name, Planned_Size, Allocated_Staff_Name, Zone_Name, Activity_Dates_Individual, Scheduled_Days, Scheduled_Start_Time, Scheduled_End_Time, Duration, Class_Type):
-        self.__Description = Description
-        self.__Module_Code = Module_Code
-        self.__Study_Mode = Study_Mode
-        self.__Cohort = Cohort
-        self.__Allocated_Location_Name = Allocated_Location_Name
-        self.__Planned_Size = Planned_Size
-        self.__Allocated_Staff_Name = Allocated_Staff_Name
-        self.__Zone_Name = Zone_Name
-        self.__Activity_Dates_Individual = Activity_Dates_Individual
-        self.__Scheduled_Days = Scheduled_Days
-        self.__Scheduled_Start_Time = Scheduled_Start_Time
-        self.__Scheduled_End_Time = Scheduled_End_Time
-        self.__Duration = Duration
-        self.__Class_Type = Class_Type
+        super().__init__(Description, Module_Code, Study_Mode, Cohort, Allocated_Location_Name, Planned_Size, Allocated_Staff_Name,
+                         Zone_Name, Activity_Dates_Individual, Scheduled_Days, Scheduled_Start_Time, Scheduled_End_Time, Duration, Class_Type)
+
+    def get_display_item(self, name):
+        # Read a single display value without building the get_items() dict
+        if name == 'Location':
+            return f"{self.get_item('Allocated_Location_Name')}({self.get_item('Zone_Name')})"
+        return self.get_item(DISPLAY_FIELDS[name])
 
     def get_items(self):
         # Return all attributes as a dictionary
-        return {
-            'Module Name': self.__Description,
-            'Module Code': self.__Module_Code,
-            'Study Mode': self.__Study_Mode,
-            'Cohort': self.__Cohort,
-            'Location': f"{self.__Allocated_Location_Name}({self.__Zone_Name})",
-            'Planned Size': self.__Planned_Size,
-            'Lecturer': self.__Allocated_Staff_Name,
-            'Scheduled Date': self.__Activity_Dates_Individual,
-            'Scheduled Day': self.__Scheduled_Days,
-            'Lecture Start Time': self.__Scheduled_Start_Time,
-            'Lecture End Time': self.__Scheduled_End_Time,
-            'Duration': self.__Duration,
-            'Class Type': self.__Class_Type
-        }
+        return {name: self.get_display_item(name) for name in DISPLAY_FIELDS}
+
+
+def display_values(timetable_data):
+    # Values of one row in Treeview column order
+    return tuple(timetable_data.get_display_item(name) for name in DISPLAY_FIELDS)
+
+
+def display_value(data, name, row):
+    # Display value of one row, as compared by the query predicates
+    return data["timetable_data_list"][row].get_display_item(name)
+
+
+def display_columns(store):
+    # Columns of the store keyed by display name, with Location joined to its zone
+    columns = {name: store.columns[field] for name, field in DISPLAY_FIELDS.items()}
+    interned = {}
+    columns['Location'] = [
+        interned.setdefault(location, location) for location in (
+            f"{name}({zone})" for name, zone in zip(store.columns["Allocated_Location_Name"], store.columns["Zone_Name"]))
+    ]
+    return columns
 
 
 # Implement Heap Sort and Binary Search Algorithm
 class DataManager:
-    def __init__(self):
-        self.timetable_manager = TimetableManager()
-
-    # 'reverse' parameter for descending and 'key' parameter to specify sorting key
-    def heapify(self, arr, n, i, reverse=False, key=lambda x: x):
+    def __init__(self, cache=None, query_cache=None):
+        self.timetable_manager = TimetableManager(cache=cache)
+        # Results of repeated searches and sorts, dropped whenever the data changes
+        self.query_cache = query_cache if query_cache is not None else QueryCache()
+
+    def cached(self, key, compute):
+        return self.query_cache.lookup(key, self.timetable_manager.generation, compute)
+
+    @timed("query.search")
+    def search(self, search_key, search_criteria):
+        # binary_search_all through the query cache
+        return self.cached(("search", search_criteria, search_key),
+                           lambda: self.binary_search_all(search_key, search_criteria))
+
+    @timed("query.prefix")
+    def prefix_search(self, prefix, search_criteria):
+        # Rows whose value starts with 'prefix' ignoring case, i.e. every value
+        # the autocomplete offers, in file and CSV order
+        def compute():
+            values = self.timetable_manager.suggestions[search_criteria].complete(prefix)
+            results = []
+            for data in self.timetable_manager.data_by_file.values():
+                index = data["indexes"][search_criteria]
+                timetable_data_list = data["timetable_data_list"]
+                positions = sorted(position for value in values for position in index.lookup(value))
+                results.extend(timetable_data_list[position] for position in positions)
+            return results
+        return self.cached(("prefix", search_criteria, prefix.casefold()), compute)
+
+    @timed("query.filter")
+    def filter(self, predicates):
+        # Rows matching every predicate, planned per file from the indexes
+        return self.cached(("filter",) + tuple(predicate.key() for predicate in predicates),
+                           lambda: query_files(self.timetable_manager.data_by_file, predicates, display_value))
+
+    @timed("sort")
+    def sort_results(self, query, data, sort_attribute, reverse, key, first=None):
+        # Sort the rows of 'query' (or keep the first 'first' of them) without
+        # changing 'data'. Cached unless query is None, e.g. for time-dependent results.
+        def compute():
+            if first is not None:
+                # Only the first rows are shown, so keep them with a bounded heap
+                return self.top_k(data, first, reverse=reverse, key=key)
+            sorted_data = list(data)
+            self.heap_sort(sorted_data, reverse=reverse, key=key)
+            return sorted_data
+
+        if query is None:
+            return compute()
+        return self.cached(("sort",) + query + (sort_attribute, reverse, first), compute)
+
+    # 'reverse' parameter for descending, 'keys' holds the pre-computed sort key of each element
+    def heapify(self, arr, keys, n, i, reverse=False):
         largest = i     # Initialize largest as root
         leftChild = 2 * i + 1
         rightChild = 2 * i + 2
 
         # Detect if left child of root exists and which is greater than root
-        if leftChild < n and ((key(arr[i].get_items()) < key(arr[leftChild].get_items())) if not reverse else (key(arr[i].get_items()) > key(arr[leftChild].get_items()))):
+        if leftChild < n and ((keys[i] < keys[leftChild]) if not reverse else (keys[i] > keys[leftChild])):
             largest = leftChild
 
-        if rightChild < n and ((key(arr[largest].get_items()) < key(arr[rightChild].get_items())) if not reverse else (key(arr[largest].get_items()) > key(arr[rightChild].get_items()))):
+        if rightChild < n and ((keys[largest] < keys[rightChild]) if not reverse else (keys[largest] > keys[rightChild])):
             largest = rightChild
 
-        # If the largest element is not the root, swap them
+        # If the largest element is not the root, swap them together with their keys
         if largest != i:
             arr[i], arr[largest] = arr[largest], arr[i]     # Swap the elements
-            self.heapify(arr, n, largest, reverse, key)
+            keys[i], keys[largest] = keys[largest], keys[i]
+            self.heapify(arr, keys, n, largest, reverse)
 
-    # The main function to heap sort an array
+    # The main function to heap sort an array, 'key' is evaluated once per element
+    @timed("sort.heap_sort")
     def heap_sort(self, arr, reverse=False, key=lambda x: x):
         n = len(arr)
+        # The position breaks ties, so equal keys keep their input order as in top_k
+        keys = [(key(item), -i if reverse else i) for i, item in enumerate(arr)]
 
         # Build a max-heap
         for i in range(n // 2 - 1, -1, -1):
-            self.heapify(arr, n, i, reverse, key)
+            self.heapify(arr, keys, n, i, reverse)
 
         # Swap the root (largest element) with the current last element
         for i in range(n - 1, 0, -1):
             arr[i], arr[0] = arr[0], arr[i]     # Swap
-            self.heapify(arr, i, 0, reverse, key)
+            keys[i], keys[0] = keys[0], keys[i]
+            self.heapify(arr, keys, i, 0, reverse)
+
+    # First k elements in sort order, without sorting all of arr
+    @timed("sort.top_k")
+    def top_k(self, arr, k, reverse=False, key=lambda x: x):
+        return top_k(arr, k, key=key, reverse=reverse)
+
+    @timed("query.next_sessions")
+    def next_sessions(self, field, value, n, now=None):
+        # Next n sessions of a lecturer, location or cohort starting at or after
+        # 'now', read from the per-value chronological indexes of every file
+        now = now or datetime.now()
+        key = datetime_key(now.toordinal(), now.hour * 60 + now.minute)
+        sources = []
+        for data in self.timetable_manager.data_by_file.values():
+            index = data["session_indexes"][field].get(value)
+            if index is not None:
+                sources.append((index, data["timetable_data_list"]))
+        return next_sessions(sources, key, n)
+
+    @timed("query.between")
+    def schedules_between(self, start_ordinal, end_ordinal):
+        # Rows of every file from the start date to the end date inclusive, in
+        # chronological order, bisected from each file's datetime index
+        def compute():
+            sources = [(data["datetime_index"], data["timetable_data_list"])
+                       for data in self.timetable_manager.data_by_file.values()]
+            return sessions_between(sources, *day_range_keys(start_ordinal, end_ordinal))
+        return self.cached(("between", start_ordinal, end_ordinal), compute)
+
+    @timed("query.clashes")
+    def find_clashes(self):
+        # Double-booked rooms and lecturers across every loaded file
+        return find_clashes(self.timetable_manager.data_by_file)
 
     def binary_search(self, csv_filename, search_key, search_criteria):
-        data = self.timetable_manager.data_by_file[csv_filename]["timetable_data_list"]
-
-        # Initialize the left and right pointers for binary search
-        left, right = 0, len(data) - 1
-
+        data = self.timetable_manager.data_by_file[csv_filename]
+        timetable_data_list = data["timetable_data_list"]
+        if not timetable_data_list:
+            return []
+
+        # Bisect the sorted index of the search criteria, which was built
+        # when the file was loaded, to get every matching row
+        positions = data["indexes"][search_criteria].lookup(search_key)
+        return [timetable_data_list[position] for position in positions]
+
+    def binary_search_all(self, search_key, search_criteria):
+        # Exact-match lookup across every loaded file
         results = []
+        for csv_filename in self.timetable_manager.data_by_file:
+            results.extend(self.binary_search(
+                csv_filename, search_key, search_criteria))
+        return results
 
-        while left <= right:
-            # Calculate the middle index
-            mid = (left + right) // 2
 
-            # Get the value of the search criteria for the current item at the middle index
-            current_item = data[mid].get_items()[search_criteria]
+# Filter the Timetable Data Items
+class TimetableManager:
+    # Fields with a chronological index per value, for "next N sessions" queries
+    SESSION_FIELDS = ("Lecturer", "Location", "Cohort")
 
-            # Check if the current item matches the search key
-            if current_item == search_key:
-                results.append(data[mid])
+    # Entries of data_by_file that hold indexes, saved to the cache with the store
+    INDEX_KEYS = ("indexes", "session_indexes", "datetime_index")
 
-                # Continue searching for additional matches to the left of the current item
-                left = mid - 1
-                while left >= 0 and data[left].get_items()[search_criteria] == search_key:
-                    results.append(data[left])
-                    left -= 1
+    def __init__(self, cache=None):
+        self.data_by_file = {}
+        # Optional ParsedDataCache used to skip re-parsing unchanged files
+        self.cache = cache
+        # Autocomplete over the distinct values of each field in the loaded files
+        self.suggestions = {name: PrefixTrie() for name in DISPLAY_FIELDS}
+        # Bumped whenever data_by_file changes, cached query results of older
+        # generations are never served
+        self.generation = 0
+        # Signatures of the files that failed to load, see record_failures
+        self.failed_signatures = {}
+
+    def indexes_key(self):
+        # Identifies how cached indexes were built, so they are only reused when they match
+        return "gui"
 
-                right = mid + 1
-                while right < len(data) and data[right].get_items()[search_criteria] == search_key:
-                    results.append(data[right])
-                    right += 1
+    def data_filter(self, csv_filename):
+        # Read the file from the cache when it is unchanged
+        if self.cache is not None:
+            entry = self.cache.load(csv_filename, self.indexes_key())
+            if entry is not None:
+                self.set_file_data(csv_filename, entry.store, entry.indexes,
+                                   file_signature(csv_filename))
+                return
+
+        # Otherwise parse it into a column store and (re)build its indexes
+        signature = file_signature(csv_filename)
+        self.set_file_data(csv_filename, TimetableStore.from_csv(csv_filename), signature=signature)
+        self.save_to_cache(csv_filename, self.data_by_file[csv_filename])
+
+    @timed("load")
+    def prepare_files(self, csv_filepaths, workers=None, progress=None, cancelled=None):
+        # Parse the files in parallel and build their entries without touching
+        # data_by_file, so this can run off the main thread
+        results = load_stores(csv_filepaths, workers, self.cache, self.indexes_key(),
+                              progress, cancelled)
+        prepared = []
+        for result in results:
+            if result.error is None:
+                data = self.build_file_data(result.store, result.indexes, result.signature)
+                if not result.cached:
+                    self.save_to_cache(result.csv_filename, data)
+                prepared.append((result.csv_filename, data))
+        return results, prepared
+
+    def load_files(self, csv_filepaths, workers=None):
+        # Parse the files in parallel, then merge them in the given order
+        results, prepared = self.prepare_files(csv_filepaths, workers)
+        self.record_failures(results)
+        self.add_files(prepared)
+        return results
 
-                # Break out of the loop, as it found all matching items
-                break
-            elif current_item < search_key:
-                # If the current item is less than the search key, update the left pointer
-                left = mid + 1
+    def prepare_refresh(self, directories, workers=None, progress=None, cancelled=None):
+        # Re-parse only the CSV files added or modified in the directories since
+        # they were loaded. Indexes are per file, so the unchanged files keep theirs.
+        changes = scan_changes(self.data_by_file, directories, self.failed_signatures)
+        changes.results, changes.prepared = self.prepare_files(
+            changes.added + changes.modified, workers, progress, cancelled)
+        return changes
+
+    def apply_changes(self, changes):
+        # Drop the deleted files and the ones that no longer load, then install
+        # the re-parsed ones in one step
+        self.record_failures(changes.results)
+        for csv_filename in changes.removed:
+            self.remove_file(csv_filename)
+        for result in changes.results:
+            if result.error is not None:
+                self.remove_file(result.csv_filename)
+        self.add_files(changes.prepared)
+
+    def record_failures(self, results):
+        # Remember the signature of each file that failed to load, so a refresh
+        # only retries it once the file changes again
+        for result in results:
+            if result.error is None:
+                self.failed_signatures.pop(result.csv_filename, None)
             else:
-                right = mid - 1
+                self.failed_signatures[result.csv_filename] = result.signature
 
-        return results
+    def refresh(self, directories, workers=None):
+        changes = self.prepare_refresh(directories, workers)
+        self.apply_changes(changes)
+        return changes
+
+    def save_to_cache(self, csv_filename, data):
+        if self.cache is None:
+            return
+        indexes = {key: data[key] for key in self.INDEX_KEYS}
+        self.cache.save(csv_filename, data["signature"], data["store"], indexes, self.indexes_key())
+
+    def set_file_data(self, csv_filename, store, indexes=None, signature=None):
+        self.add_files([(csv_filename, self.build_file_data(store, indexes, signature))])
+
+    def add_files(self, prepared):
+        # Install (csv_filename, data) entries, replacing any earlier version of
+        # the file in place so the file order is kept
+        for csv_filename, data in prepared:
+            old_data = self.data_by_file.get(csv_filename)
+            if old_data is not None:
+                self.update_suggestions(old_data, -1)
+            self.data_by_file[csv_filename] = data
+            self.update_suggestions(data, 1)
+            self.generation += 1
+
+    def remove_file(self, csv_filename):
+        data = self.data_by_file.pop(csv_filename, None)
+        if data is not None:
+            self.update_suggestions(data, -1)
+            self.generation += 1
+
+    def update_suggestions(self, data, count):
+        # The sorted field indexes already hold each file's distinct values
+        for name, trie in self.suggestions.items():
+            for value in data["indexes"][name].keys:
+                trie.add(value, count)
+
+    def build_file_data(self, store, indexes=None, signature=None):
+        # Build the indexes unless they were read from the cache
+        if indexes is None:
+            with metrics.timer("index.build"):
+                columns = display_columns(store)
+                indexes = {
+                    "indexes": build_field_indexes(columns),
+                    "session_indexes": build_session_indexes(store, columns, self.SESSION_FIELDS),
+                    "datetime_index": build_datetime_index(store)
+                }
+
+        # Initialize the timetable data dictionary for this file, the row
+        # views and indexes all read from the store's columns
+        return {
+            "store": store,
+            "signature": signature,     # (size, mtime) of the file when it was read
+            "timetable_data_list": row_views(store, TimetableData),
+            **indexes
+        }
 
 
-# Filter the Timetable Data Items
-class TimetableManager:
+# Treeview that only holds the rows in view, refilled from a backing list on scroll
+class VirtualTable:
+    # Rows kept below the viewport so partly visible rows are filled too
+    BUFFER_ROWS = 5
+    HEADER_HEIGHT = 25
+
+    def __init__(self, tree, scrollbar):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.rows = []      # Backing view, e.g. all schedules or the current results
+        self.offset = 0     # Index of the first visible row
+        self.slots = []     # Treeview items reused for whichever rows are in view
+        self.row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+
+        self.scrollbar.configure(command=self.yview)
+        self.tree.bind("<Configure>", lambda event: self.redraw())
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", self.on_mousewheel)
+        self.tree.bind("<Button-5>", self.on_mousewheel)
+        self.tree.bind("<Prior>", lambda event: self.yview("scroll", -1, "pages"))
+        self.tree.bind("<Next>", lambda event: self.yview("scroll", 1, "pages"))
+
+    def visible_rows(self):
+        return max(1, (self.tree.winfo_height() - self.HEADER_HEIGHT) // self.row_height)
+
+    def set_rows(self, rows):
+        # Swap the backing view, only the visible rows are redrawn
+        self.rows = rows
+        self.offset = 0
+        self.redraw()
+
+    @timed("treeview.redraw")
+    def redraw(self):
+        count = min(self.visible_rows() + self.BUFFER_ROWS, len(self.rows) - self.offset)
+        count = max(count, 0)
+
+        # Grow or shrink the pool of Treeview items to the number of rows in view
+        while len(self.slots) < count:
+            self.slots.append(self.tree.insert("", "end", values=()))
+        if len(self.slots) > count:
+            self.tree.delete(*self.slots[count:])
+            del self.slots[count:]
+
+        for i, item_id in enumerate(self.slots):
+            self.tree.item(item_id, values=display_values(self.rows[self.offset + i]))
+        self.update_scrollbar()
+
+    def update_scrollbar(self):
+        if not self.rows:
+            self.scrollbar.set(0.0, 1.0)
+            return
+        first = self.offset / len(self.rows)
+        last = min(1.0, (self.offset + self.visible_rows()) / len(self.rows))
+        self.scrollbar.set(first, last)
+
+    def scroll_to(self, offset):
+        offset = max(0, min(offset, len(self.rows) - self.visible_rows()))
+        if offset != self.offset:
+            self.offset = offset
+            self.tree.selection_remove(*self.tree.selection())
+            self.redraw()
+
+    def yview(self, *args):
+        # Scrollbar command: ("moveto", fraction) or ("scroll", amount, "units"/"pages")
+        if args[0] == "moveto":
+            self.scroll_to(round(float(args[1]) * len(self.rows)))
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= self.visible_rows()
+            self.scroll_to(self.offset + amount)
+
+    def on_mousewheel(self, event):
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self.yview("scroll", -3, "units")
+        else:
+            self.yview("scroll", 3, "units")
+        return "break"
+
+
+# Work running on a background thread. It only reports through the queue, the
+# Tk widgets are updated from the main thread when JobRunner polls it.
+class BackgroundJob:
     def __init__(self):
-        self.data_by_file = {}
+        self.cancel_event = threading.Event()
+        self.messages = queue.Queue()
 
-    def data_filter(self, csv_filename):
-        # Initialize the timetable data dictionary for this file
-        self.data_by_file[csv_filename] = {
-            "timetable_data_list": []
-        }
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def report(self, fraction, text):
+        self.messages.put(("progress", fraction, text))
+
+    def file_progress(self, done, total, csv_filename):
+        # progress callback for load_stores
+        self.report(done / total, f"Loaded {done} of {total}: {os.path.basename(csv_filename)}")
 
-        with open(csv_filename, 'r') as csv_file:
-            csv_reader = csv.reader(csv_file)
-            for column in csv_reader:
-                name = column[1]
-                parts = name.split("_")
-                # Check if there are enough parts before accessing indices. Prevent (IndexError: list index out of range)
-                if len(parts) >= 2:
-                    timetable_data = TimetableData(
-                        Description=column[2],
-                        Module_Code=parts[3],
-                        Study_Mode=parts[2],
-                        Cohort=parts[0] + " " + parts[1],
-                        Allocated_Location_Name=column[8],
-                        Planned_Size=column[9],
-                        Allocated_Staff_Name=column[10],
-                        Zone_Name=column[11],
-                        Activity_Dates_Individual=column[3],
-                        Scheduled_Days=column[4],
-                        Scheduled_Start_Time=column[5],
-                        Scheduled_End_Time=column[6],
-                        Duration=column[7],
-                        Class_Type=parts[4]
-                    )
-
-                    data = self.data_by_file[csv_filename]
-                    data["timetable_data_list"].append(timetable_data)
+
+# Runs one BackgroundJob at a time and applies its result on the Tk thread
+class JobRunner:
+    POLL_MS = 50
+
+    def __init__(self, root, on_progress, on_busy):
+        self.root = root
+        self.on_progress = on_progress  # on_progress(fraction, text)
+        self.on_busy = on_busy          # on_busy(busy, text, determinate)
+        self.job = None
+
+    @property
+    def busy(self):
+        return self.job is not None
+
+    def start(self, text, work, on_done, determinate=False):
+        # work(job) runs on a worker thread and must not touch any widget,
+        # on_done(result) runs on the Tk thread once it has finished
+        if self.busy:
+            return False
+        job = self.job = BackgroundJob()
+        self.on_busy(True, text, determinate)
+
+        def run():
+            try:
+                result = work(job)
+            except OperationCancelled:
+                job.messages.put(("cancelled",))
+            except Exception as e:
+                job.messages.put(("error", e))
+            else:
+                job.messages.put(("done", result))
+
+        threading.Thread(target=run, daemon=True).start()
+        self.root.after(self.POLL_MS, self.poll, job, on_done)
+        return True
+
+    def poll(self, job, on_done):
+        while True:
+            try:
+                message = job.messages.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "progress":
+                self.on_progress(message[1], message[2])
+                continue
+
+            self.job = None
+            if message[0] == "error":
+                self.on_busy(False, "Failed", True)
+                messagebox.showerror("Error", str(message[1]))
+            elif message[0] == "cancelled" or job.cancelled():
+                # Results that finish after Cancel was pressed are dropped
+                self.on_busy(False, "Cancelled", True)
+            else:
+                self.on_busy(False, "", True)
+                on_done(message[1])
+            return
+        self.root.after(self.POLL_MS, self.poll, job, on_done)
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel_event.set()
 
 
 # Implementation of the GUI
 class Window:
-
-    search_term_suggestions = {
-        "Module Name": [
-            "SET Computer Hacking Forensics Investigator (CHFI)",
-            "SET Data Communication & Networking (DCNG)",
-            "SET Data Communication & Networking",
-            "SET Database Design & Modelling (DDMG)",
-            "SET Database Design & Modelling",
-            "SET Discrete Mathematics (DM)",
-            "SET Ethical Hacking & Countermeasures (EHC)",
-            "SET Introduction to Computer Operating Systems (Group A)",
-            "SET Information Systems and the Organisations (ISOG)",
-            "SET Introduction to Software Engineering (ISEG)",
-            "SET Introduction to Programming (IP)",
-            "SET Network Defense (ND)",
-            "SET Security Specialist (SS)"
-        ],
-        "Module Code": [
-            "CHFI",
-            "DDMG",
-            "DCNG",
-            "DDMG",
-            "DM",
-            "EHC",
-            "ICOS",
-            "IP",
-            "ISEG",
-            "ISOG",
-            "ND",
-            "SS"
-        ],
-        "Study Mode": [
-            "FT", "PT"
-        ],
-        "Cohort": ["DICT-DNDFC 221"],
-        "Location": [
-            "A01(Marina)",
-            "B05/B06(Marina)",
-            "C01(Jackson)",
-            "C02/C03(Jackson)",
-            "D01(Jackson)",
-            "D03(Jackson)",
-            "D06(Jackson)",
-            "LT3(Marina)",
-            "MBA1(Marina)",
-            "Online Learning(Marina)",
-            "Online Learning(Jackson)"
-        ],
-        "Planned Size": [
-            "20", "24", "30", "48", "50", "60", "80", "84", "90", "100"
-        ],
-        "Lecturer": [
-            "Ankit Saurabh",
-            "Chang Wing Hong Edmund",
-            "Dr Liau Vui Kien",
-            "Dr Tan Boon Leing",
-            "Kelvin Wu",
-            "Lee Han John",
-            "Lau Jun Tian Terence",
-            "Ong Chin Ann",
-            "Yegna Ramanchandran Vijayalakshmi",
-            "Yee Sook Liang"
-        ],
-        "Scheduled Day": [
-            "Monday", "Tuesday", "Wednesday", "Thursday", "Friday"
-        ],
-        "Lecture Start Time": [
-            "8:30:00",
-            "08:30:00",
-            "12:00:00",
-            "13:00:00",
-            "15:30:00",
-            "19:00:00"
-        ],
-        "Lecture End Time": [
-            "11:30:00",
-            "15:00:00",
-            "15:30:00",
-            "18:00:00",
-            "18:30:00",
-            "22:00:00"
-        ],
-        "Duration": [
-            "2:30",
-            "03:00",
-            "3:00",
-            "3:30"
-        ],
-        "Class Type": [
-            "Lab02GrpA/1", "Lec09", "Lec15", "Lab03GrpA/1", "Lec12", "Lec06A/1", "Lab03GrpB/1", "Lec01", "Lec06",
-            "Lec04B/1", "Lec06B/1", "Lab02GrpB/1", "Lec10", "Lec08 (Lab Grp1)", "Lab05GrpB/1", "Lab05GrpA/1", "Lec04",
-            "Lab04GrpB/1", "Lec07", "Lab04GrpA/1", "Lec04A/1", "Lab01GrpB/1", "Lab01GrpA/1", "Lec02", "Lab02Grp01/1",
-            "Lec01/1 (Group B)", "Lec01/1", "Lab04Grp01/1", "Lab05Grp01/1", "Lab06Grp01/1", "Lec01/1 (Group A)",
-            "Lec02/1 (Group B)", "Lec02/1", "Lec02/1 (Group A)", "Lab01Grp02/1", "Lab03Grp02/1", "Lab02Grp03/1", "Lec03/1",
-            "Lab03Grp03/1", "Lec03/1 (Group B)", "Lec03/1 (Group A)", "Lec04/1", "Lec04/1 (Group A)", "Lec04/1 (Group B)",
-            "Lec05/1", "Lec05/1 (Group B)", "Lec05/1 (Group A)", "Lec06/1 (Group B)", "Lec06/1 (Group A)", "Lec06/1",
-            "Lec07/1 (Group A)", "Lec07/1 (Group B)", "Lec07/1", "Lec08/1", "Lec08/1 (Group A)", "Lec08/1 (Group B)",
-            "Lec09/1 (Group B)", "Lec09/1", "Lec09/1 (Group A)", "Lec10/1 (Group B)", "Lec10/1", "Lec11/1", "Lec11/1 (Group A)",
-            "Lec11/1 (Group B)", "Lec12/1 (Group A)", "Lec12/1 (Group B)", "Lec12/1", "Lec13/1 (Group B)", "Lec13/1 (Group A)",
-            "Lec13/1", "Lec14/1", "Lec14/1 (Group A)", "Lec14/1 (Group B)", "Lec15/1 (Group A)", "Lec15/1", "Lec15/1 (Group B)",
-            "Lec11 (Lab Grp 1)", "Lec05 (Lab Grp 1)", "Lec14 (Lab Grp 1)", "Lec13 (Lab Grp 1)", "Lec03 (Lab Grp 1)",
-            "Lec13 (Lab Grp 2)", "Lec11 (Lab Grp 2)", "Lec08 (Lab Grp 2)", "Lec14 (Lab Grp 2)", "Lec03 (Lab Grp 2)", "Lec05 (Lab Grp 2)"
-        ]
+    # How often the loaded folders are polled for changed CSV files while watching
+    WATCH_INTERVAL_MS = 5000
+
+    # How often the metrics status bar is refreshed while metrics are on
+    STATUS_INTERVAL_MS = 500
+
+    # Delay after the last keystroke before the suggestions are filtered
+    SUGGEST_DELAY_MS = 150
+    SUGGESTION_LIMIT = 50
+
+    # Export grouping option -> display field naming each row's group. Excel puts
+    # each group on its own sheet, PDF on its own pages or in its own document.
+    EXPORT_GROUPS = {
+        "No Grouping": None,
+        "By Module": "Module Code",
+        "By Cohort": "Cohort",
+        "By Lecturer": "Lecturer",
+        "By Location": "Location"
     }
 
-    def __init__(self, root):
-        self.timetable_manager = DataManager()
+    # Field conditions offered by the filter panel
+    FILTER_ROWS = 4
+    FILTER_MATCHES = ("equals", "contains")
+
+    PDF_COLUMN_WIDTHS = [
+        130, 40, 40, 80, 80, 40, 50, 50, 50, 60, 60, 30, 50
+    ]
+
+    def __init__(self, root, workers=None, cache_dir=DEFAULT_CACHE_DIR):
+        # Pass cache_dir=None to always re-parse the CSV files
+        self.timetable_manager = DataManager(
+            cache=ParsedDataCache(cache_dir) if cache_dir else None)
         self.folder_paths = []
+        self.workers = workers
 
         self.root = root
         self.root.title("Timetable Viewer & Generator")
@@ -285,6 +573,16 @@ class Window:
         self.folder_path_label.pack()
 
         self.searched_data = []
+        # Identifies the search behind searched_data so sorting it can be cached,
+        # None when the results cannot be reproduced (e.g. next sessions)
+        self.searched_query = None
+
+        self.loaded_data = []
+        self.showing_all = False
+
+        # Filter panel window and its (field, match, value) widgets, built on first use
+        self.filter_panel = None
+        self.filter_rows = []
 
         # Create a frame of the treeview
         tree_frame = tk.Frame(root)
@@ -328,9 +626,8 @@ class Window:
         self.tree.heading("#12", text="Duration")
         self.tree.heading("#13", text="Class Type")
 
-        # Create vertical scrollbar
-        v_scrollbar = ttk.Scrollbar(
-            tree_frame, orient="vertical", command=self.tree.yview)
+        # Create vertical scrollbar, it scrolls the virtual table's backing rows
+        v_scrollbar = ttk.Scrollbar(tree_frame, orient="vertical")
         v_scrollbar.pack(side="right", fill="y")
 
         # Create horizontal scrollbar
@@ -338,11 +635,13 @@ class Window:
             tree_frame, orient="horizontal", command=self.tree.xview)
         h_scrollbar.pack(side="bottom", fill="x")
 
-        self.tree.configure(yscrollcommand=v_scrollbar.set)
         self.tree.configure(xscrollcommand=h_scrollbar.set)
 
         self.tree.pack(fill=tk.BOTH, expand=True)
 
+        # Only the rows in view exist in the Treeview, however many are loaded
+        self.table = VirtualTable(self.tree, v_scrollbar)
+
         # Create a frame for buttons
         button_frame = tk.Frame(root)
         button_frame.pack(pady=15)
@@ -355,6 +654,17 @@ class Window:
             button_frame, text="Add CSV Folder", command=self.add_csv_folder)
         add_folder_button.grid(row=0, column=3, padx=10, pady=20)
 
+        refresh_button = tk.Button(
+            button_frame, text="Refresh", command=self.refresh_data)
+        refresh_button.grid(row=0, column=2, padx=10, pady=20)
+
+        # Poll the loaded folders and refresh automatically while checked
+        self.watch_var = tk.BooleanVar(value=False)
+        self.watch_job = None
+        watch_checkbutton = tk.Checkbutton(
+            button_frame, text="Watch Folders", variable=self.watch_var, command=self.toggle_watch)
+        watch_checkbutton.grid(row=0, column=4, padx=10, pady=20)
+
         self.criteria_label = tk.Label(
             button_frame, text="Select Search Criteria:")
         self.criteria_label.grid(row=1, column=0, padx=10, pady=10)
@@ -385,9 +695,11 @@ class Window:
         search_label = tk.Label(button_frame, text="Search Term:", width=10)
         search_label.grid(row=1, column=2, padx=10, pady=10)
 
-        # Create an entry widget for search term
+        # Create an entry widget for search term, its suggestions follow what is typed
         self.search_entry = ttk.Combobox(button_frame, width=35)
         self.search_entry.grid(row=1, column=3, padx=10, pady=10)
+        self.search_entry.bind("<KeyRelease>", self.schedule_suggestions)
+        self.suggest_job = None
 
         search_button = tk.Button(
             button_frame, text="Search", command=self.display_searched_data)
@@ -427,7 +739,7 @@ class Window:
         sort_order_label.grid(row=3, column=2, padx=10, pady=10)
 
         self.export_options = ttk.Combobox(
-            button_frame, values=["Excel (.xlsx)", "PDF (.pdf)"])
+            button_frame, values=["Excel (.xlsx)", "PDF (.pdf)", "PDF per Group (.zip)"])
         self.export_options.set("Excel (.xlsx)")
         self.export_options.grid(row=3, column=3, padx=10, pady=10)
 
@@ -435,33 +747,116 @@ class Window:
             button_frame, text="Export", command=self.export_data)
         export_button.grid(row=3, column=4, padx=10, pady=10)
 
+        # Exports can split the schedules per module, cohort, lecturer or location
+        self.export_group_var = tk.StringVar()
+        self.export_group_var.set("No Grouping")
+        export_group_combobox = ttk.Combobox(
+            button_frame, textvariable=self.export_group_var, values=list(self.EXPORT_GROUPS))
+        export_group_combobox.grid(row=3, column=0, padx=10, pady=10)
+
+        show_first_label = tk.Label(button_frame, text="Show First:")
+        show_first_label.grid(row=4, column=0, padx=10, pady=10)
+
+        # Number of rows kept by Sort and Next Sessions, blank shows all sorted rows
+        self.show_first_entry = tk.Entry(button_frame, width=8)
+        self.show_first_entry.grid(row=4, column=1, padx=10, pady=10)
+
+        next_sessions_button = tk.Button(
+            button_frame, text="Next Sessions", command=self.display_next_sessions)
+        next_sessions_button.grid(row=4, column=3, padx=10, pady=10)
+
+        clash_button = tk.Button(
+            button_frame, text="Clash Report", command=self.show_clash_report)
+        clash_button.grid(row=4, column=4, padx=10, pady=10)
+
+        dates_label = tk.Label(button_frame, text="Dates (DD/MM/YYYY):")
+        dates_label.grid(row=5, column=0, padx=10, pady=10)
+
+        # Inclusive date range shown by Between Dates
+        dates_frame = tk.Frame(button_frame)
+        dates_frame.grid(row=5, column=1, columnspan=2, padx=10, pady=10)
+        self.start_date_entry = tk.Entry(dates_frame, width=12)
+        self.start_date_entry.pack(side="left")
+        tk.Label(dates_frame, text="to").pack(side="left", padx=5)
+        self.end_date_entry = tk.Entry(dates_frame, width=12)
+        self.end_date_entry.pack(side="left")
+
+        between_dates_button = tk.Button(
+            button_frame, text="Between Dates", command=self.display_schedules_between_dates)
+        between_dates_button.grid(row=5, column=3, padx=10, pady=10)
+
+        this_week_button = tk.Button(
+            button_frame, text="This Week", command=self.display_schedules_this_week)
+        this_week_button.grid(row=5, column=4, padx=10, pady=10)
+
+        filter_button = tk.Button(
+            button_frame, text="Filters...", command=self.open_filter_panel)
+        filter_button.grid(row=4, column=2, padx=10, pady=10)
+
+        # Progress of the running background job, which can be cancelled
+        progress_frame = tk.Frame(root)
+        progress_frame.pack(fill=tk.X, padx=10, pady=5)
+
+        self.progress_bar = ttk.Progressbar(
+            progress_frame, orient="horizontal", mode="determinate", maximum=1.0)
+        self.progress_bar.pack(side="left", fill=tk.X, expand=True)
+
+        self.progress_label = tk.Label(progress_frame, text="", width=40, anchor="w")
+        self.progress_label.pack(side="left", padx=10)
+
+        self.cancel_button = tk.Button(
+            progress_frame, text="Cancel", command=self.cancel_job, state=tk.DISABLED)
+        self.cancel_button.pack(side="left")
+
+        # Buttons disabled while a job runs, so only one touches the data at a time
+        self.job_controls = [
+            load_button, add_folder_button, refresh_button, search_button, sort_button,
+            self.show_all_button, export_button, next_sessions_button, clash_button, filter_button,
+            between_dates_button, this_week_button
+        ]
+        self.jobs = JobRunner(root, self.show_progress, self.set_busy)
+
+        # Latest timing of the instrumented operations, see timetable_metrics.
+        # Jobs record from worker threads, so the bar polls instead of being told.
+        self.status_label = tk.Label(root, text="", anchor="w", relief=tk.SUNKEN)
+        if metrics.active():
+            self.status_label.pack(side="bottom", fill=tk.X)
+            self.update_status()
+
         # Bind header click events to sort by the selected attribute
         for col_id in self.tree["columns"]:
             self.tree.heading(
                 col_id, command=lambda c=col_id: self.sort_by_attribute(c))
 
+    def update_status(self):
+        self.status_label.config(text=metrics.status_text())
+        self.root.after(self.STATUS_INTERVAL_MS, self.update_status)
+
+    def show_progress(self, fraction, text):
+        self.progress_bar.configure(value=fraction)
+        self.progress_label.config(text=text)
+
+    def set_busy(self, busy, text, determinate):
+        state = tk.DISABLED if busy else tk.NORMAL
+        for control in self.job_controls:
+            control.config(state=state)
+        self.cancel_button.config(state=tk.NORMAL if busy else tk.DISABLED)
+
+        # Queries report no progress, so they get a moving bar instead
+        self.progress_bar.stop()
+        self.progress_bar.configure(mode="determinate" if determinate else "indeterminate", value=0)
+        if busy and not determinate:
+            self.progress_bar.start()
+        self.progress_label.config(text=text)
+
+    def cancel_job(self):
+        self.jobs.cancel()
+
     def get_loaded_data(self):
+        # Every loaded schedule, in file order
         loaded_data = []
-        for item in self.tree.get_children():
-            values = self.tree.item(item, 'values')
-            if len(values) >= 14:
-                timetable_data = TimetableData(
-                    Description=values[0],
-                    Module_Code=values[1],
-                    Study_Mode=values[2],
-                    Cohort=values[3],
-                    Allocated_Location_Name=values[4],
-                    Planned_Size=values[5],
-                    Allocated_Staff_Name=values[6],
-                    Zone_Name=values[7],
-                    Activity_Dates_Individual=values[8],
-                    Scheduled_Days=values[9],
-                    Scheduled_Start_Time=values[10],
-                    Scheduled_End_Time=values[11],
-                    Duration=values[12],
-                    Class_Type=values[13]
-                )
-                loaded_data.append(timetable_data)
+        for data in self.timetable_manager.timetable_manager.data_by_file.values():
+            loaded_data.extend(data["timetable_data_list"])
         return loaded_data
 
     def add_csv_folder(self):
@@ -480,34 +875,8 @@ class Window:
                 "No CSV Files Found", "No CSV files were found in the selected directory.\nPlease select a folder with CSV files.")
             return
 
-        self.folder_paths.append(folder_path)
-
         self.load_csv_data(folder_path)
 
-        self.folder_path_label.config(
-            text=f"Selected Folders: {', '.join(self.folder_paths)}")
-
-    def load_csv_data(self, folder_path):
-        csv_filepaths = []
-        all_files = os.listdir(folder_path)
-
-        csv_files = [file for file in all_files if file.endswith('.csv')]
-
-        if not csv_files:
-            messagebox.showerror(
-                "No CSV Files Found", "No CSV files were found in the selected directory.\nPlease select a valid folder.")
-            return
-
-        for csv_filename in csv_files:
-            csv_filepath = os.path.join(folder_path, csv_filename)
-            csv_filepaths.append(csv_filepath)
-
-        for csv_filepath in csv_filepaths:
-            self.timetable_manager.data_filter(csv_filepath)
-
-        self.loaded_data = self.get_loaded_data()
-        self.display_data()
-
     def load_csv(self):
         # Ask the user to select a directory
         directory_path = filedialog.askdirectory()
@@ -515,62 +884,101 @@ class Window:
         if not directory_path:
             return
 
-        self.folder_paths.append(directory_path)
-
-        self.folder_path_label.config(
-            text=f"Selected Folders: {', '.join(self.folder_paths)}")
-
         self.load_csv_data(directory_path)
 
     def load_csv_data(self, folder_path):
-        csv_filepaths = []
-        all_files = os.listdir(folder_path)
-
-        csv_files = [file for file in all_files if file.endswith('.csv')]
+        csv_filepaths = list_csv_files(folder_path)
 
-        if not csv_files:
+        if not csv_filepaths:
             messagebox.showerror(
                 "No CSV Files Found", "No CSV files were found in the selected directory.\nPlease select a valid folder.")
             return
 
-        for csv_filename in csv_files:
-            csv_filepath = os.path.join(folder_path, csv_filename)
-            csv_filepaths.append(csv_filepath)
+        manager = self.timetable_manager.timetable_manager
 
-        for csv_filepath in csv_filepaths:
-            self.timetable_manager.timetable_manager.data_filter(csv_filepath)
+        # Parse and index on the worker thread, data_by_file is only updated
+        # on the Tk thread once every file is ready
+        def work(job):
+            return manager.prepare_files(
+                csv_filepaths, self.workers, job.file_progress, job.cancelled)
 
-        self.loaded_data = self.get_loaded_data()
-        self.display_data()
+        def done(outcome):
+            results, prepared = outcome
+            manager.record_failures(results)
+            manager.add_files(prepared)
+            self.update_suggestions()
+
+            self.folder_paths.append(folder_path)
+            self.folder_path_label.config(
+                text=f"Selected Folders: {', '.join(self.folder_paths)}")
+
+            failed = [str(result) for result in results if result.error is not None]
+            if failed:
+                messagebox.showwarning(
+                    "Some CSV Files Failed", "The following files could not be loaded:\n" + "\n".join(failed))
+
+            self.loaded_data = self.get_loaded_data()
+            self.searched_query = None
+            self.display_data()
+
+        self.jobs.start("Loading CSV files", work, done, determinate=True)
 
     def show_all_data(self):
         self.display_data()
         self.searched_data = []
 
     def display_data(self):
-        self.tree.delete(*self.tree.get_children())
-
-        for csv_filename in self.timetable_manager.timetable_manager.data_by_file:
-            data = self.timetable_manager.timetable_manager.data_by_file[
-                csv_filename]["timetable_data_list"]
-
-            for timetable_data in data:
-                items = timetable_data.get_items()
-                self.tree.insert("", "end", values=(
-                    items["Module Name"],
-                    items["Module Code"],
-                    items["Study Mode"],
-                    items["Cohort"],
-                    items["Location"],
-                    items["Planned Size"],
-                    items["Lecturer"],
-                    items["Scheduled Date"],
-                    items["Scheduled Day"],
-                    items["Lecture Start Time"],
-                    items["Lecture End Time"],
-                    items["Duration"],
-                    items["Class Type"]
-                ))
+        self.showing_all = True
+        self.table.set_rows(self.get_loaded_data())
+
+    def refresh_data(self):
+        # Re-parse only the CSV files that changed in the loaded folders
+        manager = self.timetable_manager.timetable_manager
+        folder_paths = list(self.folder_paths)
+
+        def work(job):
+            return manager.prepare_refresh(
+                folder_paths, self.workers, job.file_progress, job.cancelled)
+
+        def done(changes):
+            if not changes:
+                return
+            manager.apply_changes(changes)
+            self.update_suggestions()
+
+            failed = [str(result) for result in changes.results if result.error is not None]
+            if failed:
+                messagebox.showwarning(
+                    "Some CSV Files Failed", "The following files could not be loaded:\n" + "\n".join(failed))
+
+            # Redraw when all schedules are shown, search and sort results are
+            # left as they are until the next query
+            self.loaded_data = self.get_loaded_data()
+            self.searched_query = None
+            if self.showing_all:
+                offset = self.table.offset
+                self.display_data()
+                self.table.scroll_to(offset)
+
+        self.jobs.start("Checking folders for changes", work, done, determinate=True)
+
+    def toggle_watch(self):
+        # Cancel any pending poll so toggling never starts a second loop
+        if self.watch_job is not None:
+            self.root.after_cancel(self.watch_job)
+            self.watch_job = None
+        if self.watch_var.get():
+            self.watch_job = self.root.after(self.WATCH_INTERVAL_MS, self.poll_folders)
+
+    def poll_folders(self):
+        self.watch_job = None
+        # Stop polling once the checkbox is cleared
+        if not self.watch_var.get():
+            return
+        # Skip this round rather than queue behind a running job
+        if not self.jobs.busy:
+            self.refresh_data()
+        self.watch_job = self.root.after(self.WATCH_INTERVAL_MS, self.poll_folders)
 
     def sort_by_attribute(self, col_id):
         # Sort the data based on the column clicked
@@ -586,74 +994,281 @@ class Window:
         sort_order = self.sort_order_var.get()
         reverse = (sort_order == "Descending")
 
-        data_to_sort = self.loaded_data if not self.searched_data else self.searched_data
+        searching = bool(self.searched_data)
+        data_to_sort = self.loaded_data if not searching else self.searched_data
+        query = self.searched_query if searching else ("all",)
 
-        # Define a key function to extract the sorting value
+        # Define a key function to extract the sorting value, using the
+        # pre-parsed integer keys for date, day and time attributes
         def key_func(item):
-            value = item[sort_attribute]
-
-            # Convert date and time strings to datetime objects for specific attributes
             if sort_attribute == 'Scheduled Date':
-                return datetime.strptime(value, "%d/%m/%Y")
+                return item.date_ordinal
             elif sort_attribute == 'Scheduled Day':
-                days_of_week = ["Monday", "Tuesday", "Wednesday",
-                                "Thursday", "Friday", "Saturday", "Sunday"]
-                return days_of_week.index(value)
-            elif sort_attribute in ['Lecture Start Time', 'Lecture End Time']:
-                return datetime.strptime(value, "%H:%M:%S")
+                return item.day_index
+            elif sort_attribute == 'Lecture Start Time':
+                return item.start_minutes
+            elif sort_attribute == 'Lecture End Time':
+                return item.end_minutes
+            elif sort_attribute == 'Duration':
+                return item.duration_minutes
             else:
-                return value
+                return item.get_display_item(sort_attribute)
+
+        show_first = self.get_show_first()
 
+        # Sort a copy on the worker thread, the shown lists only change when it is done
+        def work(job):
+            return self.timetable_manager.sort_results(
+                query, data_to_sort, sort_attribute, reverse, key_func, show_first)
+
+        def done(sorted_data):
+            if show_first is None:
+                if searching:
+                    self.searched_data = sorted_data
+                else:
+                    self.loaded_data = sorted_data
+            self.display_results(sorted_data)
+
+        self.jobs.start("Sorting", work, done)
+
+    def get_show_first(self):
+        value = self.show_first_entry.get().strip()
+        return int(value) if value.isdigit() and int(value) > 0 else None
+
+    def display_next_sessions(self):
+        # Upcoming sessions of the lecturer, location or cohort in the search box
+        field = self.criteria_var.get()
+        if field not in self.timetable_manager.timetable_manager.SESSION_FIELDS:
+            messagebox.showerror(
+                "Error", "Select Lecturer, Location or Cohort as the search criteria.")
+            return
+
+        results = self.timetable_manager.next_sessions(
+            field, self.search_entry.get(), self.get_show_first() or 10)
+        if not results:
+            messagebox.showinfo("Next Sessions", "No upcoming sessions were found.")
+            return
+
+        self.searched_data = results
+        self.searched_query = None
+        self.display_results(results)
+
+    def display_schedules_between_dates(self):
         try:
-            self.timetable_manager.heap_sort(
-                data_to_sort, reverse=reverse, key=key_func)
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+            start_ordinal, end_ordinal = (datetime.strptime(entry.get().strip(), "%d/%m/%Y").toordinal()
+                                          for entry in (self.start_date_entry, self.end_date_entry))
+        except ValueError:
+            messagebox.showerror("Error", "Enter both dates as DD/MM/YYYY.")
             return
+        self.display_schedules_between(start_ordinal, end_ordinal)
 
-        self.display_results(data_to_sort)
+    def display_schedules_this_week(self):
+        self.display_schedules_between(*week_range())
+
+    def display_schedules_between(self, start_ordinal, end_ordinal):
+        def work(job):
+            return self.timetable_manager.schedules_between(start_ordinal, end_ordinal)
+
+        def done(results):
+            self.searched_data = results
+            self.searched_query = ("between", start_ordinal, end_ordinal)
+            self.display_results(results)
+
+        self.jobs.start("Listing schedules", work, done)
 
     def display_searched_data(self):
         search_criteria = self.criteria_var.get()
         search_key = self.search_entry.get()
 
-        results = []
+        def work(job):
+            return self.timetable_manager.search(search_key, search_criteria)
 
-        for csv_filename in self.timetable_manager.timetable_manager.data_by_file:
-            results.extend(self.timetable_manager.binary_search(
-                csv_filename, search_key, search_criteria))
+        def done(results):
+            self.searched_data = results
+            self.searched_query = ("search", search_criteria, search_key)
+            self.display_results(results)
 
-        self.searched_data = results
+        self.jobs.start("Searching", work, done)
 
-        self.display_results(results)
+    def open_filter_panel(self):
+        # One panel per window, brought to the front if it is already open
+        if self.filter_panel is not None and self.filter_panel.winfo_exists():
+            self.filter_panel.lift()
+            return
+
+        panel = self.filter_panel = tk.Toplevel(self.root)
+        panel.title("Filter Schedules")
+
+        for column, text in enumerate(("Field", "Match", "Value")):
+            tk.Label(panel, text=text).grid(row=0, column=column, padx=10, pady=5)
+
+        self.filter_rows = []
+        for row in range(1, self.FILTER_ROWS + 1):
+            field_var = tk.StringVar()
+            field_dropdown = ttk.Combobox(
+                panel, textvariable=field_var, values=list(DISPLAY_FIELDS), state="readonly")
+            field_dropdown.grid(row=row, column=0, padx=10, pady=5)
+
+            match_var = tk.StringVar(value=self.FILTER_MATCHES[0])
+            match_dropdown = ttk.Combobox(
+                panel, textvariable=match_var, values=self.FILTER_MATCHES, state="readonly", width=10)
+            match_dropdown.grid(row=row, column=1, padx=10, pady=5)
+
+            value_entry = ttk.Combobox(panel, width=35)
+            value_entry.grid(row=row, column=2, padx=10, pady=5)
+            field_dropdown.bind("<<ComboboxSelected>>",
+                                lambda event, f=field_var, v=value_entry: self.filter_suggestions(f, v))
+            self.filter_rows.append((field_var, match_var, value_entry))
+
+        # Inclusive date and start time ranges, either end may be left blank
+        self.filter_range_entries = {}
+        range_labels = [
+            ("Date From (DD/MM/YYYY):", "date_from", "Date To:", "date_to"),
+            ("Starts After (HH:MM):", "start_after", "Starts Before:", "start_before")
+        ]
+        for row, (low_label, low_name, high_label, high_name) in enumerate(range_labels, self.FILTER_ROWS + 1):
+            tk.Label(panel, text=low_label).grid(row=row, column=0, padx=10, pady=5)
+            self.filter_range_entries[low_name] = tk.Entry(panel, width=12)
+            self.filter_range_entries[low_name].grid(row=row, column=1, padx=10, pady=5)
+            high_frame = tk.Frame(panel)
+            high_frame.grid(row=row, column=2, padx=10, pady=5, sticky="w")
+            tk.Label(high_frame, text=high_label).pack(side="left")
+            self.filter_range_entries[high_name] = tk.Entry(high_frame, width=12)
+            self.filter_range_entries[high_name].pack(side="left", padx=10)
+
+        button_row = self.FILTER_ROWS + len(range_labels) + 1
+        tk.Button(panel, text="Apply", command=self.apply_filters).grid(
+            row=button_row, column=1, padx=10, pady=10)
+        tk.Button(panel, text="Clear", command=self.clear_filters).grid(
+            row=button_row, column=2, padx=10, pady=10, sticky="w")
+
+    def filter_suggestions(self, field_var, value_entry):
+        trie = self.timetable_manager.timetable_manager.suggestions.get(field_var.get())
+        value_entry['values'] = trie.complete("", self.SUGGESTION_LIMIT) if trie is not None else []
+
+    def clear_filters(self):
+        for field_var, match_var, value_entry in self.filter_rows:
+            field_var.set("")
+            match_var.set(self.FILTER_MATCHES[0])
+            value_entry.set("")
+        for entry in self.filter_range_entries.values():
+            entry.delete(0, tk.END)
+
+    def get_filter_predicates(self):
+        # Predicates of the filled-in rows of the filter panel, raises ValueError
+        # for an invalid date or time
+        predicates = []
+        for field_var, match_var, value_entry in self.filter_rows:
+            field, value = field_var.get(), value_entry.get()
+            if field and value:
+                predicate_class = Contains if match_var.get() == "contains" else Equals
+                predicates.append(predicate_class(field, value))
+
+        entries = {name: entry.get().strip() for name, entry in self.filter_range_entries.items()}
+        for predicate in (range_predicate("date_ordinal", parse_date_ordinal, entries["date_from"], entries["date_to"]),
+                          range_predicate("start_minutes", parse_time_minutes,
+                                          entries["start_after"], entries["start_before"])):
+            if predicate is not None:
+                predicates.append(predicate)
+        return predicates
+
+    def apply_filters(self):
+        try:
+            predicates = self.get_filter_predicates()
+        except ValueError as e:
+            messagebox.showerror("Error", f"{e}. Use DD/MM/YYYY for dates and HH:MM for times.",
+                                 parent=self.filter_panel)
+            return
+        if not predicates:
+            messagebox.showinfo("Filters", "Fill in at least one filter.", parent=self.filter_panel)
+            return
+
+        def work(job):
+            return self.timetable_manager.filter(predicates)
+
+        def done(results):
+            self.searched_data = results
+            self.searched_query = ("filter",) + tuple(predicate.key() for predicate in predicates)
+            self.display_results(results)
+
+        self.jobs.start("Filtering", work, done)
 
     def display_results(self, results):
-        self.tree.delete(*self.tree.get_children())
+        self.showing_all = False
+        self.table.set_rows(results)
 
-        for result in results:
-            items = result.get_items()
-            self.tree.insert("", "end", values=(
-                items["Module Name"],
-                items["Module Code"],
-                items["Study Mode"],
-                items["Cohort"],
-                items["Location"],
-                items["Planned Size"],
-                items["Lecturer"],
-                items["Scheduled Date"],
-                items["Scheduled Day"],
-                items["Lecture Start Time"],
-                items["Lecture End Time"],
-                items["Duration"],
-                items["Class Type"]
+    def show_clash_report(self):
+        self.jobs.start("Finding clashes", lambda job: self.timetable_manager.find_clashes(),
+                        self.display_clash_report)
+
+    def display_clash_report(self, clashes):
+        if not clashes:
+            messagebox.showinfo("Clash Report", "No room or lecturer clashes were found.")
+            return
+
+        # List the clashes in their own window, one row per overlapping pair
+        report = tk.Toplevel(self.root)
+        report.title(f"Clash Report ({len(clashes)} clashes)")
+        report.geometry("1000x400")
+
+        columns = ("Type", "Resource", "Date", "Overlap", "Session", "Clashes With")
+        clash_tree = ttk.Treeview(report, show="headings", columns=columns)
+        for column_id, width in zip(columns, [70, 150, 80, 90, 300, 300]):
+            clash_tree.heading(column_id, text=column_id)
+            clash_tree.column(column_id, width=width)
+
+        v_scrollbar = ttk.Scrollbar(
+            report, orient="vertical", command=clash_tree.yview)
+        v_scrollbar.pack(side="right", fill="y")
+        clash_tree.configure(yscrollcommand=v_scrollbar.set)
+        clash_tree.pack(fill=tk.BOTH, expand=True)
+
+        for clash in clashes:
+            clash_tree.insert("", "end", values=(
+                clash.kind,
+                clash.resource,
+                clash.first.get_item("Activity_Dates_Individual"),
+                f"{format_minutes(clash.overlap_start)}-{format_minutes(clash.overlap_end)}",
+                clash.describe(clash.first),
+                clash.describe(clash.second)
             ))
 
     def criteria_change(self, *args):
-        selected_criteria = self.criteria_var.get()
-        search_terms = self.search_term_suggestions.get(selected_criteria, [])
-
-        self.search_entry['values'] = search_terms
         self.search_entry.set("")
+        self.update_suggestions()
+
+    def schedule_suggestions(self, event):
+        # Debounce: only filter once typing pauses, not on every keystroke
+        if event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+            return
+        if self.suggest_job is not None:
+            self.root.after_cancel(self.suggest_job)
+        self.suggest_job = self.root.after(self.SUGGEST_DELAY_MS, self.update_suggestions, True)
+
+    def update_suggestions(self, live=False):
+        self.suggest_job = None
+        search_criteria = self.criteria_var.get()
+        trie = self.timetable_manager.timetable_manager.suggestions.get(search_criteria)
+        if trie is None:
+            self.search_entry['values'] = []
+            return
+        prefix = self.search_entry.get()
+        self.search_entry['values'] = trie.complete(prefix, self.SUGGESTION_LIMIT)
+        # While typing, the table follows what has been typed so far
+        if live and prefix:
+            self.display_prefix_results(search_criteria, prefix)
+
+    def display_prefix_results(self, search_criteria, prefix):
+        def work(job):
+            return self.timetable_manager.prefix_search(prefix, search_criteria)
+
+        def done(results):
+            self.searched_data = results
+            self.searched_query = ("prefix", search_criteria, prefix.casefold())
+            self.display_results(results)
+
+        # Skipped while another job runs, the Search button still works
+        self.jobs.start("Searching", work, done)
 
     def export_data(self):
         export_format = self.export_options.get()
@@ -662,137 +1277,90 @@ class Window:
             self.export_to_excel()
         elif export_format == "PDF (.pdf)":
             self.export_to_pdf()
+        elif export_format == "PDF per Group (.zip)":
+            self.export_to_pdf_archive()
 
-    def export_to_excel(self):
-        wb = Workbook()
-        ws = wb.active
+    def get_export_group(self):
+        # Function naming the group of each row for the selected Group By option
+        group_name = self.EXPORT_GROUPS.get(self.export_group_var.get())
+        if group_name is None:
+            return None
+        return lambda item: item.get_display_item(group_name)
 
-        # Define the headers of excel
-        headers = [
-            "Module Name",
-            "Module Code",
-            "Study Mode",
-            "Cohort",
-            "Location",
-            "Planned Size",
-            "Lecturer",
-            "Scheduled Date",
-            "Scheduled Day",
-            "Lecture Start Time",
-            "Lecture End Time",
-            "Duration",
-            "Class Type"
-        ]
+    def export_to_excel(self):
+        # The export libraries are only imported once something is exported,
+        # they take longer to import than the rest of the viewer together
+        from timetable_export import write_excel
 
-        ws.append(headers)
+        excel_file = filedialog.asksaveasfilename(
+            defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx")])
+        if not excel_file:
+            return
 
         data_to_export = self.loaded_data if not self.searched_data else self.searched_data
 
-        # Iterate through the data and add it to the worksheet
-        for item in data_to_export:
-            values = item.get_items()
-            row_data = [
-                values["Module Name"],
-                values["Module Code"],
-                values["Study Mode"],
-                values["Cohort"],
-                values["Location"],
-                values["Planned Size"],
-                values["Lecturer"],
-                values["Scheduled Date"],
-                values["Scheduled Day"],
-                values["Lecture Start Time"],
-                values["Lecture End Time"],
-                values["Duration"],
-                values["Class Type"]
-            ]
-            ws.append(row_data)
+        group = self.get_export_group()
 
-        excel_file = filedialog.asksaveasfilename(
-            defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx")])
-        if excel_file:
-            wb.save(excel_file)
-            messagebox.showinfo("Export Successful",
-                                "Data has been exported to Excel successfully.")
+        # The workbook is streamed to disk on the worker thread
+        def work(job):
+            write_excel(excel_file, data_to_export, list(DISPLAY_FIELDS), display_values, group,
+                        lambda done, total: job.report(done / total, f"Exported {done} of {total} rows"),
+                        job.cancelled)
+
+        self.jobs.start("Exporting to Excel", work,
+                        lambda result: messagebox.showinfo(
+                            "Export Successful", "Data has been exported to Excel successfully."),
+                        determinate=True)
 
     def export_to_pdf(self):
-        data_to_export = self.loaded_data if not self.searched_data else self.searched_data
+        from timetable_export import write_pdf
 
         pdf_file = filedialog.asksaveasfilename(
             defaultextension=".pdf", filetypes=[("PDF files", "*.pdf")])
-
         if not pdf_file:
             return
 
-        doc = SimpleDocTemplate(pdf_file, pagesize=landscape(letter))
-        story = []
+        data_to_export = self.loaded_data if not self.searched_data else self.searched_data
+        group = self.get_export_group()
+
+        self.jobs.start("Exporting to PDF",
+                        lambda job: write_pdf(pdf_file, data_to_export, list(DISPLAY_FIELDS),
+                                              display_values, self.PDF_COLUMN_WIDTHS, group),
+                        lambda result: messagebox.showinfo(
+                            "Export Successful", "Timetable has been exported to PDF successfully."))
+
+    def export_to_pdf_archive(self):
+        from timetable_export import write_pdf_archive
+
+        group = self.get_export_group()
+        if group is None:
+            messagebox.showerror(
+                "Error", "Select how to group the schedules, one PDF is written per group.")
+            return
+
+        zip_file = filedialog.asksaveasfilename(
+            defaultextension=".zip", filetypes=[("Zip files", "*.zip")])
+        if not zip_file:
+            return
 
-        headers = [
-            "Module Name",
-            "Module Code",
-            "Study Mode",
-            "Cohort",
-            "Location",
-            "Planned Size",
-            "Lecturer",
-            "Scheduled Date",
-            "Scheduled Day",
-            "Lecture Start Time",
-            "Lecture End Time",
-            "Duration",
-            "Class Type"
-        ]
+        data_to_export = self.loaded_data if not self.searched_data else self.searched_data
 
-        col_widths = [
-            130, 40, 40, 80, 80, 40, 50, 50, 50, 60, 60, 30, 50
-        ]
+        # Each group's document is rendered in its own process
+        def work(job):
+            write_pdf_archive(zip_file, data_to_export, list(DISPLAY_FIELDS), display_values,
+                              self.PDF_COLUMN_WIDTHS, group, self.workers,
+                              lambda done, total: job.report(done / total, f"Rendered {done} of {total} PDFs"),
+                              job.cancelled)
 
-        data = [headers]
-
-        for item in data_to_export:
-            values = item.get_items()
-            row_data = [
-                values["Module Name"],
-                values["Module Code"],
-                values["Study Mode"],
-                values["Cohort"],
-                values["Location"],
-                values["Planned Size"],
-                values["Lecturer"],
-                values["Scheduled Date"],
-                values["Scheduled Day"],
-                values["Lecture Start Time"],
-                values["Lecture End Time"],
-                values["Duration"],
-                values["Class Type"]
-            ]
-            data.append(row_data)
-
-        table = Table(data, colWidths=col_widths)
-
-        # Apply table styles
-        style = TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.lightblue),
-            ('GRID', (0, 0), (-1, -1), 1, colors.white),
-            ('FONTSIZE', (0, 0), (-1, -1), 6)
-        ])
-        table.setStyle(style)
-
-        story.append(table)
-
-        story.append(PageBreak())
-
-        doc.build(story)
-        messagebox.showinfo("Export Successful",
-                            "Timetable has been exported to PDF successfully.")
+        self.jobs.start("Exporting PDFs", work,
+                        lambda result: messagebox.showinfo(
+                            "Export Successful", "Timetables have been exported to PDF successfully."),
+                        determinate=True)
 
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = Window(root)
     root.mainloop()
+    # With TIMETABLE_METRICS set, the summary goes to stderr and TIMETABLE_METRICS_FILE
+    write_report(out=sys.stderr)
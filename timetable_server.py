@@ -0,0 +1,321 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+import sys
+import time
+from http import HTTPStatus
+from itertools import islice
+from urllib.parse import parse_qsl, urlsplit
+from timetable_cache import DEFAULT_CACHE_DIR
+from timetable_metrics import metrics
+from timetable_scheduler_cli import BatchRunner, build_query_parser
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Seconds an idle keep-alive connection stays open
+KEEPALIVE_TIMEOUT = 15
+
+# Largest request head accepted, bodies are read and ignored
+MAX_HEAD_BYTES = 16 * 1024
+
+# Rows returned by one query at most, the response says when more matched
+DEFAULT_MAX_ROWS = 10000
+
+# Seconds between checks of the loaded folders for changed CSV files
+DEFAULT_WATCH_INTERVAL = 2.0
+
+# Query routes and the batch command each one runs, with the same arguments:
+#   /search?field=Cohort&term=DICT-DNDFC%20221&sort=Activity_Dates_Individual&limit=5
+#   /date-range?from=01/03/2023&to=31/03/2023
+#   /week?date=06/03/2023
+#   /query?eq=Allocated_Staff_Name:Kelvin%20Wu&eq=Scheduled_Days:Monday&starts_after=12:00
+QUERY_ROUTES = {
+    "/search": "search",
+    "/date-range": "date-range",
+    "/week": "week",
+    "/query": "query"
+}
+
+ROUTES = {"/health", "/stats", "/reload"} | set(QUERY_ROUTES)
+
+FLAG_PARAMETERS = {"reverse", "contains"}
+# FIELD:VALUE parameters of /query, given once per condition
+PAIR_PARAMETERS = {"eq", "contains"}
+VALUE_PARAMETERS = {"field", "term", "sort", "limit", "from", "to", "date", "starts_after", "starts_before"}
+
+
+def query_argv(command, params):
+    # URL parameters to the arguments of the same batch command, e.g.
+    # /search?field=Cohort&term=X&limit=5 -> search --field=Cohort --term=X --limit=5
+    argv = [command]
+    for name, value in params:
+        option = "--" + name.replace("_", "-")
+        if command == "query" and name in PAIR_PARAMETERS:
+            field, separator, value = value.partition(":")
+            if not separator:
+                raise ValueError(f"{name} takes FIELD:VALUE, got '{field}'")
+            argv.extend([option, field, value])
+        elif name in FLAG_PARAMETERS:
+            if value.lower() in ("", "1", "true", "yes"):
+                argv.append(option)
+        elif name in VALUE_PARAMETERS:
+            argv.append(f"{option}={value}")
+        else:
+            raise ValueError(f"unknown parameter '{name}'")
+    return argv
+
+
+def check_loopback(host):
+    # The server has no authentication, so it only listens on this machine
+    if host == "localhost":
+        return
+    try:
+        if ipaddress.ip_address(host).is_loopback:
+            return
+    except ValueError:
+        pass
+    raise ValueError(f"{host} is not a loopback address, use 127.0.0.1, ::1 or localhost")
+
+
+class BadRequest(Exception):
+    pass
+
+
+# HTTP/1.1 JSON server answering queries from one in-memory load of the folders.
+# Requests are answered on the event loop, so each query sees one consistent
+# generation of the data; reloads parse on a worker thread and swap in between.
+class TimetableServer:
+    def __init__(self, directories, workers=None, cache_dir=DEFAULT_CACHE_DIR,
+                 max_rows=DEFAULT_MAX_ROWS, watch_interval=DEFAULT_WATCH_INTERVAL, access_log=False):
+        self.runner = BatchRunner(directories, workers, cache_dir)
+        self.query_parser = build_query_parser()
+        self.max_rows = max_rows
+        self.watch_interval = watch_interval
+        self.access_log = access_log
+        self.requests = 0
+        self.connections = 0
+        self.started = time.time()
+        self.reload_lock = None
+
+    @property
+    def data_manager(self):
+        return self.runner.timetable_manager.data_manager
+
+    def load(self):
+        return self.runner.load()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+        check_loopback(host)
+        self.reload_lock = asyncio.Lock()
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEAD_BYTES)
+        watcher = asyncio.create_task(self.watch()) if self.watch_interval else None
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+    async def watch(self):
+        # Hot reload: re-parse only the CSV files changed since they were loaded
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                await self.reload()
+            except OSError as e:
+                print(f"Reload failed: {e}", file=sys.stderr)
+
+    async def reload(self):
+        async with self.reload_lock:
+            loop = asyncio.get_running_loop()
+            changes = await loop.run_in_executor(
+                None, self.data_manager.prepare_refresh, self.runner.directories, self.runner.workers)
+            # Swapped in on the event loop, so no request sees half a reload
+            self.data_manager.apply_changes(changes)
+            if changes:
+                print(f"Reloaded CSV files: {changes}", file=sys.stderr)
+            return changes
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), KEEPALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except (BadRequest, asyncio.LimitOverrunError, ValueError) as e:
+                    await self.send(writer, "GET", 400, {"error": str(e) or "bad request"}, False, 0.0)
+                    break
+                if request is None:
+                    break
+
+                method, target, keep_alive = request
+                start = time.perf_counter()
+                try:
+                    status, payload = await self.dispatch(method, target)
+                except Exception as e:
+                    # A failing query must not take the connection or the server down
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                elapsed = time.perf_counter() - start
+                self.requests += 1
+                path = urlsplit(target).path
+                metrics.record("http." + (path.strip("/") if path in ROUTES else "unknown"), elapsed)
+                if self.access_log:
+                    print(f'{peer[0]} "{method} {target}" {status} {elapsed * 1000:.1f}ms', file=sys.stderr)
+                await self.send(writer, method, status, payload, keep_alive, elapsed)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def read_request(self, reader):
+        # (method, target, keep_alive) of the next request, or None when the client closed
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise BadRequest("malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            name, separator, value = line.partition(":")
+            if separator:
+                headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length") or 0)
+        if length:
+            await reader.readexactly(length)
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return method, target, keep_alive
+
+    async def send(self, writer, method, status, payload, keep_alive, elapsed):
+        body = json.dumps(payload).encode()
+        head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                f"X-Response-Time-Ms: {elapsed * 1000:.3f}\r\n\r\n")
+        writer.write(head.encode() + (body if method != "HEAD" else b""))
+        await writer.drain()
+
+    async def dispatch(self, method, target):
+        url = urlsplit(target)
+        params = parse_qsl(url.query, keep_blank_values=True)
+        if url.path == "/reload":
+            if method != "POST":
+                return 405, {"error": "use POST to reload"}
+            changes = await self.reload()
+            return 200, {"changes": str(changes), "generation": self.data_manager.generation}
+
+        if method not in ("GET", "HEAD"):
+            return 405, {"error": f"{method} is not supported"}
+        if url.path == "/health":
+            return 200, self.health()
+        if url.path == "/stats":
+            return 200, self.stats()
+        command = QUERY_ROUTES.get(url.path)
+        if command is None:
+            return 404, {"error": f"no route {url.path}", "routes": sorted(ROUTES)}
+        try:
+            return 200, self.run_query(command, params)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+
+    def run_query(self, command, params):
+        start = time.perf_counter()
+        args = self.query_parser.parse_args(query_argv(command, params))
+        rows = list(islice(self.runner.query(args), self.max_rows + 1))
+        truncated = len(rows) > self.max_rows
+        rows = rows[:self.max_rows]
+        return {
+            "count": len(rows),
+            "truncated": truncated,
+            "generation": self.data_manager.generation,
+            "ms": round((time.perf_counter() - start) * 1000, 3),
+            "rows": [row.get_items() for row in rows]
+        }
+
+    def health(self):
+        data_by_file = self.data_manager.data_by_file
+        return {
+            "files": len(data_by_file),
+            "rows": sum(len(data["store"]) for data in data_by_file.values()),
+            "generation": self.data_manager.generation
+        }
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "open_connections": self.connections,
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "query_cache": str(self.runner.timetable_manager.query_cache),
+            **metrics.to_dict()
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve timetable queries as JSON over HTTP on this machine, loading the CSV files once.")
+    parser.add_argument("--dir", dest="directories", action="append", required=True,
+                        help="directory of CSV files to load, may be given more than once")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"loopback address to listen on (default {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port (default {DEFAULT_PORT})")
+    parser.add_argument("--workers", type=int, help="processes used to parse the CSV files")
+    parser.add_argument("--no-cache", action="store_true", help="always re-parse the CSV files")
+    parser.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS,
+                        help=f"rows returned per query at most (default {DEFAULT_MAX_ROWS})")
+    parser.add_argument("--watch-interval", type=float, default=DEFAULT_WATCH_INTERVAL,
+                        help=f"seconds between checks for changed CSV files, 0 turns hot reload off "
+                             f"(default {DEFAULT_WATCH_INTERVAL})")
+    parser.add_argument("--access-log", action="store_true", help="print one line per request to stderr")
+    args = parser.parse_args()
+
+    try:
+        check_loopback(args.host)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Request timings are kept for /stats
+    metrics.enabled = True
+    server = TimetableServer(args.directories, args.workers, None if args.no_cache else DEFAULT_CACHE_DIR,
+                             args.max_rows, args.watch_interval, args.access_log)
+    try:
+        for result in server.load():
+            print(result, file=sys.stderr)
+    except OSError as e:
+        parser.error(str(e))
+
+    def ready(listener):
+        for sock in listener.sockets:
+            host, port = sock.getsockname()[:2]
+            print(f"Serving {server.health()['rows']} rows on http://{host}:{port}", file=sys.stderr)
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import os
+import sqlite3
+from datetime import datetime
+from itertools import repeat
+from timetable_cache import DEFAULT_CACHE_DIR, file_signature
+from timetable_keys import INVALID_KEY
+from timetable_loader import LoadResult, load_stores
+from timetable_metrics import metrics, timed
+from timetable_query import Contains, Equals, Range
+from timetable_store import FIELDS, KEY_COLUMNS, TimetableRow, TimetableStore, row_views
+
+
+# Bump whenever the tables change, older databases are rebuilt on open
+SQLITE_SCHEMA_VERSION = 2
+
+DEFAULT_DB_PATH = os.path.join(DEFAULT_CACHE_DIR, "timetable.sqlite3")
+
+# Rows of every file: the raw fields, the pre-parsed sort keys, and the file
+# and CSV row they came from so results keep the in-memory backend's order
+SCHEDULE_COLUMNS = FIELDS + tuple(KEY_COLUMNS)
+
+# Indexed lookups: lecturer, room, date, day and module code
+INDEXES = {
+    "schedules_lecturer": "Allocated_Staff_Name",
+    "schedules_location": "Allocated_Location_Name",
+    "schedules_date": "date_ordinal, start_minutes",
+    "schedules_day": "Scheduled_Days",
+    "schedules_module": "Module_Code"
+}
+
+# Order of the in-memory searches: file by file in load order, CSV rows in order
+FILE_ORDER = "position, row"
+
+# Order of the datetime index: date, start time (rows without one first), then file and row
+CHRONOLOGICAL_ORDER = "date_ordinal, max(start_minutes, 0), position, row"
+
+# --sort columns, the date and time fields sort by their pre-parsed keys as in SORT_KEYS
+SORT_COLUMNS = {
+    "Activity_Dates_Individual": ("date_ordinal", "start_minutes"),
+    "Scheduled_Days": ("day_index",),
+    "Scheduled_Start_Time": ("start_minutes",),
+    "Scheduled_End_Time": ("end_minutes",),
+    "Duration": ("duration_minutes",)
+}
+
+
+def sort_order(field, reverse=False, tie_order=FILE_ORDER):
+    # ORDER BY clause for --sort. Ties keep the unsorted order, as top_k does
+    if field not in FIELDS:
+        raise ValueError(f"unknown field '{field}'")
+    direction = " DESC" if reverse else ""
+    columns = SORT_COLUMNS.get(field, (field,))
+    return ", ".join(column + direction for column in columns) + ", " + tie_order
+
+
+def predicate_sql(predicate):
+    # WHERE condition and parameters of one timetable_query predicate. Field
+    # names are checked against FIELDS, they cannot be passed as parameters.
+    if isinstance(predicate, Range):
+        if predicate.key_column not in KEY_COLUMNS:
+            raise ValueError(f"unknown key column '{predicate.key_column}'")
+        conditions, params = [f"{predicate.key_column} != ?"], [INVALID_KEY]
+        if predicate.low is not None:
+            conditions.append(f"{predicate.key_column} >= ?")
+            params.append(predicate.low)
+        if predicate.high is not None:
+            conditions.append(f"{predicate.key_column} <= ?")
+            params.append(predicate.high)
+        return " AND ".join(conditions), params
+    if predicate.field not in FIELDS:
+        raise ValueError(f"unknown field '{predicate.field}'")
+    if isinstance(predicate, Equals):
+        return f"{predicate.field} = ?", [predicate.value]
+    if isinstance(predicate, Contains):
+        # instr() is case-sensitive like 'in', LIKE would not be
+        return f"instr({predicate.field}, ?) > 0", [predicate.term]
+    raise ValueError(f"unsupported predicate {type(predicate).__name__}")
+
+
+# Optional storage backend keeping the parsed schedules in a local SQLite file
+# instead of in memory. Searches, date ranges and sorts run as indexed SQL
+# queries and return the same rows, in the same order, as the in-memory
+# DataManager. The database persists between runs, so unchanged files are
+# not parsed again.
+class SqliteBackend:
+    def __init__(self, db_path=DEFAULT_DB_PATH, row_class=TimetableRow):
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        # Row view class of the results, e.g. the CLI's TimetableData
+        self.row_class = row_class
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.create_schema()
+        # Bumped whenever the stored files change, like DataManager.generation
+        self.generation = 0
+
+    def close(self):
+        self.connection.close()
+
+    def create_schema(self):
+        connection = self.connection
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SQLITE_SCHEMA_VERSION:
+            connection.executescript("DROP TABLE IF EXISTS schedules; DROP TABLE IF EXISTS files;")
+        key_columns = "".join(f", {key_column} INTEGER NOT NULL" for key_column in KEY_COLUMNS)
+        field_columns = "".join(f", {field} TEXT NOT NULL" for field in FIELDS)
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, "
+                "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, position INTEGER)")
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS schedules (file_id INTEGER NOT NULL, row INTEGER NOT NULL"
+                f"{field_columns}{key_columns}, PRIMARY KEY (file_id, row)) WITHOUT ROWID")
+            for name, columns in INDEXES.items():
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON schedules ({columns})")
+            connection.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+
+    def file_ids(self):
+        # Stored file paths -> ids, in load order
+        return dict(self.connection.execute("SELECT path, id FROM files ORDER BY position, id"))
+
+    @property
+    def csv_filenames(self):
+        return list(self.file_ids())
+
+    def row_count(self):
+        return self.connection.execute("SELECT count(*) FROM schedules").fetchone()[0]
+
+    @timed("sqlite.load")
+    def load_files(self, csv_filepaths, workers=None, replace=False):
+        # Parse the new and modified files in parallel and ingest them, the
+        # unchanged ones are served from the database. With replace=True the
+        # stored files that are not listed are dropped.
+        csv_filepaths = list(dict.fromkeys(csv_filepaths))
+        stored = {path: (size, mtime_ns) for path, size, mtime_ns
+                  in self.connection.execute("SELECT path, size, mtime_ns FROM files")}
+        if replace:
+            for csv_filename in set(stored) - set(csv_filepaths):
+                self.remove_file(csv_filename)
+
+        results, stale = {}, []
+        for csv_filepath in csv_filepaths:
+            try:
+                signature = file_signature(csv_filepath)
+            except OSError:
+                signature = None
+            if signature is not None and stored.get(csv_filepath) == signature:
+                result = LoadResult(csv_filepath, signature=signature)
+                result.rows = self.connection.execute(
+                    "SELECT count(*) FROM schedules JOIN files ON files.id = file_id WHERE path = ?",
+                    (csv_filepath,)).fetchone()[0]
+                result.cached = True
+                results[csv_filepath] = result
+            else:
+                stale.append(csv_filepath)
+
+        for result in load_stores(stale, workers):
+            if result.error is None:
+                self.ingest(result.csv_filename, result.store, result.signature)
+            elif result.csv_filename in stored:
+                # Drop the rows of a file that can no longer be read, as the
+                # memory backend does not load it either
+                self.remove_file(result.csv_filename)
+            results[result.csv_filename] = result
+        self.set_positions(csv_filepaths, replace)
+        return [results[csv_filepath] for csv_filepath in csv_filepaths]
+
+    def set_positions(self, csv_filepaths, replace):
+        # Files are searched in load order, like the keys of data_by_file: with
+        # replace=True in the listed order, otherwise the new files go after
+        # the stored ones. Ties never fall back to the file ids, which keep
+        # the order of the first load.
+        with self.connection as connection:
+            if replace:
+                connection.executemany("UPDATE files SET position = ? WHERE path = ?",
+                                       enumerate(csv_filepaths))
+            else:
+                start = connection.execute("SELECT coalesce(max(position) + 1, 0) FROM files").fetchone()[0]
+                connection.executemany("UPDATE files SET position = ? WHERE path = ? AND position IS NULL",
+                                       enumerate(csv_filepaths, start))
+
+    def ingest(self, csv_filename, store, signature):
+        # Replace one file's rows in a single transaction with one bulk insert
+        size, mtime_ns = signature
+        with metrics.timer("sqlite.ingest"), self.connection as connection:
+            row = connection.execute("SELECT id FROM files WHERE path = ?", (csv_filename,)).fetchone()
+            if row is None:
+                file_id = connection.execute("INSERT INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+                                             (csv_filename, size, mtime_ns)).lastrowid
+            else:
+                file_id = row[0]
+                connection.execute("DELETE FROM schedules WHERE file_id = ?", (file_id,))
+                connection.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE id = ?",
+                                   (size, mtime_ns, file_id))
+            columns = [store.columns[field] for field in FIELDS]
+            columns += [getattr(store, key_column) for key_column in KEY_COLUMNS]
+            placeholders = ", ".join("?" * (len(SCHEDULE_COLUMNS) + 2))
+            connection.executemany(
+                f"INSERT INTO schedules (file_id, row, {', '.join(SCHEDULE_COLUMNS)}) VALUES ({placeholders})",
+                zip(repeat(file_id), store.row_ids, *columns))
+        metrics.count("sqlite.rows", len(store))
+        self.generation += 1
+
+    def remove_file(self, csv_filename):
+        with self.connection as connection:
+            connection.execute("DELETE FROM schedules WHERE file_id = (SELECT id FROM files WHERE path = ?)",
+                               (csv_filename,))
+            connection.execute("DELETE FROM files WHERE path = ?", (csv_filename,))
+        self.generation += 1
+
+    def file_id(self, csv_filename):
+        row = self.connection.execute("SELECT id FROM files WHERE path = ?", (csv_filename,)).fetchone()
+        if row is None:
+            raise KeyError(csv_filename)
+        return row[0]
+
+    @timed("sqlite.select")
+    def select(self, where=(), params=(), order=FILE_ORDER, limit=None):
+        # Rows matching every WHERE condition, as row views over one result store
+        sql = f"SELECT {', '.join(FIELDS)} FROM schedules JOIN files ON files.id = file_id"
+        if where:
+            sql += " WHERE " + " AND ".join(f"({condition})" for condition in where)
+        sql += " ORDER BY " + order
+        params = list(params)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        store = TimetableStore()
+        for values in self.connection.execute(sql, params):
+            store.append(values)
+        return row_views(store, self.row_class)
+
+    def find(self, predicates=(), order=FILE_ORDER, limit=None, csv_filename=None):
+        # Rows matching every predicate, of one file or of all of them
+        where, params = [], []
+        if csv_filename is not None:
+            where.append("file_id = ?")
+            params.append(self.file_id(csv_filename))
+        for predicate in predicates:
+            condition, condition_params = predicate_sql(predicate)
+            where.append(condition)
+            params.extend(condition_params)
+        return self.select(where, params, order, limit)
+
+    def binary_search(self, csv_filename, search_key, search_criteria):
+        return self.find([Equals(search_criteria, search_key)], csv_filename=csv_filename)
+
+    def binary_search_all(self, search_key, search_criteria):
+        # Exact-match lookup across every stored file
+        return self.find([Equals(search_criteria, search_key)])
+
+    def substring_search(self, csv_filename, field, term):
+        return self.find([Contains(field, term)], csv_filename=csv_filename)
+
+    def list_schedules_by_module_name(self, csv_filename, module_name):
+        return self.substring_search(csv_filename, "Description", module_name)
+
+    def list_schedules_by_lecturer_name(self, csv_filename, lecturer_name):
+        return self.substring_search(csv_filename, "Allocated_Staff_Name", lecturer_name)
+
+    def list_schedules_by_date_range(self, csv_filename, start_date, end_date):
+        start_date = datetime.strptime(start_date, "%d/%m/%Y").toordinal()
+        end_date = datetime.strptime(end_date, "%d/%m/%Y").toordinal()
+        return self.find([Range("date_ordinal", start_date, end_date)], CHRONOLOGICAL_ORDER,
+                         csv_filename=csv_filename)
+
+    def list_schedules_by_location(self, csv_filename, location_name):
+        return self.substring_search(csv_filename, "Allocated_Location_Name", location_name)
+
+    def list_schedules_by_specific_time(self, csv_filename, specific_time):
+        return self.substring_search(csv_filename, "Scheduled_Start_Time", specific_time)
+
+    def list_schedules_by_duration(self, csv_filename, duration):
+        return self.substring_search(csv_filename, "Duration", duration)
+
+    def list_schedules_by_day(self, csv_filename, day):
+        return self.substring_search(csv_filename, "Scheduled_Days", day)
+
+    def schedules_between(self, start_ordinal, end_ordinal, limit=None):
+        # Schedules of every file from the start date to the end date inclusive, in chronological order
+        return self.find([Range("date_ordinal", start_ordinal, end_ordinal)], CHRONOLOGICAL_ORDER, limit)
+
+    def sorted_schedules(self, predicates=(), sort="Activity_Dates_Individual", reverse=False, limit=None):
+        # Sorted (and limited) in SQL, the same rows as top_k for the same key
+        return self.find(predicates, sort_order(sort, reverse), limit)
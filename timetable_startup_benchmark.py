@@ -0,0 +1,79 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+# Timed in a fresh interpreter per run, so modules imported by an earlier run
+# never hide the import cost. Prints one "phase seconds" line per phase.
+STARTUP_SCRIPT = """
+import sys
+import time
+start = time.perf_counter()
+import tkinter as tk
+import timetable_scheduler_gui
+print("import", time.perf_counter() - start)
+print("export_libraries_loaded", int("openpyxl" in sys.modules or "reportlab" in sys.modules))
+if sys.argv[1] == "import":
+    sys.exit()
+
+root = tk.Tk()
+print("tk_root", time.perf_counter() - start)
+timetable_scheduler_gui.Window(root, cache_dir=None)
+print("window", time.perf_counter() - start)
+# Process the pending map, configure and draw events: the first paint
+root.update()
+print("first_paint", time.perf_counter() - start)
+root.destroy()
+"""
+
+PHASES = ("import", "tk_root", "window", "first_paint")
+
+
+def has_display():
+    if os.name == "nt" or sys.platform == "darwin":
+        return True
+    return bool(os.environ.get("DISPLAY"))
+
+
+def run_once(mode):
+    # Seconds since interpreter start for each phase of one cold start
+    completed = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, mode],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True)
+    timings = {}
+    for line in completed.stdout.splitlines():
+        phase, value = line.split()
+        timings[phase] = float(value)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure cold start of the timetable viewer: import time and time to first paint.")
+    parser.add_argument("--runs", type=int, default=10, help="cold starts to time (default 10)")
+    parser.add_argument("--import-only", action="store_true",
+                        help="only time the import, e.g. on machines without a display")
+    args = parser.parse_args()
+
+    # Without a display Tk cannot create a window, run under Xvfb to get the paint phases:
+    #   xvfb-run python timetable_startup_benchmark.py
+    mode = "import" if args.import_only or not has_display() else "paint"
+    if mode == "import" and not args.import_only:
+        print("No display found, timing the import only (run under xvfb-run for the paint phases)")
+
+    runs = [run_once(mode) for _ in range(args.runs)]
+
+    print(f"{'phase':<12} {'median ms':>10} {'min ms':>10} {'max ms':>10}")
+    for phase in PHASES:
+        values = [timings[phase] * 1000 for timings in runs if phase in timings]
+        if values:
+            print(f"{phase:<12} {statistics.median(values):>10.1f} {min(values):>10.1f} {max(values):>10.1f}")
+    if any(timings["export_libraries_loaded"] for timings in runs):
+        print("Warning: openpyxl or reportlab was imported at startup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import csv
+from array import array
+from timetable_keys import (parse_date_ordinal, parse_time_minutes,
+                            parse_duration_minutes, parse_day_index)
+
+
+# Raw timetable fields, in TimetableData constructor order
+FIELDS = (
+    "Description",
+    "Module_Code",
+    "Study_Mode",
+    "Cohort",
+    "Allocated_Location_Name",
+    "Planned_Size",
+    "Allocated_Staff_Name",
+    "Zone_Name",
+    "Activity_Dates_Individual",
+    "Scheduled_Days",
+    "Scheduled_Start_Time",
+    "Scheduled_End_Time",
+    "Duration",
+    "Class_Type"
+)
+
+# Pre-parsed integer sort keys: key column -> (source field, parser)
+KEY_COLUMNS = {
+    "date_ordinal": ("Activity_Dates_Individual", parse_date_ordinal),
+    "start_minutes": ("Scheduled_Start_Time", parse_time_minutes),
+    "end_minutes": ("Scheduled_End_Time", parse_time_minutes),
+    "day_index": ("Scheduled_Days", parse_day_index),
+    "duration_minutes": ("Duration", parse_duration_minutes)
+}
+
+
+def parse_csv_row(column):
+    # Split one CSV row into a tuple of FIELDS values, or None for rows that
+    # are not timetable activities (e.g. the header)
+    name = column[1]
+    parts = name.split("_")
+    # Check if there are enough parts before accessing indices. Prevent (IndexError: list index out of range)
+    if len(parts) < 2:
+        return None
+    return (
+        column[2],                  # Description
+        parts[3],                   # Module_Code
+        parts[2],                   # Study_Mode
+        parts[0] + " " + parts[1],  # Cohort
+        column[8],                  # Allocated_Location_Name
+        column[9],                  # Planned_Size
+        column[10],                 # Allocated_Staff_Name
+        column[11],                 # Zone_Name
+        column[3],                  # Activity_Dates_Individual
+        column[4],                  # Scheduled_Days
+        column[5],                  # Scheduled_Start_Time
+        column[6],                  # Scheduled_End_Time
+        column[7],                  # Duration
+        parts[4]                    # Class_Type
+    )
+
+
+# Column-oriented storage for the rows of one CSV file
+class TimetableStore:
+    def __init__(self):
+        # One list of strings per field, repeated values share one string object
+        self.columns = {field: [] for field in FIELDS}
+        # One int array per pre-parsed sort key
+        for key_column in KEY_COLUMNS:
+            setattr(self, key_column, array('i'))
+        self._interned = {}
+        self._column_lists = [self.columns[field] for field in FIELDS]
+        # (key array, index of the source field, parser, cache of parsed values)
+        self._key_specs = [
+            (getattr(self, key_column), FIELDS.index(field), parser, {})
+            for key_column, (field, parser) in KEY_COLUMNS.items()
+        ]
+
+    def __len__(self):
+        return len(self.columns["Description"])
+
+    @property
+    def row_ids(self):
+        return range(len(self))
+
+    def append(self, values):
+        # Append one row given as a tuple in FIELDS order, returns its row id
+        interned = self._interned
+        for column, value in zip(self._column_lists, values):
+            column.append(interned.setdefault(value, value))
+
+        # Parse each distinct source string only once per store
+        for key_array, source_index, parser, parsed in self._key_specs:
+            source = values[source_index]
+            key = parsed.get(source)
+            if key is None:
+                key = parsed[source] = parser(source)
+            key_array.append(key)
+
+        return len(self) - 1
+
+    def row_values(self, row):
+        return tuple(self.columns[field][row] for field in FIELDS)
+
+    @classmethod
+    def from_csv(cls, csv_filename):
+        store = cls()
+        with open(csv_filename, 'r') as csv_file:
+            for column in csv.reader(csv_file):
+                values = parse_csv_row(column)
+                if values is not None:
+                    store.append(values)
+        return store
+
+
+# Lightweight view of one row of a TimetableStore
+class TimetableRow:
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, *values):
+        # Standalone rows (not loaded from a CSV) get a single-row store
+        store = TimetableStore()
+        self._store = store
+        self._row = store.append(values)
+
+    @classmethod
+    def from_store(cls, store, row):
+        view = cls.__new__(cls)
+        view._store = store
+        view._row = row
+        return view
+
+    def get_item(self, field):
+        # Read a single raw field without building the get_items() dict
+        return self._store.columns[field][self._row]
+
+    @property
+    def date_ordinal(self):
+        return self._store.date_ordinal[self._row]
+
+    @property
+    def start_minutes(self):
+        return self._store.start_minutes[self._row]
+
+    @property
+    def end_minutes(self):
+        return self._store.end_minutes[self._row]
+
+    @property
+    def day_index(self):
+        return self._store.day_index[self._row]
+
+    @property
+    def duration_minutes(self):
+        return self._store.duration_minutes[self._row]
+
+
+def row_views(store, view_class):
+    # Build one view per row of the store
+    from_store = view_class.from_store
+    return [from_store(store, row) for row in store.row_ids]
@@ -0,0 +1,51 @@
+import csv
+import time
+from itertools import islice
+from timetable_keys import parse_date_ordinal
+from timetable_loader import LoadResult
+from timetable_store import FIELDS, parse_csv_row
+
+
+# Generator stages for reading, filtering and limiting timetable records one
+# row at a time. Records are tuples in FIELDS order, so memory use does not
+# grow with the size of the CSV files.
+def iter_records(csv_filename):
+    with open(csv_filename, 'r') as csv_file:
+        for column in csv.reader(csv_file):
+            values = parse_csv_row(column)
+            if values is not None:
+                yield values
+
+
+def iter_files(csv_filenames, on_error=None):
+    # Records of every file in turn. A file that cannot be read or parsed is
+    # passed to on_error as a failed LoadResult and the next file is read; the
+    # rows read before the error have already been produced.
+    for csv_filename in csv_filenames:
+        start = time.perf_counter()
+        try:
+            yield from iter_records(csv_filename)
+        except (OSError, ValueError, IndexError, csv.Error) as e:
+            if on_error is None:
+                raise
+            on_error(LoadResult(csv_filename, seconds=time.perf_counter() - start, error=str(e)))
+
+
+def matching(records, field, term, exact=False):
+    # Same comparison as binary_search (exact) or list_schedules_by_* (substring)
+    index = FIELDS.index(field)
+    if exact:
+        return (values for values in records if values[index] == term)
+    return (values for values in records if term in values[index])
+
+
+def in_date_range(records, start_ordinal, end_ordinal):
+    # Same inclusive comparison as list_schedules_by_date_range
+    index = FIELDS.index("Activity_Dates_Individual")
+    return (values for values in records
+            if start_ordinal <= parse_date_ordinal(values[index]) <= end_ordinal)
+
+
+def limited(records, limit=None):
+    # Stop reading the files as soon as 'limit' records have been produced
+    return records if limit is None else islice(records, limit)